@@ -89,6 +89,142 @@ DATA_DIR = BASE_DIR / "data"
 RAW_CORPUS_DIR = DATA_DIR / "raw_corpus"
 TEXT_CORPUS_DIR = DATA_DIR / "text_corpus"
 CHUNKED_CORPUS_DIR = DATA_DIR / "chunked_corpus"
+EMBEDDING_INDEX_DIR = CHUNKED_CORPUS_DIR / "index"
+BM25_INDEX_DIR = CHUNKED_CORPUS_DIR / "bm25"
+LEGACY_EMBEDDINGS_PATH = CHUNKED_CORPUS_DIR / "embedded_chunks.pkl"
+
+# Vector search: ANN index built after embedding ('none', 'exact', 'ivf_flat', 'pq' or
+# 'reduced'), IVF list count (None = sqrt of the chunk count) and lists probed per query.
+# 'reduced' scans ANN_REDUCED_DIM-dimensional projections ('pca' or Matryoshka-style
+# 'prefix' truncation) and re-scores the best ANN_SHORTLIST rows with the full vectors.
+# SEARCH_MODE is 'exact' (full scan), 'auto' (ANN when available), 'ann', 'hybrid' (dense
+# + BM25 fused with reciprocal rank fusion) or 'hybrid_pruned' (dense scoring limited to
+# the BM25_CANDIDATES rows BM25 returns). ANN is approximate, so it is opt-in: measure
+# recall@k on your index with `python ann_index.py --index ...` before switching to 'auto'.
+ANN_INDEX_TYPE = 'ivf_flat'
+ANN_NLIST = None
+ANN_NPROBE = 8
+ANN_REDUCED_DIM = 64
+ANN_REDUCED_PROJECTION = 'pca'
+ANN_SHORTLIST = 100
+SEARCH_MODE = 'exact'
+BM25_CANDIDATES = 200
+RRF_K = 60
+
+# Sharded exact search: number of long-lived worker processes the embedding matrix is
+# split across (0 = search in the web process) and BLAS threads per worker. Keeping
+# SEARCH_SHARD_THREADS low stops the workers from fighting the LLM's torch threads.
+SEARCH_SHARDS = int(os.environ.get('ARCHIVEBOT_SEARCH_SHARDS', 0))
+SEARCH_SHARD_THREADS = 1
+
+# Maximal marginal relevance: retrieve MMR_FETCH_K candidates and keep the top_k that
+# trade relevance (weight MMR_LAMBDA) against similarity to the chunks already picked.
+# /api/query can override all three with mmr, mmr_lambda and fetch_k
+MMR_ENABLED = False
+MMR_LAMBDA = 0.5
+MMR_FETCH_K = 20
+
+# Cross-encoder reranking: RERANK_CANDIDATES retrieved chunks are rescored in one batched
+# pass and the best top_k kept. A pass slower than RERANK_TIME_BUDGET_MS is abandoned and
+# the dense order used instead. /api/query can override RERANK_ENABLED with rerank
+RERANK_ENABLED = False
+RERANK_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+RERANK_CANDIDATES = 20
+RERANK_TIME_BUDGET_MS = 400
+
+# Model loaded in the background at server start (e.g. 'TinyLlama/TinyLlama-1.1B-Chat-v1.0'),
+# followed by a warm-up generation and search. None = wait for /api/load_model
+LLM_PRELOAD_MODEL = os.environ.get('ARCHIVEBOT_PRELOAD_MODEL')
+
+# CPU inference for the LLM: 'fp32', 'int8' (dynamic quantization of the linear layers,
+# about a quarter of the fp32 weight memory) or 'bf16' (only used when the CPU has native
+# bf16 instructions). int8 and bf16 change the model's output, so compare them with
+# scripts/benchmark_llm.py before opting in.
+# LLM_NUM_THREADS = None uses every core not reserved for search shards
+LLM_CPU_MODE = os.environ.get('ARCHIVEBOT_LLM_CPU_MODE', 'fp32')
+LLM_NUM_THREADS = None
+
+# Assisted (speculative) decoding: a much smaller model with a compatible tokenizer
+# (e.g. 'JackFram/llama-68m' for TinyLlama) drafts tokens that the main model verifies
+# in one forward pass. Requests then run one at a time instead of being batched.
+# /api/load_model accepts draft_model to override this. None = plain sampling
+LLM_DRAFT_MODEL = os.environ.get('ARCHIVEBOT_DRAFT_MODEL')
+
+# Shared model server: with MODEL_SERVER_SOCKET set, the LLM and the search index live in one
+# long-running process (python manage.py run_model_server) and every Django worker talks to it
+# over this Unix socket instead of loading its own copy. None = each web process loads its own
+MODEL_SERVER_SOCKET = os.environ.get('ARCHIVEBOT_MODEL_SERVER_SOCKET')
+# Key both ends authenticate with (HMAC challenge); None = SECRET_KEY, which must then not be
+# the default: the socket carries pickled messages and the server refuses to start otherwise
+MODEL_SERVER_AUTHKEY = os.environ.get('ARCHIVEBOT_MODEL_SERVER_AUTHKEY')
+# Seconds a worker waits for a reply, and keeps retrying to connect while a server (re)starts
+MODEL_SERVER_TIMEOUT = 300
+MODEL_SERVER_CONNECT_TIMEOUT = 10
+# Idle connections each worker keeps open to the server
+MODEL_SERVER_MAX_IDLE_CONNECTIONS = 8
+# Seconds in-flight requests get to finish when the server stops or is replaced by a new one
+MODEL_SERVER_DRAIN_SECONDS = 60
+
+# Continuous batching: concurrent queries are decoded together, up to this many per
+# forward pass, joining and leaving the batch as they start and finish (0 or 1 = the
+# plain one-request-at-a-time transformers pipeline). Off until
+# `python -m rag_app.llm_interface --check-equivalence` passes for the deployed model
+LLM_MAX_BATCH_SIZE = 1
+
+# Prefix KV cache: attention keys/values of recently seen prompt prefixes (the RAG
+# scaffold plus retrieved documents), reused so repeated contexts skip most of the
+# prefill. Prefixes are matched in blocks of PREFIX_CACHE_BLOCK_TOKENS (0 MB = disabled,
+# the plain transformers pipeline). Off until
+# `python -m rag_app.llm_interface --check-equivalence` passes for the deployed model
+PREFIX_CACHE_MAX_MB = 0
+PREFIX_CACHE_BLOCK_TOKENS = 32
+
+# Context packing: retrieved chunks are added to the prompt by LLM token count until the
+# model's context window minus max_new_tokens is used up, the last one cut at a sentence
+# boundary. RAG_MAX_CONTEXT_TOKENS additionally caps the document tokens to bound
+# prefill time (None = only the context window limits it)
+RAG_MAX_CONTEXT_TOKENS = None
+
+# Caches in front of vector_search: query embeddings (per encoder) and search results
+# (per index version, so they are invalidated whenever a new index is written), plus
+# the LLM token count of each retrieved chunk used for context packing
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = 4096
+SEARCH_CACHE_MAX_ENTRIES = 1024
+SEARCH_CACHE_TTL_SECONDS = 3600
+CHUNK_TOKEN_CACHE_MAX_ENTRIES = 65536
+
+# Semantic answer cache in front of the LLM: a query whose embedding is at least
+# ANSWER_CACHE_THRESHOLD cosine-similar to a cached one, and which retrieves the same
+# chunks, gets the cached answer. Dropped when the index or model changes. Set
+# ANSWER_CACHE_DB to a file path to keep answers across restarts. Off by default; check
+# invalidation with `python -m rag_app.answer_cache` before turning it on
+ANSWER_CACHE_ENABLED = False
+ANSWER_CACHE_MAX_ENTRIES = 2048
+ANSWER_CACHE_THRESHOLD = 0.9
+ANSWER_CACHE_DB = None
+
+# Upper bound on the number of queries accepted by /api/search_batch
+SEARCH_BATCH_MAX_QUERIES = 1000
+
+# Memory budget for SentenceTransformer encoders kept resident between queries
+ENCODER_MEMORY_BUDGET_MB = int(os.environ.get('ARCHIVEBOT_ENCODER_MEMORY_MB', 1024))
+
+# Compression of the combined all_chunks.jsonl written after chunking: None, 'gzip' or 'zstd'
+# (zstd needs the zstandard package)
+CHUNK_COMPRESSION = None
+
+# Near-duplicate chunk removal between chunking and embedding (dedup_chunks.py).
+# Chunks whose estimated Jaccard similarity of word 5-gram shingles is at least
+# DEDUP_THRESHOLD are merged; more LSH bands find candidates at lower similarity.
+# Off by default: merging changes the corpus, its chunk ids and therefore citations
+DEDUP_CHUNKS = False
+DEDUP_THRESHOLD = 0.8
+DEDUP_LSH_BANDS = 16
+
+# Embedding generation: CPU worker processes (0 = encode in the embedding process) and
+# padded tokens per batch, so batches of short chunks hold more rows than batches of long ones
+EMBEDDING_WORKERS = int(os.environ.get('ARCHIVEBOT_EMBEDDING_WORKERS', 0))
+EMBEDDING_BATCH_TOKENS = 16384
 
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
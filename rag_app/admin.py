@@ -3,7 +3,7 @@ from .models import PipelineState, ChatMessage
 
 @admin.register(PipelineState)
 class PipelineStateAdmin(admin.ModelAdmin):
-    list_display = ['id', 'model_loaded', 'model_name', 'scraping_in_progress', 'embedding_in_progress']
+    list_display = ['id', 'model_loaded', 'model_name', 'model_status', 'scraping_in_progress', 'embedding_in_progress']
     readonly_fields = ['id']
 
 @admin.register(ChatMessage)
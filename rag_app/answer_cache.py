@@ -0,0 +1,202 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+
+def cache_version(index_version: Any, model_name: Any) -> str:
+    # cached answers are only valid for the index and LLM that produced them
+    return f"{index_version}|{model_name}"
+
+class SemanticAnswerCache:
+    # cache of final RAG answers in front of the LLM. entries hold the query embedding,
+    # the ids of the chunks the answer was generated from and the answer. a new query hits
+    # when its embedding is within threshold cosine similarity of a cached query *and* its
+    # retrieval returned the same chunk set, so paraphrases reuse the answer but a question
+    # that retrieves different documents never does.
+    # embeddings live in one preallocated (max_entries x dim) matrix scanned with a single
+    # product; slots are recycled in LRU order. everything is tied to a version (index
+    # version + LLM name) and dropped when it changes. with db_path set, entries are also
+    # written to SQLite and reloaded on startup
+    def __init__(self, max_entries: int = 2048, threshold: float = 0.9, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.db_path = db_path
+        self.version: Optional[str] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._slots: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()  # slot -> entry, LRU order
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.chunk_mismatches = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        if db_path:
+            with self._connect() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS answers (version TEXT, query TEXT, chunk_ids TEXT, "
+                           "embedding BLOB, answer TEXT, created REAL)")
+                db.execute("CREATE INDEX IF NOT EXISTS answers_version ON answers (version)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def _check_version_locked(self, version: str):
+        # a new index or model retires every cached answer, in memory and on disk
+        if version == self.version:
+            return
+        if self._slots:
+            self.invalidations += 1
+        self._slots.clear()
+        self.version = version
+        if self.db_path:
+            with self._connect() as db:
+                db.execute("DELETE FROM answers WHERE version != ?", (version,))
+                rows = db.execute("SELECT query, chunk_ids, embedding, answer FROM answers WHERE version = ? "
+                                  "ORDER BY created DESC LIMIT ?", (version, self.max_entries)).fetchall()
+            for query, chunk_ids, embedding, answer in reversed(rows):
+                self._store_locked(query, np.frombuffer(embedding, dtype=np.float32),
+                                   frozenset(json.loads(chunk_ids)), answer)
+
+    def _store_locked(self, query: str, embedding: np.ndarray, chunk_ids: frozenset, answer: str):
+        if self._matrix is None or self._matrix.shape[1] != len(embedding):
+            self._matrix = np.zeros((self.max_entries, len(embedding)), dtype=np.float32)
+            self._slots.clear()
+        if len(self._slots) < self.max_entries:
+            # slots fill up in order and are only freed all at once
+            slot = len(self._slots)
+        else:
+            slot, _ = self._slots.popitem(last=False)
+            self.evictions += 1
+        self._matrix[slot] = embedding
+        self._slots[slot] = {"query": query, "chunk_ids": chunk_ids, "answer": answer}
+
+    def get(self, embedding: np.ndarray, chunk_ids: Iterable[Any], version: str) -> Optional[str]:
+        # cached answer for a query embedding and its retrieved chunks, or None
+        embedding = self._normalize(embedding)
+        chunk_ids = frozenset(chunk_ids)
+        with self._lock:
+            self._check_version_locked(version)
+            if not self._slots or self._matrix.shape[1] != len(embedding):
+                self.misses += 1
+                return None
+
+            slots = np.fromiter(self._slots.keys(), dtype=np.int64, count=len(self._slots))
+            similarities = self._matrix[slots] @ embedding
+            for i in np.argsort(-similarities):
+                if similarities[i] < self.threshold:
+                    break
+                entry = self._slots[int(slots[i])]
+                if entry["chunk_ids"] == chunk_ids:
+                    self._slots.move_to_end(int(slots[i]))
+                    self.hits += 1
+                    print(f"Answer cache hit (similarity {similarities[i]:.3f} to '{entry['query']}')")
+                    return entry["answer"]
+                self.chunk_mismatches += 1
+            self.misses += 1
+            return None
+
+    def put(self, query: str, embedding: np.ndarray, chunk_ids: Iterable[Any], answer: str, version: str):
+        embedding = self._normalize(embedding)
+        chunk_ids = frozenset(chunk_ids)
+        with self._lock:
+            self._check_version_locked(version)
+            self._store_locked(query, embedding, chunk_ids, answer)
+            if self.db_path:
+                with self._connect() as db:
+                    db.execute("INSERT INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                               (version, query, json.dumps(sorted(chunk_ids, key=str)), embedding.tobytes(),
+                                answer, time.time()))
+                    # keep the table bounded like the in-memory matrix
+                    db.execute("DELETE FROM answers WHERE rowid NOT IN "
+                               "(SELECT rowid FROM answers ORDER BY created DESC LIMIT ?)", (self.max_entries,))
+
+    def configure(self, max_entries: Optional[int] = None, threshold: Optional[float] = None):
+        with self._lock:
+            if threshold is not None:
+                self.threshold = threshold
+            if max_entries is not None and max_entries != self.max_entries:
+                self.max_entries = max_entries
+                self._matrix = None
+                self._slots.clear()
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+            if self.db_path:
+                with self._connect() as db:
+                    db.execute("DELETE FROM answers")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._slots),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "chunk_mismatches": self.chunk_mismatches,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "approx_bytes": int(self._matrix.nbytes) if self._matrix is not None else 0,
+                "persistent": bool(self.db_path),
+                "version": self.version,
+            }
+
+def check_invalidation(db_path: Optional[str] = None) -> Dict[str, bool]:
+    # an answer must never outlive its index version or LLM, in memory or in SQLite. each
+    # case stores one answer under a base version, then looks it up from a fresh cache on the
+    # same database (a restarted worker) under a changed version and again under the base
+    # version, which must miss too because the stale rows were deleted. returns {case: passed}
+    embedding, chunk_ids = np.ones(8, dtype=np.float32), ["a", "b"]
+    base = cache_version("v1", "model-a")
+    changes = {"index version": cache_version("v2", "model-a"), "LLM": cache_version("v1", "model-b")}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, (change, version) in enumerate(changes.items()):
+            path = db_path or os.path.join(tmp, f"answers-{i}.sqlite3")
+            cache = SemanticAnswerCache(db_path=path)
+            cache.clear()
+            cache.put("question", embedding, chunk_ids, "answer", base)
+            results["restart, same version: hit"] = (
+                SemanticAnswerCache(db_path=path).get(embedding, chunk_ids, base) == "answer")
+            results[f"restart, {change} changed: miss"] = (
+                SemanticAnswerCache(db_path=path).get(embedding, chunk_ids, version) is None)
+            results[f"restart, {change} changed back: miss"] = (
+                SemanticAnswerCache(db_path=path).get(embedding, chunk_ids, base) is None)
+            with sqlite3.connect(path) as db:
+                stale = db.execute("SELECT COUNT(*) FROM answers WHERE version = ?", (base,)).fetchone()[0]
+            results[f"SQLite, {change} changed: stale rows deleted"] = stale == 0
+
+            cache = SemanticAnswerCache()
+            cache.put("question", embedding, chunk_ids, "answer", base)
+            results[f"memory, {change} changed: miss"] = cache.get(embedding, chunk_ids, version) is None
+            results[f"memory, {change} changed back: miss"] = cache.get(embedding, chunk_ids, base) is None
+
+    for case, passed in results.items():
+        print(f"{'ok' if passed else 'FAILED'}: {case}")
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check that answer cache entries are invalidated '
+                                                 'when the index version or LLM changes')
+    parser.add_argument('--db', help='SQLite file to check against (default: a temporary file; '
+                                     'existing answers in it are cleared)')
+    args = parser.parse_args()
+    raise SystemExit(0 if all(check_invalidation(args.db).values()) else 1)
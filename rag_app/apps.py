@@ -1,11 +1,23 @@
+import os
+import sys
 from django.apps import AppConfig
 
+def should_preload():
+    """Preload only in the process that serves requests, not in other management commands
+    or the runserver autoreloader's parent process"""
+    if len(sys.argv) > 1 and os.path.basename(sys.argv[0]) == 'manage.py':
+        if sys.argv[1] != 'runserver':
+            return False
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+    return True
+
 class RagAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag_app'
     
     def ready(self):
         # Reset pipeline state on server startup
+        from django.conf import settings
         try:
             from .models import PipelineState
             state = PipelineState.get_instance()
@@ -13,7 +25,22 @@ class RagAppConfig(AppConfig):
             state.ocr_in_progress = False
             state.chunking_in_progress = False
             state.embedding_in_progress = False
+            # the model lives in process memory, so it is gone after a restart of the serving
+            # process; other management commands must not touch the state of a live server, and
+            # with a shared model server the model state belongs to that process instead
+            serving = should_preload()
+            if not settings.MODEL_SERVER_SOCKET and serving:
+                state.model_loaded = False
+                state.model_status = 'idle'
+                state.model_error = None
             state.save()
             print("Pipeline state reset on startup")
         except Exception as e:
-            print(f"Could not reset pipeline state: {e}") 
\ No newline at end of file
+            print(f"Could not reset pipeline state: {e}")
+            return
+        
+        # Optionally start loading the LLM right away (the model server preloads its own)
+        if settings.LLM_PRELOAD_MODEL and not settings.MODEL_SERVER_SOCKET and serving:
+            from .views import start_model_loading
+            print(f"Preloading model: {settings.LLM_PRELOAD_MODEL}")
+            start_model_loading(settings.LLM_PRELOAD_MODEL) 
\ No newline at end of file
@@ -1,32 +1,450 @@
+import hashlib
 import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+import numpy as np
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer, pipeline
+)
 import pickle
 from typing import List, Dict, Any
 
+def _legacy_cache(past_key_values):
+    # (key, value) tensors per layer, [batch, heads, length, head_dim]
+    return past_key_values.to_legacy_cache() if hasattr(past_key_values, "to_legacy_cache") else past_key_values
+
+def _model_cache(legacy):
+    # newer transformers versions expect a Cache object instead of tuples
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        return legacy
+    return DynamicCache.from_legacy_cache(legacy)
+
+class PrefixCache:
+    # LRU of KV caches for prompt prefixes, bounded by max_bytes. prefixes are cut at
+    # multiples of block_tokens and keyed by a hash of their token ids. every block boundary
+    # of a stored entry is indexed, so a prompt that shares only the scaffold and first
+    # documents of an earlier prompt still reuses that part of its cache
+    def __init__(self, max_bytes=512 * 1024 * 1024, block_tokens=32):
+        self.max_bytes = max_bytes
+        self.block_tokens = block_tokens
+        self._entries = OrderedDict()  # key -> (legacy cache, length, bytes)
+        self._boundaries = {}  # prefix hash -> (entry key, prefix length)
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.computed_tokens = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+    
+    def _prefix_hashes(self, ids):
+        # (length, hash) of every block-aligned prefix of ids, shortest first
+        digest = hashlib.sha1()
+        hashes = []
+        for end in range(self.block_tokens, len(ids) + 1, self.block_tokens):
+            digest.update(np.asarray(ids[end - self.block_tokens:end], dtype=np.int64).tobytes())
+            hashes.append((end, digest.hexdigest()))
+        return hashes
+    
+    def lookup(self, ids):
+        # cache of the longest known prefix of ids and its length, or (None, 0).
+        # the last token is never covered, the model has to run it to produce logits
+        with self._lock:
+            for length, key in reversed(self._prefix_hashes(ids[:-1])):
+                entry_key, _ = self._boundaries.get(key, (None, 0))
+                entry = self._entries.get(entry_key)
+                if entry is None:
+                    continue
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                self.reused_tokens += length
+                self.computed_tokens += len(ids) - length
+                return [(k[:, :, :length], v[:, :, :length]) for k, v in entry[0]], length
+            self.misses += 1
+            self.computed_tokens += len(ids)
+            return None, 0
+    
+    def store(self, ids, past):
+        # keep the longest block-aligned prefix of a prompt whose cache past covers it
+        hashes = self._prefix_hashes(ids[:-1])
+        if not hashes:
+            return
+        length, key = hashes[-1]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+        
+        past = [(k[:, :, :length].clone(), v[:, :, :length].clone()) for k, v in past]
+        size = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in past)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            self._entries[key] = (past, length, size)
+            self.resident_bytes += size
+            for prefix_length, prefix_key in hashes:
+                self._boundaries[prefix_key] = (key, prefix_length)
+            while self.resident_bytes > self.max_bytes:
+                self._evict_oldest()
+    
+    def _evict_oldest(self):
+        key, (_, _, size) = self._entries.popitem(last=False)
+        self.resident_bytes -= size
+        self.evictions += 1
+        self._boundaries = {h: owner for h, owner in self._boundaries.items() if owner[0] != key}
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._boundaries.clear()
+            self.resident_bytes = 0
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            total_tokens = self.reused_tokens + self.computed_tokens
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "reused_tokens": self.reused_tokens,
+                "computed_tokens": self.computed_tokens,
+                "reused_fraction": self.reused_tokens / total_tokens if total_tokens else 0.0,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+def prefill_prompt(model, prompt_ids, prefix_cache=None):
+    # run a prompt through the model, starting from the cached KV of its longest known prefix.
+    # returns the logits at the last position and the legacy cache of the whole prompt
+    past, reused = prefix_cache.lookup(prompt_ids) if prefix_cache is not None else (None, 0)
+    device = model.device
+    output = model(
+        input_ids=torch.tensor([prompt_ids[reused:]], device=device),
+        attention_mask=torch.ones((1, len(prompt_ids)), dtype=torch.long, device=device),
+        position_ids=torch.arange(reused, len(prompt_ids), device=device).unsqueeze(0),
+        past_key_values=_model_cache(tuple(past)) if past is not None else None,
+        use_cache=True,
+    )
+    past = _legacy_cache(output.past_key_values)
+    if prefix_cache is not None:
+        prefix_cache.store(prompt_ids, past)
+    return output.logits[:, -1, :], past
+
+class StopOnEvent(StoppingCriteria):
+    # stops model.generate once the event is set, e.g. when a streamed response is abandoned
+    def __init__(self, event):
+        self.event = event
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+class GenerationRequest:
+    # one prompt queued on a GenerationScheduler. decoded text is put on a queue as
+    # tokens are produced; iterating the request yields it and re-raises scheduler errors
+    def __init__(self, prompt_ids, max_new_tokens=512, temperature=0.7, top_p=0.95):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.generated = []
+        self.error = None
+        self.cancelled = False
+        self._pieces = queue.Queue()
+        self._emitted = 0
+    
+    def cancel(self):
+        # the consumer has gone; the scheduler drops the request before its next step
+        self.cancelled = True
+    
+    def emit(self, tokenizer, final=False):
+        # send the newly decoded text; an incomplete multi-byte character is held back
+        text = tokenizer.decode(self.generated, skip_special_tokens=True)
+        if not final and text.endswith("\ufffd"):
+            return
+        if len(text) > self._emitted:
+            self._pieces.put(text[self._emitted:])
+            self._emitted = len(text)
+    
+    def finish(self, error=None):
+        self.error = error
+        self._pieces.put(None)
+    
+    def __iter__(self):
+        while True:
+            piece = self._pieces.get()
+            if piece is None:
+                break
+            yield piece
+        if self.error is not None:
+            raise self.error
+    
+    def result(self):
+        return "".join(self)
+
+class GenerationScheduler:
+    # continuous batching for one causal LM. requests wait in a queue; a background thread
+    # keeps one left-padded batch whose KV cache advances one token per forward pass for
+    # every row at once. finished rows leave the batch after any step and waiting requests
+    # join it after their prompts are prefilled, so nobody waits for the longest answer
+    def __init__(self, model, tokenizer, max_batch_size=8, prefix_cache=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = prefix_cache
+        self.eos_token_id = tokenizer.eos_token_id
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self._waiting = queue.Queue()
+        
+        # batch state: the cache covers every token except next_tokens, the last sampled
+        # token of each row, which is fed in on the next step
+        self._active = []
+        self._past = None
+        self._mask = None
+        self._next_tokens = None
+        
+        self.requests = 0
+        self.tokens = 0
+        self.steps = 0
+        self.batched_rows = 0
+        self.busy_seconds = 0.0
+        
+        self._thread = threading.Thread(target=self._loop, name="llm-scheduler", daemon=True)
+        self._thread.start()
+    
+    def submit(self, prompt, max_new_tokens=512, temperature=0.7, top_p=0.95):
+        prompt_ids = self.tokenizer(prompt, truncation=True)["input_ids"]
+        request = GenerationRequest(prompt_ids, max_new_tokens, temperature, top_p)
+        self._waiting.put(request)
+        return request
+    
+    def _loop(self):
+        while True:
+            # block while idle, otherwise only pick up requests that are already waiting
+            joining = []
+            if not self._active:
+                joining.append(self._waiting.get())
+            while len(self._active) + len(joining) < self.max_batch_size:
+                try:
+                    joining.append(self._waiting.get_nowait())
+                except queue.Empty:
+                    break
+            for request in [r for r in joining if r.cancelled]:
+                request.finish()
+                joining.remove(request)
+            
+            start = time.perf_counter()
+            try:
+                with torch.inference_mode():
+                    if joining:
+                        self._prefill(joining)
+                    if self._active:
+                        self._decode_step()
+            except Exception as e:
+                print(f"Error in generation scheduler: {e}")
+                for request in self._active + joining:
+                    if request.error is None:
+                        request.finish(e)
+                self._active, self._past, self._mask, self._next_tokens = [], None, None, None
+            self.busy_seconds += time.perf_counter() - start
+    
+    def _sample(self, logits, requests):
+        # per-row temperature and nucleus sampling; temperature 0 is greedy
+        logits = logits.float()
+        temperatures = torch.tensor([max(r.temperature, 1e-5) for r in requests], device=logits.device)
+        top_p = torch.tensor([r.top_p for r in requests], device=logits.device)
+        probs = torch.softmax(logits / temperatures[:, None], dim=-1)
+        sorted_probs, sorted_ids = torch.sort(probs, dim=-1, descending=True)
+        sorted_probs[(torch.cumsum(sorted_probs, dim=-1) - sorted_probs) > top_p[:, None]] = 0
+        sampled = sorted_ids.gather(1, torch.multinomial(sorted_probs, 1)).squeeze(1)
+        greedy = torch.tensor([r.temperature <= 0 for r in requests], device=logits.device)
+        return torch.where(greedy, logits.argmax(dim=-1), sampled)
+    
+    def _record(self, requests, tokens):
+        # append each row's new token; returns the indices of rows that keep generating
+        keep = []
+        for i, (request, token) in enumerate(zip(requests, tokens.tolist())):
+            done = token == self.eos_token_id
+            if not done:
+                request.generated.append(token)
+                self.tokens += 1
+            # a cancelled row leaves the batch here, freeing its slot for a waiting request
+            done = done or request.cancelled or len(request.generated) >= request.max_new_tokens
+            request.emit(self.tokenizer, final=done)
+            if done:
+                request.finish()
+            else:
+                keep.append(i)
+        return keep
+    
+    def _prefill(self, joining):
+        # run the new prompts and merge their caches into the running batch
+        device = self.model.device
+        if self.prefix_cache is None:
+            # one left-padded batch
+            width = max(len(r.prompt_ids) for r in joining)
+            input_ids = torch.full((len(joining), width), self.pad_token_id, dtype=torch.long, device=device)
+            mask = torch.zeros((len(joining), width), dtype=torch.long, device=device)
+            for i, request in enumerate(joining):
+                length = len(request.prompt_ids)
+                input_ids[i, width - length:] = torch.tensor(request.prompt_ids, device=device)
+                mask[i, width - length:] = 1
+            position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+            
+            output = self.model(input_ids=input_ids, attention_mask=mask, position_ids=position_ids, use_cache=True)
+            logits = output.logits[:, -1, :]
+            past = _legacy_cache(output.past_key_values)
+        else:
+            # one prompt at a time, so each starts from its own cached prefix
+            logits, past, mask = [], None, None
+            for request in joining:
+                row_logits, row_past = prefill_prompt(self.model, request.prompt_ids, self.prefix_cache)
+                row_mask = torch.ones((1, len(request.prompt_ids)), dtype=torch.long, device=device)
+                logits.append(row_logits)
+                past, mask = (row_past, row_mask) if past is None else self._stack(past, mask, row_past, row_mask)
+            logits = torch.cat(logits)
+        
+        self.requests += len(joining)
+        tokens = self._sample(logits, joining)
+        keep = self._record(joining, tokens)
+        if not keep:
+            return
+        
+        index = torch.tensor(keep, device=device)
+        past = [(k[index], v[index]) for k, v in past]
+        mask = mask[index]
+        next_tokens = tokens[index].unsqueeze(1)
+        joining = [joining[i] for i in keep]
+        
+        if not self._active:
+            self._active, self._past, self._mask, self._next_tokens = joining, past, mask, next_tokens
+            return
+        
+        self._past, self._mask = self._stack(self._past, self._mask, past, mask)
+        self._next_tokens = torch.cat([self._next_tokens, next_tokens])
+        self._active = self._active + joining
+    
+    @staticmethod
+    def _stack(past_a, mask_a, past_b, mask_b):
+        # left-pad the shorter of two caches so both have the same length, then stack their rows
+        length = max(mask_a.shape[1], mask_b.shape[1])
+        
+        def pad(cache, cache_mask):
+            extra = length - cache_mask.shape[1]
+            if not extra:
+                return cache, cache_mask
+            cache = [(torch.nn.functional.pad(k, (0, 0, extra, 0)), torch.nn.functional.pad(v, (0, 0, extra, 0)))
+                     for k, v in cache]
+            return cache, torch.nn.functional.pad(cache_mask, (extra, 0))
+        
+        past_a, mask_a = pad(past_a, mask_a)
+        past_b, mask_b = pad(past_b, mask_b)
+        past = [(torch.cat([ka, kb]), torch.cat([va, vb])) for (ka, va), (kb, vb) in zip(past_a, past_b)]
+        return past, torch.cat([mask_a, mask_b])
+    
+    def _decode_step(self):
+        mask = torch.cat([self._mask, torch.ones_like(self._mask[:, :1])], dim=1)
+        position_ids = mask.sum(dim=1, keepdim=True) - 1
+        output = self.model(
+            input_ids=self._next_tokens,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=_model_cache(tuple(self._past)),
+            use_cache=True,
+        )
+        self.steps += 1
+        self.batched_rows += len(self._active)
+        
+        tokens = self._sample(output.logits[:, -1, :], self._active)
+        keep = self._record(self._active, tokens)
+        past = _legacy_cache(output.past_key_values)
+        
+        if len(keep) < len(self._active):
+            index = torch.tensor(keep, device=mask.device, dtype=torch.long)
+            past = [(k[index], v[index]) for k, v in past]
+            mask = mask[index]
+            tokens = tokens[index]
+            self._active = [self._active[i] for i in keep]
+            if keep:
+                # drop leading columns that are padding for every remaining row
+                first = int(mask.sum(dim=0).nonzero()[0])
+                if first:
+                    past = [(k[:, :, first:], v[:, :, first:]) for k, v in past]
+                    mask = mask[:, first:]
+        
+        if self._active:
+            self._past, self._mask, self._next_tokens = list(past), mask, tokens.unsqueeze(1)
+        else:
+            self._past, self._mask, self._next_tokens = None, None, None
+    
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "active": len(self._active),
+            "waiting": self._waiting.qsize(),
+            "requests": self.requests,
+            "tokens": self.tokens,
+            "mean_batch_size": round(self.batched_rows / self.steps, 2) if self.steps else 0.0,
+            "tokens_per_second": round(self.tokens / self.busy_seconds, 1) if self.busy_seconds else 0.0,
+        }
+
+# returned by generate_response when generation fails; never cached
+ERROR_RESPONSE = "I encountered an error while generating a response."
+
 class LocalLLM:
-    def __init__(self, model_name="TinyLlama/TinyLlama-1.1B-Chat-v1.0", device=None): 
+    def __init__(self, model_name="TinyLlama/TinyLlama-1.1B-Chat-v1.0", device=None, max_batch_size=0,
+                 prefix_cache_mb=0, prefix_block_tokens=32, cpu_mode="fp32", num_threads=None,
+                 draft_model_name=None):
         print(f"Loading model: {model_name}")
+        load_start = time.perf_counter()
         
         # auto-detect device if not specified
         if device is None:
             device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
         
+        self.model_name = model_name
         self.device = device
         print(f"Using device: {device}")
         
         # load tokenizer and model
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
         
-        # load in 8-bit quantization for memory efficiency if on CUDA
-        if device == "cuda":
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_name, 
-                device_map="auto",
-                load_in_8bit=True
-            )
-        else:
-            self.model = AutoModelForCausalLM.from_pretrained(model_name).to(device)
+        self.cpu_mode = cpu_mode if device == "cpu" else None
+        if device == "cpu":
+            from .pipeline import import_script
+            import_script("llm_cpu").configure_threads(num_threads)
+            print(f"CPU inference mode: {cpu_mode}")
+        self.model = self._load_model(model_name)
+        
+        # optional small draft model for assisted (speculative) decoding: it proposes a few
+        # tokens at a time and the main model verifies them in a single forward pass
+        self.draft_model_name = draft_model_name
+        self.draft_model = None
+        self.assistant_kwargs = {}
+        self.assisted = {"new_tokens": 0, "target_forwards": 0, "draft_forwards": 0, "seconds": 0.0}
+        self._assist_lock = threading.Lock()
+        if draft_model_name:
+            from .pipeline import import_script
+            print(f"Loading draft model: {draft_model_name}")
+            self.draft_model = self._load_model(draft_model_name)
+            draft_tokenizer = AutoTokenizer.from_pretrained(draft_model_name)
+            if not import_script("assisted_decoding").same_vocabulary(self.tokenizer, draft_tokenizer):
+                # universal assisted decoding re-tokenizes the draft's text for the main model
+                self.assistant_kwargs = {"tokenizer": self.tokenizer, "assistant_tokenizer": draft_tokenizer}
+            if max_batch_size > 1:
+                print("Assisted decoding generates one request at a time, continuous batching disabled")
+                max_batch_size = 0
         
         # create text generation 
         self.generator = pipeline(
@@ -36,10 +454,52 @@ class LocalLLM:
             device=device
         )
         
-        print("Model loaded successfully")
+        # KV caches of recently seen prompt prefixes (scaffold + retrieved documents)
+        self.prefix_cache = PrefixCache(int(prefix_cache_mb * 1024 * 1024), prefix_block_tokens) if prefix_cache_mb > 0 else None
+        
+        # with max_batch_size > 1, concurrent requests share forward passes
+        self.scheduler = (GenerationScheduler(self.model, self.tokenizer, max_batch_size, self.prefix_cache)
+                          if max_batch_size > 1 else None)
+        
+        # prompt tokens the model can attend to; rag_response keeps the prompt within
+        # context_window - max_new_tokens so the answer always has room
+        self.max_new_tokens = 512
+        self.context_window = min(
+            getattr(self.model.config, "max_position_embeddings", None) or 2048,
+            getattr(self.tokenizer, "model_max_length", None) or 2048,
+        )
+        
+        # time-to-first-token of recent streamed responses
+        self.streams = 0
+        self.generation_ttft_seconds = deque(maxlen=100)
+        
+        self.load_seconds = time.perf_counter() - load_start
+        print(f"Model loaded successfully in {self.load_seconds:.1f}s")
+    
+    def _load_model(self, model_name):
+        # load in 8-bit quantization for memory efficiency if on CUDA
+        if self.device == "cuda":
+            return AutoModelForCausalLM.from_pretrained(
+                model_name, 
+                device_map="auto",
+                load_in_8bit=True
+            )
+        model = AutoModelForCausalLM.from_pretrained(model_name).to(self.device)
+        
+        # on CPU: int8 dynamic quantization or bf16 weights
+        if self.device == "cpu":
+            from .pipeline import import_script
+            model = import_script("llm_cpu").optimize_for_cpu(model, self.cpu_mode)
+        return model
     
-    def generate_response(self, prompt, max_new_tokens=512, temperature=0.7):
+    def generate_response(self, prompt, max_new_tokens=None, temperature=0.7):
+        max_new_tokens = max_new_tokens or self.max_new_tokens
         try:
+            if self.scheduler is not None:
+                return self.scheduler.submit(prompt, max_new_tokens, temperature).result().strip()
+            if self.prefix_cache is not None or self.draft_model is not None:
+                return self._generate(prompt, max_new_tokens, temperature).strip()
+            
             response = self.generator(
                 prompt,
                 max_new_tokens=max_new_tokens,
@@ -61,37 +521,324 @@ class LocalLLM:
         
         except Exception as e:
             print(f"Error generating response: {e}")
-            return "I encountered an error while generating a response."
+            return ERROR_RESPONSE
+    
+    def stream_response(self, prompt, max_new_tokens=None, temperature=0.7):
+        # yield the response text piece by piece as tokens are decoded
+        max_new_tokens = max_new_tokens or self.max_new_tokens
+        start = time.perf_counter()
+        if self.scheduler is not None:
+            request = self.scheduler.submit(prompt, max_new_tokens, temperature)
+            pieces, cancel = iter(request), request.cancel
+        else:
+            pieces = self._stream_generate(prompt, max_new_tokens, temperature)
+            cancel = pieces.close
+        
+        first_token = None
+        try:
+            for text in pieces:
+                if not text:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                    self.streams += 1
+                    self.generation_ttft_seconds.append(first_token)
+                    print(f"Time to first token (generation): {first_token * 1000:.1f} ms")
+                yield text
+        finally:
+            # a consumer that stops early (a closed client stream) stops the decoding too
+            cancel()
+    
+    def _generate(self, prompt, max_new_tokens, temperature, streamer=None, stop=None, prefix_cache=None):
+        # model.generate, continuing from the cached KV of the prompt's longest known prefix
+        # (in prefix_cache, by default the model's own), or assisted by the draft model when
+        # one is loaded. setting the stop event ends generation after the current step
+        prefix_cache = prefix_cache if prefix_cache is not None else self.prefix_cache
+        ids = self.tokenizer(prompt)["input_ids"]
+        inputs = {
+            "input_ids": torch.tensor([ids], device=self.model.device),
+            "attention_mask": torch.ones((1, len(ids)), dtype=torch.long, device=self.model.device),
+        }
+        options = dict(
+            streamer=streamer,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=self.tokenizer.eos_token_id,
+            return_dict_in_generate=True,
+        )
+        # temperature 0 is greedy, as in GenerationScheduler._sample
+        options.update(dict(do_sample=True, temperature=temperature, top_p=0.95) if temperature > 0
+                       else dict(do_sample=False))
+        if stop is not None:
+            options["stopping_criteria"] = StoppingCriteriaList([StopOnEvent(stop)])
+        
+        if self.draft_model is not None:
+            return self._assisted_generate(ids, inputs, options)
+        
+        if prefix_cache is not None:
+            past, _ = prefix_cache.lookup(ids)
+            if past is not None:
+                inputs["past_key_values"] = _model_cache(tuple(past))
+        
+        output = self.model.generate(**inputs, **options)
+        if prefix_cache is not None:
+            prefix_cache.store(ids, _legacy_cache(output.past_key_values))
+        return self.tokenizer.decode(output.sequences[0, len(ids):], skip_special_tokens=True)
+    
+    def _assisted_generate(self, ids, inputs, options):
+        # one assisted generation at a time, so the forward-pass counts behind the
+        # acceptance rate belong to a single request
+        from .pipeline import import_script
+        assisted_decoding = import_script("assisted_decoding")
+        with self._assist_lock:
+            output, counts = assisted_decoding.assisted_generate(
+                self.model, self.draft_model, len(ids), **inputs, **options, **self.assistant_kwargs)
+        for key, value in counts.items():
+            self.assisted[key] += value
+        print(f"Assisted decoding: {counts['new_tokens']} tokens in {counts['seconds']:.2f}s, acceptance rate "
+              f"{assisted_decoding.acceptance_rate(counts['new_tokens'], counts['target_forwards'], counts['draft_forwards']):.0%}")
+        return self.tokenizer.decode(output.sequences[0, len(ids):], skip_special_tokens=True)
+    
+    def _stream_generate(self, prompt, max_new_tokens, temperature):
+        # _generate runs on a background thread and feeds a TextIteratorStreamer
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop = threading.Event()
+        errors = []
+        
+        def run():
+            try:
+                self._generate(prompt, max_new_tokens, temperature, streamer=streamer, stop=stop)
+            except Exception as e:
+                errors.append(e)
+                # unblock the consumer, which would otherwise wait for tokens forever
+                streamer.end()
+        
+        thread = threading.Thread(target=run, name="llm-stream", daemon=True)
+        thread.start()
+        try:
+            yield from streamer
+        finally:
+            # closing this generator early ends generate() after its current step
+            stop.set()
+        thread.join()
+        
+        if errors:
+            raise errors[0]
+    
+    def _assisted_stats(self):
+        from .pipeline import import_script
+        return import_script("assisted_decoding").summarize(dict(self.assisted))
+    
+    def stats(self):
+        # time to first token from the start of generation; the done event of
+        # rag_response_stream reports request_ttft, which includes retrieval
+        ttft = sorted(self.generation_ttft_seconds)
+        return {
+            "device": self.device,
+            "cpu_mode": self.cpu_mode,
+            "load_seconds": round(self.load_seconds, 2),
+            "streams": self.streams,
+            "last_generation_ttft_ms": round(self.generation_ttft_seconds[-1] * 1000, 1) if ttft else None,
+            "mean_generation_ttft_ms": round(sum(ttft) / len(ttft) * 1000, 1) if ttft else None,
+            "p95_generation_ttft_ms": round(ttft[int(0.95 * (len(ttft) - 1))] * 1000, 1) if ttft else None,
+            "scheduler": self.scheduler.stats() if self.scheduler is not None else None,
+            "prefix_cache": self.prefix_cache.stats() if self.prefix_cache is not None else None,
+            "draft_model": self.draft_model_name,
+            "assisted": self._assisted_stats() if self.draft_model is not None else None,
+        }
+
+class CrossEncoderReranker:
+    # rescores a retrieved shortlist with a cross-encoder in one batched forward pass.
+    # passes run on a worker thread, so a request never waits longer than its time
+    # budget; on timeout the shortlist keeps its dense order. the model is loaded when
+    # the reranker is built, never inside a budgeted call
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", max_pending=4):
+        from .pipeline import import_script
+        self.model_name = model_name
+        self.model = import_script("encoder_registry").get_cross_encoder(model_name)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        # batches queued or running; beyond max_pending a request keeps dense order instead of queueing
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.timeouts = 0
+        self.skipped = 0
+    
+    def _score(self, query, texts):
+        scores = self.model.predict([(query, text) for text in texts], batch_size=len(texts), show_progress_bar=False)
+        return np.asarray(scores, dtype=np.float32)
+    
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+    
+    def rerank(self, query, results, top_k, time_budget_ms=None):
+        with self._lock:
+            self.calls += 1
+            if len(results) <= 1:
+                return results[:top_k]
+            if self._pending >= self.max_pending:
+                self.skipped += 1
+                print(f"Reranker has {self._pending} batches pending, keeping dense order")
+                return results[:top_k]
+            self._pending += 1
+        
+        future = self._executor.submit(self._score, query, [r['chunk']['text'] for r in results])
+        future.add_done_callback(self._done)
+        try:
+            scores = future.result(timeout=time_budget_ms / 1000 if time_budget_ms else None)
+        except FuturesTimeout:
+            # drop the batch if it has not started yet; a running pass cannot be interrupted
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            print(f"Rerank exceeded its {time_budget_ms} ms budget, keeping dense order")
+            return results[:top_k]
+        except Exception as e:
+            print(f"Error reranking results: {e}")
+            return results[:top_k]
+        
+        reranked = []
+        for i in np.argsort(-scores, kind='stable')[:top_k]:
+            result = dict(results[i])
+            result['rerank_score'] = float(scores[i])
+            reranked.append(result)
+        return reranked
+
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+
+def get_reranker(model_name):
+    # one reranker (and worker thread) per cross-encoder model
+    with _rerankers_lock:
+        if model_name not in _rerankers:
+            _rerankers[model_name] = CrossEncoderReranker(model_name)
+        return _rerankers[model_name]
 
 def load_embedded_chunks(embeddings_path):
+    # index directories are memory-mapped; legacy .pkl files are unpickled whole
     try:
+        if os.path.isdir(embeddings_path):
+            from .pipeline import import_script
+            return import_script("index_store").load_index(embeddings_path)
         with open(embeddings_path, 'rb') as f:
             return pickle.load(f)
     except Exception as e:
         print(f"Error loading embeddings from {embeddings_path}: {e}")
         return None
 
-def rag_response(query, embedded_chunks, llm, top_k=3, max_context_length=3000):
-    # Add scripts directory to Python path
-    import sys
-    import os
-    from django.conf import settings
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def format_prompt(context, query):
+    return f"""Below are some relevant documents:
+
+{context}
+
+Based on the above documents, please answer the following question:
+{query}
+
+Answer:"""
+
+def count_tokens(tokenizer, text):
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+def chunk_token_count(tokenizer, result, version):
+    # token count of a retrieved chunk, cached per tokenizer and index row so each chunk
+    # is tokenized once per index version rather than on every query
+    from .pipeline import import_script
+    cache = import_script("search_cache").chunk_token_cache
+    key = (getattr(tokenizer, "name_or_path", type(tokenizer).__name__), result.get('row', result['chunk'].get('chunk_id')))
+    count = cache.get(key, version)
+    if count is None:
+        count = count_tokens(tokenizer, result['chunk']['text'])
+        cache.put(key, count, version)
+    return count
+
+def truncate_to_tokens(tokenizer, text, budget):
+    # longest run of whole sentences from the start of text that fits in budget tokens.
+    # text without a sentence break that fits (common in OCR output) is cut at the token level
+    kept, used = [], 0
+    for sentence in SENTENCE_END.split(text):
+        tokens = count_tokens(tokenizer, sentence)
+        if used + tokens > budget:
+            break
+        kept.append(sentence)
+        used += tokens
+    if kept:
+        return " ".join(kept)
+    ids = tokenizer(text, add_special_tokens=False)["input_ids"][:budget]
+    return tokenizer.decode(ids, skip_special_tokens=True)
+
+def pack_context(results, tokenizer, budget, version=None, min_tokens=32):
+    # add retrieved chunks in rank order while their tokens fit in budget; the first chunk
+    # that does not fit is cut at a sentence boundary if at least min_tokens remain
+    context, used = "", 0
+    for i, result in enumerate(results):
+        metadata = result['chunk']['metadata']
+        header = f"Document {i+1} (Source: {metadata['source']}, Date: {metadata['date']}):\n"
+        header_tokens = count_tokens(tokenizer, header) + 2  # plus the blank line after the chunk
+        chunk_tokens = chunk_token_count(tokenizer, result, version)
+        
+        if used + header_tokens + chunk_tokens <= budget:
+            context += f"{header}{result['chunk']['text']}\n\n"
+            used += header_tokens + chunk_tokens
+            continue
+        
+        remaining = budget - used - header_tokens
+        if remaining >= min_tokens:
+            text = truncate_to_tokens(tokenizer, result['chunk']['text'], remaining)
+            if text:
+                context += f"{header}{text} ...\n\n"
+        break
+    return context
+
+def build_rag_prompt(query, embedded_chunks, top_k=3, max_context_length=3000,
+                     mmr=False, mmr_lambda=0.5, fetch_k=None,
+                     rerank_model=None, rerank_k=20, rerank_budget_ms=None,
+                     tokenizer=None, max_prompt_tokens=None, max_context_tokens=None, **search_options):
+    # retrieve (and optionally diversify / rerank) the chunks for a query and pack them
+    # into the prompt. returns the results, the prompt and per-stage timings in seconds.
+    # with a tokenizer the documents are budgeted in tokens (max_prompt_tokens for the whole
+    # prompt, max_context_tokens for the documents), otherwise in max_context_length characters
+    from .pipeline import import_script, get_encoder_registry, get_search_caches
     
-    scripts_path = os.path.join(settings.BASE_DIR, "scripts")
-    if scripts_path not in sys.path:
-        sys.path.insert(0, scripts_path)
+    timings = {}
+    start = time.perf_counter()
     
-    # Import after adding to sys.path
-    try:
-        from embed_chunks import vector_search # type: ignore
-    except ImportError as e:
-        print(f"Error importing embed_chunks: {e}")
-        print(f"Scripts path: {scripts_path}")
-        print(f"Path exists: {os.path.exists(scripts_path)}")
-        raise
+    # make sure the query encoder is resident under the configured budget
+    get_encoder_registry()
+    get_search_caches()
+    embed_chunks = import_script("embed_chunks")
+    
+    # retrieve the relevant chunks from the embeddings (repeated questions hit the cache).
+    # with mmr, fetch_k candidates are diversified down to top_k; with a rerank model
+    # a shortlist of rerank_k chunks is retrieved and the cross-encoder picks top_k
+    retrieve_k = max(rerank_k, top_k) if rerank_model else top_k
+    if mmr:
+        if rerank_model:
+            # mmr picks the diverse rerank shortlist, so it needs more candidates than that
+            fetch_k = max(fetch_k or 0, 4 * retrieve_k)
+        results = embed_chunks.mmr_search(query, embedded_chunks, top_k=retrieve_k, fetch_k=fetch_k,
+                                          mmr_lambda=mmr_lambda, **search_options)
+    else:
+        results = embed_chunks.cached_vector_search(query, embedded_chunks, top_k=retrieve_k, **search_options)
+    timings['retrieval'] = time.perf_counter() - start
+    
+    if rerank_model:
+        stage_start = time.perf_counter()
+        results = get_reranker(rerank_model).rerank(query, results, top_k, rerank_budget_ms)
+        timings['rerank'] = time.perf_counter() - stage_start
     
-    # retrieve the relevant chunks from the embeddings
-    results = vector_search(query, embedded_chunks, top_k=top_k)
+    stage_start = time.perf_counter()
+    
+    if tokenizer is not None and (max_prompt_tokens or max_context_tokens):
+        budget = max_context_tokens or max_prompt_tokens
+        if max_prompt_tokens:
+            budget = min(budget, max_prompt_tokens - count_tokens(tokenizer, format_prompt("", query)))
+        version = embedded_chunks.get("version") or f"memory-{id(embedded_chunks)}"
+        prompt = format_prompt(pack_context(results, tokenizer, budget, version), query)
+        timings['prompt'] = time.perf_counter() - stage_start
+        return results, prompt, timings
     
     # construct the context from the retrieved chunks
     context = ""
@@ -115,24 +862,207 @@ def rag_response(query, embedded_chunks, llm, top_k=3, max_context_length=3000):
             context += new_chunk
     
     # create prompt with context and query
-    prompt = f"""Below are some relevant documents:
+    prompt = format_prompt(context, query)
+    timings['prompt'] = time.perf_counter() - stage_start
+    return results, prompt, timings
 
-{context}
+def print_timings(timings, start):
+    print("RAG timings: " + ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in timings.items())
+          + f", total {(time.perf_counter() - start) * 1000:.1f} ms")
 
-Based on the above documents, please answer the following question:
-{query}
+def prompt_budget(llm):
+    # tokenizer and prompt token budget of an LLM, or None when it has no local tokenizer
+    tokenizer = getattr(llm, "tokenizer", None)
+    if tokenizer is None:
+        return {}
+    return {"tokenizer": tokenizer, "max_prompt_tokens": llm.context_window - llm.max_new_tokens}
 
-Answer:"""
+def answer_cache_key(query, embedded_chunks, llm, results):
+    # query embedding, retrieved chunk ids and version (index + model) for the answer cache
+    from .answer_cache import cache_version
+    from .pipeline import import_script
+    embedding = import_script("embed_chunks").encode_query(embedded_chunks["model_name"], query)
+    chunk_ids = [str(result['chunk'].get('chunk_id', result.get('row'))) for result in results]
+    index_version = embedded_chunks.get("version") or f"memory-{id(embedded_chunks)}"
+    return embedding, chunk_ids, cache_version(index_version, getattr(llm, 'model_name', None))
+
+def rag_response(query, embedded_chunks, llm, top_k=3, max_context_length=3000, answer_cache=None, **options):
+    start = time.perf_counter()
+    results, prompt, timings = build_rag_prompt(query, embedded_chunks, top_k, max_context_length,
+                                                **prompt_budget(llm), **options)
+    
+    # a paraphrase of an earlier question that retrieved the same chunks gets its answer
+    if answer_cache is not None:
+        embedding, chunk_ids, version = answer_cache_key(query, embedded_chunks, llm, results)
+        response = answer_cache.get(embedding, chunk_ids, version)
+        if response is not None:
+            print_timings(timings, start)
+            return response
     
     # generate response using the LLM
-    return llm.generate_response(prompt)
+    stage_start = time.perf_counter()
+    response = llm.generate_response(prompt)
+    timings['generation'] = time.perf_counter() - stage_start
+    
+    if answer_cache is not None and response and response != ERROR_RESPONSE:
+        answer_cache.put(query, embedding, chunk_ids, response, version)
+    
+    print_timings(timings, start)
+    return response
+
+def source_summary(result):
+    # the part of a retrieved chunk the client shows as a citation
+    metadata = result['chunk'].get('metadata', {})
+    return {
+        "source": metadata.get('source'),
+        "date": metadata.get('date'),
+        "chunk_id": result['chunk'].get('chunk_id'),
+        "score": float(result.get('rerank_score', result['similarity'])),
+    }
+
+def rag_response_stream(query, embedded_chunks, llm, top_k=3, max_context_length=3000, answer_cache=None,
+                        **options):
+    # streaming variant of rag_response: yields ("sources", [...]) once retrieval is done,
+    # then ("token", text) as the LLM decodes, then ("done", metrics).
+    # a cached answer is sent as a single token event
+    start = time.perf_counter()
+    results, prompt, timings = build_rag_prompt(query, embedded_chunks, top_k, max_context_length,
+                                                **prompt_budget(llm), **options)
+    yield "sources", [source_summary(result) for result in results]
+    
+    cached = None
+    if answer_cache is not None:
+        embedding, chunk_ids, version = answer_cache_key(query, embedded_chunks, llm, results)
+        cached = answer_cache.get(embedding, chunk_ids, version)
+    
+    stage_start = time.perf_counter()
+    first_token = None
+    pieces = []
+    stream = iter([cached]) if cached is not None else llm.stream_response(prompt)
+    try:
+        for text in stream:
+            if first_token is None:
+                # measured from the start of the request, so retrieval is included
+                first_token = time.perf_counter() - start
+            pieces.append(text)
+            yield "token", text
+    finally:
+        # when the client goes away mid-answer, this stops the LLM rather than waiting for garbage collection
+        if cached is None:
+            stream.close()
+    timings['generation'] = time.perf_counter() - stage_start
+    
+    response = "".join(pieces).strip()
+    if answer_cache is not None and cached is None and response:
+        answer_cache.put(query, embedding, chunk_ids, response, version)
+    
+    print_timings(timings, start)
+    metrics = {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+    metrics['request_ttft'] = round(first_token * 1000, 1) if first_token is not None else None
+    yield "done", {"timings_ms": metrics, "cached": cached is not None}
+
+# short RAG-style prompts for check_greedy_equivalence: two share their documents, so the
+# scaffold and document tokens form a common prefix
+EQUIVALENCE_PROMPTS = [
+    format_prompt("Document 1 (Source: check, Date: 1924-11-09):\nThe varsity eleven beat Exeter 14 to 7 "
+                  "before a crowd of two thousand alumni.", "Who won the game?"),
+    format_prompt("Document 1 (Source: check, Date: 1924-11-09):\nThe varsity eleven beat Exeter 14 to 7 "
+                  "before a crowd of two thousand alumni.", "How many people watched?"),
+    format_prompt("Document 1 (Source: check, Date: 1931-03-02):\nThe debating society will meet in the "
+                  "library on Thursday evening to discuss the new dormitory.", "Where will the society meet?"),
+    format_prompt("Document 1 (Source: check, Date: 1947-05-20):\nCommencement exercises are moved indoors "
+                  "after a week of rain.", "Why were the exercises moved?"),
+]
+
+def _greedy_reference(llm, prompt, max_new_tokens):
+    # one cold model.generate per prompt, the output every other path must reproduce
+    ids = llm.tokenizer(prompt, truncation=True)["input_ids"]
+    output = llm.model.generate(
+        input_ids=torch.tensor([ids], device=llm.model.device),
+        attention_mask=torch.ones((1, len(ids)), dtype=torch.long, device=llm.model.device),
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        pad_token_id=llm.tokenizer.eos_token_id,
+    )
+    return llm.tokenizer.decode(output[0, len(ids):], skip_special_tokens=True)
+
+def _scheduler_outputs(scheduler, prompts, max_new_tokens, join_after=None):
+    # greedy outputs of a scheduler; with join_after, the second half of the prompts is
+    # submitted once the first request has decoded that many tokens
+    half = len(prompts) // 2 if join_after else len(prompts)
+    requests = [scheduler.submit(prompt, max_new_tokens, temperature=0) for prompt in prompts[:half]]
+    if join_after:
+        deadline = time.monotonic() + 120
+        while len(requests[0].generated) < join_after and time.monotonic() < deadline:
+            time.sleep(0.005)
+        requests += [scheduler.submit(prompt, max_new_tokens, temperature=0) for prompt in prompts[half:]]
+    return [request.result() for request in requests]
+
+def check_greedy_equivalence(llm, prompts=None, max_new_tokens=32, prefix_block_tokens=(1, 8)):
+    # greedy answers must not depend on how they were computed: compares each path with
+    # one cold model.generate per prompt. returns {path: [indices of differing prompts]}.
+    # prefix-cached paths run every prompt twice, so the second pass resumes from the
+    # longest block-aligned prefix; 1-token blocks reuse all but the last prompt token
+    prompts = prompts or EQUIVALENCE_PROMPTS
+    with torch.inference_mode():
+        reference = [_greedy_reference(llm, prompt, max_new_tokens) for prompt in prompts]
+        paths = {
+            "batched": _scheduler_outputs(GenerationScheduler(llm.model, llm.tokenizer, len(prompts)),
+                                          prompts, max_new_tokens),
+            "batched, joining mid-batch": _scheduler_outputs(
+                GenerationScheduler(llm.model, llm.tokenizer, len(prompts)), prompts, max_new_tokens,
+                join_after=max(1, max_new_tokens // 4)),
+        }
+        for block_tokens in prefix_block_tokens:
+            prefix_cache = PrefixCache(256 * 1024 * 1024, block_tokens)
+            scheduler = GenerationScheduler(llm.model, llm.tokenizer, len(prompts), prefix_cache)
+            for attempt in ("cold", "warm"):
+                paths[f"batched + prefix cache, {block_tokens}-token blocks, {attempt}"] = _scheduler_outputs(
+                    scheduler, prompts, max_new_tokens)
+            
+            if llm.draft_model is None:
+                prefix_cache = PrefixCache(256 * 1024 * 1024, block_tokens)
+                for attempt in ("cold", "warm"):
+                    paths[f"generate + prefix cache, {block_tokens}-token blocks, {attempt}"] = [
+                        llm._generate(prompt, max_new_tokens, 0, prefix_cache=prefix_cache) for prompt in prompts]
+    
+    mismatches = {}
+    for path, outputs in paths.items():
+        mismatches[path] = [i for i, (output, expected) in enumerate(zip(outputs, reference)) if output != expected]
+        for i in mismatches[path]:
+            print(f"{path}: prompt {i} differs\n  expected: {reference[i]!r}\n  got:      {outputs[i]!r}")
+        print(f"{path}: {len(prompts) - len(mismatches[path])}/{len(prompts)} identical to model.generate")
+    return mismatches
+
+def benchmark_concurrency(llm, prompt, concurrency, max_new_tokens=128):
+    # answer the same prompt from `concurrency` threads at once and report aggregate throughput
+    latencies, token_counts = [], []
+    
+    def answer():
+        start = time.perf_counter()
+        response = llm.generate_response(prompt, max_new_tokens=max_new_tokens)
+        latencies.append(time.perf_counter() - start)
+        token_counts.append(len(llm.tokenizer(response, add_special_tokens=False)["input_ids"]))
+    
+    start = time.perf_counter()
+    threads = [threading.Thread(target=answer) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    print(f"{concurrency} concurrent requests: {sum(token_counts) / elapsed:.1f} tokens/sec aggregate, "
+          f"mean latency {sum(latencies) / len(latencies):.2f}s, max {max(latencies):.2f}s")
+    if llm.scheduler is not None:
+        print(f"Scheduler: {llm.scheduler.stats()}")
 
 def main():
     import argparse
     
     parser = argparse.ArgumentParser(description='RAG system with local LLM')
-    parser.add_argument('--embeddings', '-e', default='./chunked_corpus/embedded_chunks.pkl',
-                        help='Path to the embedded chunks pickle file')
+    parser.add_argument('--embeddings', '-e', default='./chunked_corpus/index',
+                        help='Path to the embedding index directory (or a legacy embedded_chunks.pkl)')
     parser.add_argument('--model', '-m', default='TinyLlama/TinyLlama-1.1B-Chat-v1.0',
                         help='Hugging Face model to use')
     parser.add_argument('--device', '-d', choices=['cpu', 'cuda', 'mps'], 
@@ -140,14 +1070,33 @@ def main():
     parser.add_argument('--query', '-q', help='Query to test the RAG system')
     parser.add_argument('--interactive', '-i', action='store_true', 
                         help='Run in interactive mode')
+    parser.add_argument('--max-batch-size', type=int, default=0,
+                        help='Decode up to this many requests together with continuous batching (0 = one at a time)')
+    parser.add_argument('--draft-model',
+                        help='Smaller model proposing tokens for assisted (speculative) decoding')
+    parser.add_argument('--concurrency', type=int, default=0,
+                        help='Answer --query from this many concurrent threads and report aggregate tokens/sec')
+    parser.add_argument('--check-equivalence', action='store_true',
+                        help='Check that batched and prefix-cached greedy decoding match model.generate, then exit')
     
     args = parser.parse_args()
     
+    if args.check_equivalence:
+        llm = LocalLLM(model_name=args.model, device=args.device)
+        mismatches = check_greedy_equivalence(llm)
+        raise SystemExit(1 if any(mismatches.values()) else 0)
+    
     embedded_chunks = load_embedded_chunks(args.embeddings)
     if embedded_chunks is None:
         return
     
-    llm = LocalLLM(model_name=args.model, device=args.device)
+    llm = LocalLLM(model_name=args.model, device=args.device, max_batch_size=args.max_batch_size,
+                   draft_model_name=args.draft_model)
+    
+    if args.query and args.concurrency:
+        _, prompt, _ = build_rag_prompt(args.query, embedded_chunks, **prompt_budget(llm))
+        benchmark_concurrency(llm, prompt, args.concurrency)
+        return
     
     if args.query:
         response = rag_response(args.query, embedded_chunks, llm)
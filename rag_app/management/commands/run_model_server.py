@@ -0,0 +1,65 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+import json
+import os
+import signal
+
+from rag_app.model_server import (
+    ModelHost, ModelServer, ModelClient, ModelServerUnavailable, IndexNotFound, server_authkey, set_model_state
+)
+from rag_app.models import PipelineState
+
+class Command(BaseCommand):
+    help = ('Runs the shared model server that owns the LLM and the search index for all Django workers. '
+            'Starting a second one on the same socket replaces the first without dropping requests')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.MODEL_SERVER_SOCKET,
+                            help='Unix socket path (default: MODEL_SERVER_SOCKET)')
+        parser.add_argument('--model', default=settings.LLM_PRELOAD_MODEL,
+                            help='Model to load before taking over the socket (default: LLM_PRELOAD_MODEL)')
+        parser.add_argument('--draft-model', default=None, help='Draft model for assisted decoding')
+        parser.add_argument('--drain-seconds', type=float, default=settings.MODEL_SERVER_DRAIN_SECONDS,
+                            help='How long in-flight requests may run after a stop or takeover')
+        parser.add_argument('--check', action='store_true',
+                            help='Health check: ping the running server and exit non-zero if it does not answer')
+
+    def handle(self, *args, **options):
+        address = options['socket']
+        if not address:
+            raise CommandError('No socket path: pass --socket or set ARCHIVEBOT_MODEL_SERVER_SOCKET')
+        try:
+            authkey = server_authkey()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        if options['check']:
+            try:
+                health = ModelClient(address, authkey, connect_timeout=0).ping()
+            except ModelServerUnavailable as e:
+                raise CommandError(str(e))
+            self.stdout.write(json.dumps(health))
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(address)), exist_ok=True)
+        host = ModelHost()
+        # the model of a previous server process is gone, unless one is still serving the socket
+        if not os.path.exists(address):
+            set_model_state(PipelineState.get_instance(), model_loaded=False, model_status='idle', model_error=None)
+
+        # warm everything up first, so clients only ever reach a ready server
+        try:
+            host.ensure_index()
+        except IndexNotFound as e:
+            self.stdout.write(f'{e} Queries will fail until it exists.')
+        if options['model']:
+            self.stdout.write(f"Loading model: {options['model']}")
+            host.load_model(options['model'], options['draft_model'], wait=True)
+            if host.llm is None:
+                raise CommandError(f"Failed to load model {options['model']}")
+
+        server = ModelServer(host, address, authkey, drain_seconds=options['drain_seconds'])
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: server.stop())
+        server.serve_forever()
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0002_alter_chatmessage_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipelinestate',
+            name='model_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pipelinestate',
+            name='model_status',
+            field=models.CharField(choices=[('idle', 'Not loaded'), ('queued', 'Queued'), ('loading', 'Loading'), ('warming', 'Warming up'), ('ready', 'Ready'), ('failed', 'Failed')], default='idle', max_length=16),
+        ),
+    ]
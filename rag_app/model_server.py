@@ -0,0 +1,460 @@
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, List
+
+from .models import PipelineState
+from .pipeline import (
+    run_embedding, load_llm, generate_response, generate_response_stream, load_embedding_index,
+    refresh_embedding_index, close_embedding_index, search_many, get_encoder_registry, get_search_caches,
+    get_answer_cache, warm_up_models
+)
+
+MODEL_LOADING_STATES = ('queued', 'loading', 'warming')
+
+class ModelNotReady(Exception):
+    pass
+
+class IndexNotFound(Exception):
+    pass
+
+class ModelServerUnavailable(Exception):
+    pass
+
+class ModelServerError(Exception):
+    pass
+
+# exceptions that keep their type across the socket; anything else arrives as ModelServerError
+REMOTE_EXCEPTIONS = {cls.__name__: cls for cls in (ModelNotReady, IndexNotFound, ValueError)}
+
+def set_model_state(state, **fields):
+    """Update the model fields of the pipeline state without overwriting the others"""
+    for name, value in fields.items():
+        setattr(state, name, value)
+    state.save(update_fields=list(fields))
+
+class ModelHost:
+    """The LLM and the search index of one process, and the operations the views need from them"""
+    def __init__(self):
+        self.llm = None
+        self.embedded_chunks = None
+        self.started = time.time()
+        self._index_lock = threading.Lock()
+        self._loader = None
+
+    def ensure_index(self):
+        # pick up a newer index written by another process (this also retires cached
+        # search results for the old version), then open it if needed
+        with self._index_lock:
+            self.embedded_chunks = refresh_embedding_index(self.embedded_chunks)
+            if not self.embedded_chunks:
+                self.embedded_chunks = load_embedding_index()
+            if not self.embedded_chunks:
+                raise IndexNotFound("Embeddings not found. Please run embedding generation first.")
+            return self.embedded_chunks
+
+    def load_model(self, model_name, draft_model_name=None, wait=False):
+        # load and warm up the LLM on a background thread, tracking progress on PipelineState
+        state = PipelineState.get_instance()
+        set_model_state(state, model_status='queued', model_name=model_name, model_loaded=False, model_error=None)
+
+        def load_model_thread():
+            try:
+                set_model_state(state, model_status='loading')
+                new_llm = load_llm(model_name, draft_model_name)
+                if new_llm is None:
+                    raise RuntimeError(f"Failed to load model {model_name}")
+
+                set_model_state(state, model_status='warming')
+                try:
+                    embedded_chunks = self.ensure_index()
+                except IndexNotFound:
+                    embedded_chunks = None
+                warm_up_models(new_llm, embedded_chunks)
+
+                self.llm = new_llm
+                set_model_state(state, model_status='ready', model_loaded=True)
+                print(f"Model {model_name} loaded and warmed up")
+            except Exception as e:
+                print(f"Exception while loading model: {e}")
+                import traceback
+                traceback.print_exc()
+                set_model_state(state, model_status='failed', model_error=str(e))
+
+        self._loader = threading.Thread(target=load_model_thread, daemon=True)
+        self._loader.start()
+        if wait:
+            self._loader.join()
+
+    def _require_llm(self):
+        if not self.llm:
+            raise ModelNotReady("Model not loaded")
+        return self.llm
+
+    def query(self, query_text, options):
+        llm = self._require_llm()
+        return generate_response(query_text, self.ensure_index(), llm, **options)
+
+    def query_stream(self, query_text, options):
+        # checks run now, so a missing model or index is reported before the stream starts
+        llm = self._require_llm()
+        return generate_response_stream(query_text, self.ensure_index(), llm, **options)
+
+    def search_batch(self, queries, top_k=5, search_mode=None, nprobe=None, filters=None):
+        return search_many(queries, self.ensure_index(), top_k=top_k, search_mode=search_mode, nprobe=nprobe,
+                           filters=filters)
+
+    def reload_index(self):
+        with self._index_lock:
+            self.embedded_chunks = refresh_embedding_index(self.embedded_chunks)
+
+    def rebuild_index(self, state):
+        # embed the chunks and swap in the new index
+        embedded_chunks = run_embedding(state)
+        with self._index_lock:
+            if embedded_chunks is not None:
+                close_embedding_index(self.embedded_chunks)
+                self.embedded_chunks = embedded_chunks
+
+    def reset(self):
+        self.llm = None
+        with self._index_lock:
+            close_embedding_index(self.embedded_chunks)
+            self.embedded_chunks = None
+
+    def ping(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "model_loaded": self.llm is not None,
+            "index_loaded": bool(self.embedded_chunks),
+        }
+
+    def status(self) -> Dict[str, Any]:
+        # reused / encoded / dropped chunk counts of the run that wrote the loaded index
+        last_embedding_run = (self.embedded_chunks or {}).get("manifest", {}).get("embedding_stats")
+        return {
+            "generation": self.llm.stats() if self.llm else None,
+            "encoder": get_encoder_registry().stats(),
+            "search_cache": get_search_caches().cache_stats(),
+            "answer_cache": get_answer_cache().stats(),
+            "last_embedding_run": last_embedding_run,
+        }
+
+class ModelServer:
+    """Serves a ModelHost to other processes over a Unix socket (multiprocessing.connection).
+
+    Every client connection gets its own thread, so requests from many Django workers run
+    concurrently and meet in the LLM's batching scheduler. The socket is bound under a
+    temporary name and renamed into place, so a newly started server takes over the path
+    atomically; the old one notices, stops accepting, lets in-flight requests finish and exits.
+    """
+    OPS = ("ping", "status", "load_model", "query", "query_stream", "search_batch", "reload_index", "reset")
+    STREAM_OPS = ("query_stream",)
+
+    def __init__(self, host: ModelHost, address: str, authkey: bytes, drain_seconds: float = 60):
+        self.host = host
+        self.address = address
+        self.authkey = authkey
+        self.drain_seconds = drain_seconds
+        self.active_requests = 0
+        self.served_requests = 0
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._inode = None
+
+    def stop(self):
+        self._stopping.set()
+
+    def _owns_socket(self) -> bool:
+        try:
+            return os.stat(self.address).st_ino == self._inode
+        except FileNotFoundError:
+            return False
+
+    def serve_forever(self):
+        temporary = f"{self.address}.{os.getpid()}"
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        # the socket is created owner-only, never briefly connectable by other users
+        umask = os.umask(0o077)
+        try:
+            listener = Listener(temporary, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        self._inode = os.stat(temporary).st_ino
+        os.replace(temporary, self.address)
+        print(f"Model server {os.getpid()} listening on {self.address}")
+
+        threading.Thread(target=self._accept_loop, args=(listener,), daemon=True).start()
+        while not self._stopping.wait(1.0):
+            if not self._owns_socket():
+                print(f"{self.address} was taken over by another model server, draining")
+                break
+        self._stopping.set()
+
+        # connection threads finish the request they are in and then close
+        deadline = time.monotonic() + self.drain_seconds
+        for thread in list(self._threads):
+            thread.join(max(0.0, deadline - time.monotonic()))
+        if self.active_requests:
+            print(f"Drain timed out with {self.active_requests} request(s) still running")
+        if self._owns_socket():
+            os.unlink(self.address)
+        try:
+            listener.close()
+        except FileNotFoundError:
+            # the listener unlinks the temporary name it was bound to, which was renamed away
+            pass
+        print(f"Model server {os.getpid()} stopped after {self.served_requests} request(s)")
+
+    def _accept_loop(self, listener):
+        while not self._stopping.is_set():
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # failed authentication or a client that went away during the handshake
+                if not self._stopping.is_set():
+                    print(f"Model server rejected a connection: {e}")
+                continue
+            if self._stopping.is_set():
+                conn.close()
+                break
+            thread = threading.Thread(target=self._serve_connection, args=(conn,), daemon=True)
+            with self._lock:
+                self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+            thread.start()
+
+    def _serve_connection(self, conn):
+        with conn:
+            while not self._stopping.is_set():
+                try:
+                    if not conn.poll(0.5):
+                        continue
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if not self._dispatch(conn, op, args):
+                    return
+
+    def _dispatch(self, conn, op, args) -> bool:
+        # run one request and send its reply; False if the client is gone
+        with self._lock:
+            self.active_requests += 1
+        events = None
+        try:
+            try:
+                if op not in self.OPS:
+                    raise ValueError(f"Unknown model server operation '{op}'")
+                result = getattr(self if op == "ping" else self.host, op)(**args)
+            except Exception as e:
+                self._send_error(conn, op, e)
+                return True
+            if op not in self.STREAM_OPS:
+                conn.send(("ok", result))
+                return True
+
+            events = result
+            conn.send(("ok", None))
+            while True:
+                try:
+                    event = next(events)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    self._send_error(conn, op, e)
+                    return True
+                conn.send(("event", event))
+            conn.send(("end", None))
+            return True
+        except OSError:
+            # the client disconnected, e.g. a browser closing its stream; stop generating for it
+            if events is not None:
+                events.close()
+            return False
+        finally:
+            with self._lock:
+                self.active_requests -= 1
+                self.served_requests += 1
+
+    @staticmethod
+    def _send_error(conn, op, error):
+        if not isinstance(error, (ModelNotReady, IndexNotFound)):
+            print(f"Exception in model server {op}: {error}")
+            import traceback
+            traceback.print_exc()
+        conn.send(("error", type(error).__name__, str(error)))
+
+    def ping(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.host.ping(), "active_requests": self.active_requests,
+                    "served_requests": self.served_requests}
+
+class ModelClient:
+    """Talks to a ModelServer, with the same methods as ModelHost.
+
+    Connections are pooled, one per concurrent request of this process. A request that finds
+    its pooled connection closed (the server restarted) drops the pool and is retried on a new
+    connection, and connecting keeps retrying for connect_timeout seconds while a server is starting.
+    """
+    def __init__(self, address: str, authkey: bytes, timeout: float = 300, connect_timeout: float = 10,
+                 max_idle: int = 8):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                if time.monotonic() >= deadline:
+                    raise ModelServerUnavailable(f"No model server at {self.address}: {e}")
+                time.sleep(0.2)
+
+    def _acquire(self):
+        # an idle connection if there is one, and whether it came from the pool
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _close_idle(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _recv(self, conn, timeout):
+        if not conn.poll(timeout):
+            raise ModelServerUnavailable(f"Model server did not reply within {timeout}s")
+        return conn.recv()
+
+    def _request(self, op, args, timeout):
+        # send a request and wait for its first reply, on a connection that is kept open
+        while True:
+            conn, pooled = self._acquire()
+            try:
+                conn.send((op, args))
+                return conn, self._recv(conn, timeout)
+            except (EOFError, OSError) as e:
+                conn.close()
+                if not pooled:
+                    raise ModelServerUnavailable(f"Lost connection to model server: {e}")
+                # the server this pool was connected to has gone away, so are the other idle connections
+                self._close_idle()
+            except ModelServerUnavailable:
+                conn.close()
+                raise
+
+    @staticmethod
+    def _raise(reply):
+        _, name, message = reply
+        raise REMOTE_EXCEPTIONS.get(name, ModelServerError)(message)
+
+    def call(self, op, timeout=None, **args):
+        conn, reply = self._request(op, args, timeout or self.timeout)
+        self._release(conn)
+        if reply[0] == "error":
+            self._raise(reply)
+        return reply[1]
+
+    def stream(self, op, **args):
+        conn, reply = self._request(op, args, self.timeout)
+        if reply[0] == "error":
+            self._release(conn)
+            self._raise(reply)
+
+        def events():
+            finished = False
+            try:
+                while True:
+                    reply = self._recv(conn, self.timeout)
+                    if reply[0] == "end":
+                        finished = True
+                        return
+                    if reply[0] == "error":
+                        finished = True
+                        self._raise(reply)
+                    yield reply[1]
+            except (EOFError, OSError) as e:
+                raise ModelServerUnavailable(f"Lost connection to model server: {e}")
+            finally:
+                # a stream abandoned halfway leaves unread events behind, so its connection is not reused
+                if finished:
+                    self._release(conn)
+                else:
+                    conn.close()
+        return events()
+
+    def ping(self, timeout: float = 5) -> Dict[str, Any]:
+        return self.call("ping", timeout=timeout)
+
+    def status(self) -> Dict[str, Any]:
+        return self.call("status")
+
+    def load_model(self, model_name, draft_model_name=None):
+        self.call("load_model", model_name=model_name, draft_model_name=draft_model_name)
+
+    def query(self, query_text, options):
+        return self.call("query", query_text=query_text, options=options)
+
+    def query_stream(self, query_text, options):
+        return self.stream("query_stream", query_text=query_text, options=options)
+
+    def search_batch(self, queries, top_k=5, search_mode=None, nprobe=None, filters=None):
+        return self.call("search_batch", queries=queries, top_k=top_k, search_mode=search_mode, nprobe=nprobe,
+                         filters=filters)
+
+    def rebuild_index(self, state):
+        # embedding runs in this process, which only writes the index; the server opens
+        # the new version from disk, so no index or shard workers are started here
+        if run_embedding(state, load=False):
+            self.call("reload_index")
+
+    def reset(self):
+        self.call("reset")
+
+def server_authkey() -> bytes:
+    """Key both ends of the model server socket authenticate with"""
+    from django.conf import settings
+    from django.core.exceptions import ImproperlyConfigured
+    # the socket carries pickled messages, so a publicly known key means arbitrary code execution
+    if settings.MODEL_SERVER_AUTHKEY:
+        return settings.MODEL_SERVER_AUTHKEY.encode()
+    if not settings.SECRET_KEY or settings.SECRET_KEY.startswith('django-insecure-'):
+        raise ImproperlyConfigured('The model server needs ARCHIVEBOT_MODEL_SERVER_AUTHKEY '
+                                   'or a non-default DJANGO_SECRET_KEY')
+    return settings.SECRET_KEY.encode()
+
+_backend = None
+
+def get_model_backend():
+    """The model server client when MODEL_SERVER_SOCKET is set, otherwise this process's own ModelHost"""
+    global _backend
+    if _backend is None:
+        from django.conf import settings
+        if settings.MODEL_SERVER_SOCKET:
+            _backend = ModelClient(
+                settings.MODEL_SERVER_SOCKET, server_authkey(),
+                timeout=settings.MODEL_SERVER_TIMEOUT,
+                connect_timeout=settings.MODEL_SERVER_CONNECT_TIMEOUT,
+                max_idle=settings.MODEL_SERVER_MAX_IDLE_CONNECTIONS,
+            )
+        else:
+            _backend = ModelHost()
+    return _backend
@@ -28,8 +28,18 @@ class PipelineState(models.Model):
     embedding_total_chunks = models.IntegerField(default=0)
     
     # Model state
+    MODEL_STATUS_CHOICES = [
+        ('idle', 'Not loaded'),
+        ('queued', 'Queued'),
+        ('loading', 'Loading'),
+        ('warming', 'Warming up'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
     model_loaded = models.BooleanField(default=False)
     model_name = models.CharField(max_length=255, null=True, blank=True)
+    model_status = models.CharField(max_length=16, choices=MODEL_STATUS_CHOICES, default='idle')
+    model_error = models.TextField(null=True, blank=True)
     
     # Singleton pattern - always use the same record
     @classmethod
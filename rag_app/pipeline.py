@@ -1,11 +1,56 @@
 import os
 import subprocess
-import pickle
 import json
 from typing import Dict, Any, List, Optional
 from django.conf import settings
 import sys
 
+def import_script(module_name):
+    """Make the scripts directory importable and import one of its modules"""
+    import importlib
+    
+    scripts_path = os.path.join(settings.BASE_DIR, "scripts")
+    if scripts_path not in sys.path:
+        sys.path.insert(0, scripts_path)
+    
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as e:
+        print(f"Error importing {module_name}: {e}")
+        print(f"Scripts path: {scripts_path}")
+        print(f"Path exists: {os.path.exists(scripts_path)}")
+        raise
+
+def get_encoder_registry():
+    """Return the process-wide encoder registry, with its memory budget taken from settings"""
+    registry = import_script("encoder_registry").get_registry()
+    budget_mb = getattr(settings, "ENCODER_MEMORY_BUDGET_MB", None)
+    if budget_mb is not None:
+        registry.configure(max_bytes=int(budget_mb * 1024 * 1024))
+    return registry
+
+def get_search_caches():
+    """Return the search_cache module, with cache sizes taken from settings"""
+    search_cache = import_script("search_cache")
+    search_cache.query_embedding_cache.configure(max_entries=settings.QUERY_EMBEDDING_CACHE_MAX_ENTRIES)
+    search_cache.search_result_cache.configure(
+        max_entries=settings.SEARCH_CACHE_MAX_ENTRIES,
+        ttl_seconds=settings.SEARCH_CACHE_TTL_SECONDS,
+    )
+    search_cache.chunk_token_cache.configure(max_entries=settings.CHUNK_TOKEN_CACHE_MAX_ENTRIES)
+    return search_cache
+
+_answer_cache = None
+
+def get_answer_cache():
+    """Return the semantic answer cache, configured from settings"""
+    global _answer_cache
+    if _answer_cache is None:
+        from .answer_cache import SemanticAnswerCache
+        _answer_cache = SemanticAnswerCache(db_path=settings.ANSWER_CACHE_DB)
+    _answer_cache.configure(max_entries=settings.ANSWER_CACHE_MAX_ENTRIES, threshold=settings.ANSWER_CACHE_THRESHOLD)
+    return _answer_cache
+
 # Import your existing pipeline functions
 # Modify them to update the database state
 
@@ -252,21 +297,59 @@ def run_chunking(semantic, state, input_dir=None, output_dir=None):
             else:
                 state.chunking_failed_files.append(text_file)
             state.save()
+        
+        # Stream the per-file chunk outputs into one JSON Lines file for embedding
+        chunk_io = import_script("chunk_io")
+        suffix = "_semantic_chunks.jsonl" if semantic else "_chunks.jsonl"
+        chunk_files = sorted(
+            os.path.join(output_dir, f) for f in os.listdir(output_dir)
+            if f.endswith(suffix) and not f.startswith("all_") and (semantic or not f.endswith("_semantic_chunks.jsonl"))
+        )
+        all_chunks_path = os.path.join(output_dir, chunk_io.chunks_filename("all_chunks", settings.CHUNK_COMPRESSION))
+        if chunk_files:
+            count = chunk_io.merge_chunk_files(chunk_files, all_chunks_path)
+            print(f"Saved all {count} chunks to {all_chunks_path}")
+            
+            # Drop near-duplicate chunks (mastheads, ads, overlap) before they are embedded
+            if settings.DEDUP_CHUNKS:
+                script_path = os.path.join(settings.BASE_DIR, "scripts", "dedup_chunks.py")
+                cmd = ["python", script_path, "--input", all_chunks_path, "--output", all_chunks_path,
+                       "--threshold", str(settings.DEDUP_THRESHOLD), "--bands", str(settings.DEDUP_LSH_BANDS)]
+                result = subprocess.run(cmd, capture_output=True, text=True)
+                print(result.stdout.strip())
+                if result.returncode != 0:
+                    print(f"Error deduplicating chunks: {result.stderr.strip()}")
+        
+        # Rebuild the BM25 inverted index used for hybrid search
+        if os.path.exists(all_chunks_path):
+            script_path = os.path.join(settings.BASE_DIR, "scripts", "bm25_index.py")
+            cmd = ["python", script_path, "--input", all_chunks_path, "--output", str(settings.BM25_INDEX_DIR)]
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            print(result.stdout.strip())
+            if result.returncode != 0:
+                print(f"Error building BM25 index: {result.stderr.strip()}")
     
     except Exception as e:
         print(f"Error in chunking process: {e}")
 
-def run_embedding(state, input_path=None, output_path=None):
-    """Generate embeddings for all chunks"""
+def run_embedding(state, input_path=None, output_path=None, load=True):
+    """Generate embeddings for all chunks, then open the new index (or, with load=False, just report success)"""
     if input_path is None:
-        input_path = os.path.join(str(settings.CHUNKED_CORPUS_DIR), "all_chunks.json")
+        input_path = import_script("chunk_io").find_chunks_file(str(settings.CHUNKED_CORPUS_DIR))
     if output_path is None:
-        output_path = os.path.join(str(settings.CHUNKED_CORPUS_DIR), "embedded_chunks.pkl")
+        output_path = str(settings.EMBEDDING_INDEX_DIR)
         
     try:
         # Call the embed_chunks.py script
         script_path = os.path.join(settings.BASE_DIR, "scripts", "embed_chunks.py")
-        cmd = ["python", script_path, "--input", input_path, "--output", output_path]
+        cmd = ["python", script_path, "--input", input_path, "--output", output_path,
+               "--ann", settings.ANN_INDEX_TYPE]
+        if settings.ANN_NLIST:
+            cmd += ["--nlist", str(settings.ANN_NLIST)]
+        if settings.ANN_INDEX_TYPE == "reduced":
+            cmd += ["--reduced-dim", str(settings.ANN_REDUCED_DIM), "--projection", settings.ANN_REDUCED_PROJECTION,
+                    "--shortlist", str(settings.ANN_SHORTLIST)]
+        cmd += ["--workers", str(settings.EMBEDDING_WORKERS), "--batch-tokens", str(settings.EMBEDDING_BATCH_TOKENS)]
         process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
         
         # Monitor the process
@@ -279,43 +362,185 @@ def run_embedding(state, input_path=None, output_path=None):
                     state.save()
                 except:
                     pass
+            elif line.startswith("Embedded ") and "/" in line:
+                # streaming progress: "Embedded X/Y chunks"
+                try:
+                    state.embedding_completed_chunks = int(line.split("Embedded ")[1].split("/")[0])
+                    state.save()
+                except:
+                    pass
             elif "Embeddings saved to" in line:
                 state.embedding_completed_chunks = state.embedding_total_chunks
                 state.save()
         
         process.wait()
+        if not load:
+            return process.returncode == 0
         
-        # Load the embeddings
-        if os.path.exists(output_path):
-            with open(output_path, 'rb') as f:
-                embedded_chunks = pickle.load(f)
-                print(f"Loaded embeddings for {len(embedded_chunks['chunks'])} chunks")
-                return embedded_chunks
-        return None
+        # Open the freshly written index
+        return load_embedding_index(output_path)
     
     except Exception as e:
         print(f"Error in embedding process: {e}")
+        return None if load else False
+
+def load_embedding_index(index_dir=None, legacy_path=None):
+    """Open the memory-mapped embedding index, converting a legacy pickle if that is all there is"""
+    if index_dir is None:
+        index_dir = str(settings.EMBEDDING_INDEX_DIR)
+    if legacy_path is None:
+        legacy_path = str(settings.LEGACY_EMBEDDINGS_PATH)
+    
+    try:
+        index_store = import_script("index_store")
+        
+        if not index_store.is_index_dir(index_dir):
+            if not os.path.exists(legacy_path):
+                print(f"No embedding index found at {index_dir}")
+                return None
+            print(f"Converting legacy embeddings {legacy_path} to {index_dir}")
+            index_store.convert_pickle(legacy_path, index_dir)
+        
+        embedded_chunks = index_store.load_index(index_dir)
+        print(f"Loaded embeddings for {len(embedded_chunks['chunks'])} chunks")
+        
+        if import_script("bm25_index").attach_bm25(embedded_chunks, str(settings.BM25_INDEX_DIR)):
+            print("Attached BM25 index for hybrid search")
+        
+        if settings.SEARCH_SHARDS > 0:
+            sharded_search = import_script("sharded_search")
+            embedded_chunks["sharded"] = sharded_search.ShardedSearcher(
+                embedded_chunks["index_dir"], settings.SEARCH_SHARDS, settings.SEARCH_SHARD_THREADS
+            ).start()
+        return embedded_chunks
+    except Exception as e:
+        print(f"Error loading embedding index: {e}")
         return None
 
-def load_llm(model_name="TinyLlama/TinyLlama-1.1B-Chat-v1.0"):
-    """Load the language model"""
+def refresh_embedding_index(embedded_chunks, index_dir=None):
+    """Reopen the index if another process has written a newer version or rebuilt its ANN index"""
+    if index_dir is None:
+        index_dir = str(settings.EMBEDDING_INDEX_DIR)
+    if embedded_chunks is None or "version" not in embedded_chunks:
+        return embedded_chunks
+    
+    index_store = import_script("index_store")
+    on_disk = index_store.current_version(index_dir)
+    if on_disk is None:
+        return embedded_chunks
+    if on_disk == embedded_chunks["version"]:
+        # ann_index.py --build rebuilds the ANN structure of a published version in place
+        ann_build = index_store.current_ann_build(index_dir)
+        if ann_build is None or ann_build == embedded_chunks.get("ann_build"):
+            return embedded_chunks
+        print(f"ANN index of {on_disk} rebuilt on disk, reloading")
+    else:
+        print(f"Embedding index changed on disk ({embedded_chunks['version']} -> {on_disk}), reloading")
+    reloaded = load_embedding_index(index_dir)
+    if reloaded is None:
+        return embedded_chunks
+    close_embedding_index(embedded_chunks)
+    return reloaded
+
+def close_embedding_index(embedded_chunks):
+    """Stop the shard workers of an index that is being replaced"""
+    if embedded_chunks and embedded_chunks.get("sharded") is not None:
+        embedded_chunks["sharded"].close()
+
+def load_llm(model_name="TinyLlama/TinyLlama-1.1B-Chat-v1.0", draft_model_name=None):
+    """Load the language model, optionally with a draft model for assisted decoding"""
     try:
         from .llm_interface import LocalLLM
         
         print(f"Loading model: {model_name}")
-        llm = LocalLLM(model_name=model_name)
+        llm = LocalLLM(
+            model_name=model_name,
+            max_batch_size=settings.LLM_MAX_BATCH_SIZE,
+            prefix_cache_mb=settings.PREFIX_CACHE_MAX_MB,
+            prefix_block_tokens=settings.PREFIX_CACHE_BLOCK_TOKENS,
+            cpu_mode=settings.LLM_CPU_MODE,
+            draft_model_name=draft_model_name or settings.LLM_DRAFT_MODEL,
+            # leave the cores of the search shard workers alone
+            num_threads=settings.LLM_NUM_THREADS or import_script("llm_cpu").default_num_threads(
+                reserved=settings.SEARCH_SHARDS * settings.SEARCH_SHARD_THREADS),
+        )
         return llm
     except Exception as e:
         print(f"Error loading model: {e}")
         return None
 
-def generate_response(query, embedded_chunks, llm, top_k=3):
+def warm_up_models(llm, embedded_chunks=None):
+    """Run a short generation and a search so the first real query skips lazy initialization"""
+    import time
+    
+    start = time.perf_counter()
+    try:
+        llm.generate_response("Hello", max_new_tokens=8)
+        print(f"LLM warm-up took {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        print(f"LLM warm-up failed: {e}")
+    
+    start = time.perf_counter()
+    try:
+        if embedded_chunks:
+            # loads the index's query encoder and touches the index, ANN and BM25 structures
+            get_encoder_registry()
+            get_search_caches()
+            import_script("embed_chunks").vector_search(
+                "warm-up", embedded_chunks, top_k=1,
+                search_mode=settings.SEARCH_MODE, nprobe=settings.ANN_NPROBE,
+            )
+        if settings.RERANK_ENABLED:
+            from .llm_interface import get_reranker
+            get_reranker(settings.RERANK_MODEL).model.predict([("warm-up", "warm-up")])
+        print(f"Encoder warm-up took {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        print(f"Encoder warm-up failed: {e}")
+
+def rag_options(search_mode=None, nprobe=None, filters=None, mmr=None, mmr_lambda=None, fetch_k=None, rerank=None):
+    """Retrieval options for rag_response, with unset values taken from settings"""
+    rerank = settings.RERANK_ENABLED if rerank is None else rerank
+    return dict(
+        mmr=settings.MMR_ENABLED if mmr is None else mmr,
+        mmr_lambda=settings.MMR_LAMBDA if mmr_lambda is None else mmr_lambda,
+        fetch_k=fetch_k or settings.MMR_FETCH_K,
+        rerank_model=settings.RERANK_MODEL if rerank else None,
+        rerank_k=settings.RERANK_CANDIDATES,
+        rerank_budget_ms=settings.RERANK_TIME_BUDGET_MS,
+        search_mode=search_mode or settings.SEARCH_MODE,
+        nprobe=nprobe or settings.ANN_NPROBE,
+        bm25_candidates=settings.BM25_CANDIDATES,
+        rrf_k=settings.RRF_K,
+        filters=filters,
+        max_context_tokens=settings.RAG_MAX_CONTEXT_TOKENS,
+        answer_cache=get_answer_cache() if settings.ANSWER_CACHE_ENABLED else None,
+    )
+
+def generate_response(query, embedded_chunks, llm, top_k=3, **options):
     """Generate a response to a query using RAG"""
     try:
         from .llm_interface import rag_response
         
-        response = rag_response(query, embedded_chunks, llm, top_k)
+        response = rag_response(query, embedded_chunks, llm, top_k, **rag_options(**options))
         return response
     except Exception as e:
         print(f"Error generating response: {e}")
-        raise 
\ No newline at end of file
+        raise
+
+def generate_response_stream(query, embedded_chunks, llm, top_k=3, **options):
+    """Stream a RAG response as (event, data) pairs: sources, tokens, then timings"""
+    from .llm_interface import rag_response_stream
+    
+    return rag_response_stream(query, embedded_chunks, llm, top_k, **rag_options(**options))
+
+def search_many(queries, embedded_chunks, top_k=5, search_mode=None, nprobe=None, filters=None):
+    """Retrieve the top chunks for a batch of queries without generating answers"""
+    get_encoder_registry()
+    embed_chunks = import_script("embed_chunks")
+    
+    return embed_chunks.vector_search_many(
+        queries, embedded_chunks, top_k=top_k,
+        search_mode=search_mode or settings.SEARCH_MODE,
+        nprobe=nprobe or settings.ANN_NPROBE,
+        filters=filters,
+    )
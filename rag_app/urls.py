@@ -10,6 +10,8 @@ urlpatterns = [
     path('api/embed', views.embed, name='embed'),
     path('api/load_model', views.load_model, name='load_model'),
     path('api/query', views.query, name='query'),
+    path('api/query_stream', views.query_stream, name='query_stream'),
+    path('api/search_batch', views.search_batch, name='search_batch'),
     path('api/chat_history', views.chat_history, name='chat_history'),
     path('api/reset_state', views.reset_state, name='reset_state'),
 ] 
\ No newline at end of file
@@ -1,19 +1,71 @@
 import json
 import threading
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 from .models import PipelineState, ChatMessage
 
 # Import existing pipeline functions
 from .pipeline import (
-    run_scraping, run_ocr, run_chunking, 
-    run_embedding, load_llm, generate_response
+    run_scraping, run_ocr, run_chunking
 )
+# The LLM and the search index live behind a backend: this process's own ModelHost, or a
+# client of the shared model server when MODEL_SERVER_SOCKET is set
+from .model_server import (
+    get_model_backend, MODEL_LOADING_STATES, ModelNotReady, IndexNotFound, ModelServerUnavailable,
+    ModelServerError
+)
+
+def parse_search_filters(data):
+    """Collect the optional date-range and source filters from a request body"""
+    filters = {}
+    if data.get('date_from'):
+        filters['date_from'] = str(data['date_from'])
+    if data.get('date_to'):
+        filters['date_to'] = str(data['date_to'])
+    sources = data.get('sources')
+    if sources:
+        filters['sources'] = [sources] if isinstance(sources, str) else list(sources)
+    return filters or None
+
+def start_model_loading(model_name, draft_model_name=None):
+    """Load and warm up the LLM in the background, tracking progress on PipelineState"""
+    get_model_backend().load_model(model_name, draft_model_name)
+
+def model_not_ready_response():
+    """Error for queries that arrive before the model is ready"""
+    state = PipelineState.get_instance()
+    if state.model_status in MODEL_LOADING_STATES:
+        return JsonResponse({"error": f"Model is still {state.get_model_status_display().lower()}, please try again shortly",
+                             "status": state.model_status}, status=503)
+    return JsonResponse({"error": "Model not loaded"}, status=400)
 
-# Global variables for the RAG components
-embedded_chunks = None
-llm = None
+def model_server_unavailable_response(error):
+    """Error for requests that cannot reach the model server"""
+    print(f"Model server unavailable: {error}")
+    return JsonResponse({"error": f"Model server unavailable: {error}"}, status=503)
+
+def parse_rag_options(data):
+    """Collect the optional retrieval settings of a query request"""
+    nprobe = data.get('nprobe')
+    mmr = data.get('mmr')  # diversify retrieved chunks, see MMR_* in settings
+    mmr_lambda = data.get('mmr_lambda')
+    fetch_k = data.get('fetch_k')
+    rerank = data.get('rerank')  # cross-encoder rerank, see RERANK_* in settings
+    return dict(
+        search_mode=data.get('search_mode'),  # see SEARCH_MODE in settings
+        nprobe=int(nprobe) if nprobe else None,
+        filters=parse_search_filters(data),  # date_from / date_to (YYYY[-MM[-DD]]), sources
+        mmr=bool(mmr) if mmr is not None else None,
+        mmr_lambda=float(mmr_lambda) if mmr_lambda is not None else None,
+        fetch_k=int(fetch_k) if fetch_k else None,
+        rerank=bool(rerank) if rerank is not None else None,
+    )
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 def index(request):
     """Render the main page"""
@@ -23,6 +75,16 @@ def status(request):
     """Get the current status of all pipeline components"""
     state = PipelineState.get_instance()
     
+    backend = get_model_backend()
+    try:
+        model_stats = backend.status()
+        server = backend.ping()
+    except (ModelServerUnavailable, ModelServerError) as e:
+        model_stats = {}
+        server = {"error": str(e)}
+    server["shared"] = bool(settings.MODEL_SERVER_SOCKET)
+    server["available"] = "error" not in server
+    
     return JsonResponse({
         "scraping": {
             "in_progress": state.scraping_in_progress,
@@ -48,11 +110,19 @@ def status(request):
             "in_progress": state.embedding_in_progress,
             "completed_chunks": state.embedding_completed_chunks,
             "total_chunks": state.embedding_total_chunks,
+            "last_run": model_stats.get("last_embedding_run"),
         },
         "model": {
             "loaded": state.model_loaded,
             "name": state.model_name,
-        }
+            "status": state.model_status,
+            "error": state.model_error,
+        },
+        "model_server": server,
+        "generation": model_stats.get("generation"),
+        "encoder": model_stats.get("encoder"),
+        "search_cache": model_stats.get("search_cache"),
+        "answer_cache": model_stats.get("answer_cache"),
     })
 
 @csrf_exempt
@@ -175,12 +245,13 @@ def embed(request):
                 return JsonResponse({"error": "Embedding already in progress"}, status=400)
             
             def embed_thread():
-                global embedded_chunks
                 try:
                     state.embedding_in_progress = True
                     state.save()
-                    # Store the result in the global variable
-                    embedded_chunks = run_embedding(state)
+                    # Build the index and hand it to whoever answers queries
+                    get_model_backend().rebuild_index(state)
+                except ModelServerUnavailable as e:
+                    print(f"Index rebuilt, but the model server could not be told: {e}")
                 finally:
                     state.embedding_in_progress = False
                     state.save()
@@ -195,32 +266,26 @@ def embed(request):
 
 @csrf_exempt
 def load_model(request):
+    """Start loading a model in the background; progress is reported by /api/status"""
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             model_name = data.get('model_name', 'TinyLlama/TinyLlama-1.1B-Chat-v1.0')
+            draft_model = data.get('draft_model')  # assisted decoding, see LLM_DRAFT_MODEL in settings
             
             state = PipelineState.get_instance()
+            if state.model_status in MODEL_LOADING_STATES:
+                return JsonResponse({"error": "Model is already loading"}, status=400)
             if state.model_loaded:
                 return JsonResponse({"error": "Model already loaded"}, status=400)
             
             print(f"Loading model: {model_name}") 
+            start_model_loading(model_name, draft_model)
             
-            global llm
-            llm = load_llm(model_name)
-            
-            print(f"Model loaded successfully: {llm is not None}") 
-            
-            if llm:
-                state.model_loaded = True
-                state.model_name = model_name
-                state.save()
-                print(f"Model {model_name} loaded and state updated")  
-                return JsonResponse({"message": f"Model {model_name} loaded successfully"})
-            else:
-                print("Failed to load model")  
-                return JsonResponse({"error": "Failed to load model"}, status=500)
+            return JsonResponse({"message": f"Loading model {model_name}", "status": "queued"}, status=202)
                 
+        except ModelServerUnavailable as e:
+            return model_server_unavailable_response(e)
         except Exception as e:
             print(f"Exception in load_model: {e}")  
             import traceback
@@ -235,6 +300,7 @@ def query(request):
         try:
             data = json.loads(request.body)
             query_text = data.get('query', '')
+            options = parse_rag_options(data)
             
             print(f"Received query: '{query_text}'")  # Debug log
             
@@ -242,36 +308,17 @@ def query(request):
                 print("Error: No query provided")  # Debug log
                 return JsonResponse({"error": "No query provided"}, status=400)
             
-            global llm, embedded_chunks
-            
-            print(f"LLM loaded: {llm is not None}")  # Debug log
-            print(f"Embedded chunks loaded: {embedded_chunks is not None}")  # Debug log
-            
-            if not llm:
-                print("Error: Model not loaded")  # Debug log
-                return JsonResponse({"error": "Model not loaded"}, status=400)
-            
-            # Load embeddings if not already loaded
-            if not embedded_chunks:
-                print("Loading embeddings...")  # Debug log
-                from django.conf import settings
-                import os
-                embeddings_path = os.path.join(settings.CHUNKED_CORPUS_DIR, "embedded_chunks.pkl")
-                print(f"Looking for embeddings at: {embeddings_path}")  # Debug log
-                if os.path.exists(embeddings_path):
-                    from .llm_interface import load_embedded_chunks
-                    embedded_chunks = load_embedded_chunks(embeddings_path)
-                    print(f"Embeddings loaded: {embedded_chunks is not None}")  # Debug log
-                else:
-                    print("Error: Embeddings file not found")  # Debug log
-                    return JsonResponse({"error": "Embeddings not found. Please run embedding generation first."}, status=400)
-            
-            if not embedded_chunks:
-                print("Error: Failed to load embeddings")  # Debug log
-                return JsonResponse({"error": "Failed to load embeddings"}, status=400)
-            
             print("Generating response...")  # Debug log
-            response = generate_response(query_text, embedded_chunks, llm)
+            try:
+                response = get_model_backend().query(query_text, options)
+            except ModelNotReady:
+                print("Error: Model not loaded")  # Debug log
+                return model_not_ready_response()
+            except IndexNotFound as e:
+                print("Error: Embeddings not found")  # Debug log
+                return JsonResponse({"error": str(e)}, status=400)
+            except ModelServerUnavailable as e:
+                return model_server_unavailable_response(e)
             print(f"Response generated: {response[:100]}...")  # Debug log (first 100 chars)
             
             # Save to chat history
@@ -291,6 +338,96 @@ def query(request):
     
     return JsonResponse({"error": "Method not allowed"}, status=405)
 
+@csrf_exempt
+def query_stream(request):
+    """Answer a query as a Server-Sent Events stream: sources first, then tokens as they are generated"""
+    if request.method != 'POST':
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        data = json.loads(request.body)
+        query_text = data.get('query', '')
+        options = parse_rag_options(data)
+        
+        if not query_text:
+            return JsonResponse({"error": "No query provided"}, status=400)
+        
+        # model and index problems surface here, before the stream starts
+        stream = get_model_backend().query_stream(query_text, options)
+    except ModelNotReady:
+        return model_not_ready_response()
+    except IndexNotFound as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except ModelServerUnavailable as e:
+        return model_server_unavailable_response(e)
+    except Exception as e:
+        print(f"Exception in query_stream view: {e}")
+        return JsonResponse({"error": str(e)}, status=500)
+    
+    def events():
+        tokens = []
+        try:
+            for event, payload in stream:
+                if event == "token":
+                    tokens.append(payload)
+                    payload = {"text": payload}
+                yield sse_event(event, payload)
+        except Exception as e:
+            print(f"Exception while streaming response: {e}")
+            import traceback
+            traceback.print_exc()
+            yield sse_event("error", {"error": str(e)})
+            return
+        
+        # Save to chat history once the full answer is known
+        ChatMessage.objects.create(
+            message=query_text,
+            response="".join(tokens).strip(),
+            is_user=True
+        )
+    
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@csrf_exempt
+def search_batch(request):
+    """Retrieve the top chunks for many queries in one request, without the LLM"""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            queries = data.get('queries', [])
+            top_k = int(data.get('top_k', 5))
+            search_mode = data.get('search_mode')
+            nprobe = data.get('nprobe')
+            filters = parse_search_filters(data)
+            
+            if not isinstance(queries, list) or not queries:
+                return JsonResponse({"error": "No queries provided"}, status=400)
+            if len(queries) > settings.SEARCH_BATCH_MAX_QUERIES:
+                return JsonResponse({"error": f"At most {settings.SEARCH_BATCH_MAX_QUERIES} queries per request"}, status=400)
+            
+            results = get_model_backend().search_batch(
+                [str(q) for q in queries], top_k=top_k,
+                search_mode=search_mode,
+                nprobe=int(nprobe) if nprobe else None,
+                filters=filters,
+            )
+            
+            return JsonResponse({"results": results})
+        except IndexNotFound as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except ModelServerUnavailable as e:
+            return model_server_unavailable_response(e)
+        except Exception as e:
+            print(f"Exception in search_batch view: {e}")
+            import traceback
+            traceback.print_exc()
+            return JsonResponse({"error": str(e)}, status=500)
+    
+    return JsonResponse({"error": "Method not allowed"}, status=405)
+
 def chat_history(request):
     """Get chat history"""
     messages = ChatMessage.objects.all().order_by('timestamp')
@@ -310,9 +447,7 @@ def chat_history(request):
 def reset_state(request):
     if request.method == 'POST':
         try:
-            global llm, embedded_chunks
-            llm = None
-            embedded_chunks = None
+            get_model_backend().reset()
             
             state = PipelineState.get_instance()
             state.scraping_in_progress = False
@@ -325,6 +460,8 @@ def reset_state(request):
             state.embedding_in_progress = False
             state.model_loaded = False
             state.model_name = None
+            state.model_status = 'idle'
+            state.model_error = None
             state.save()
             
             return JsonResponse({"message": "State reset successfully"})
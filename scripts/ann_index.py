@@ -0,0 +1,511 @@
+import argparse
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from index_store import load_index, normalize_rows
+
+ANN_META_FILE = "ann.json"
+
+def assign_to_centroids(data: np.ndarray, centroids: np.ndarray, spherical: bool = True,
+                        batch_size: int = 8192) -> np.ndarray:
+    # nearest centroid for every row, computed in blocks so memmapped data is streamed
+    n = data.shape[0]
+    assignments = np.empty(n, dtype=np.int32)
+    # for euclidean k-means, argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+    bias = 0.0 if spherical else -0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    for start in range(0, n, batch_size):
+        block = np.asarray(data[start:start + batch_size], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T + bias, axis=1)
+    return assignments
+
+def kmeans(data: np.ndarray, k: int, iterations: int = 20, spherical: bool = True,
+           sample_size: Optional[int] = 65536, seed: int = 0) -> np.ndarray:
+    # lloyd's k-means on a random sample of the rows.
+    # spherical mode keeps centroids unit-length and assigns by dot product (cosine).
+    rng = np.random.default_rng(seed)
+    n = data.shape[0]
+    if sample_size and n > sample_size:
+        train = np.asarray(data[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32)
+    else:
+        train = np.asarray(data, dtype=np.float32)
+
+    k = max(1, min(k, len(train)))
+    centroids = train[rng.choice(len(train), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_to_centroids(train, centroids, spherical)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, train)
+        counts = np.bincount(assignments, minlength=k)
+
+        # re-seed empty clusters from random training rows
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = train[rng.choice(len(train), int(empty.sum()), replace=False)]
+            counts[empty] = 1
+
+        if spherical:
+            centroids = normalize_rows(sums)
+        else:
+            centroids = (sums / counts[:, None]).astype(np.float32)
+
+    return centroids
+
+def top_k_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+    # positions of the top_k highest scores, best first
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+class ExactIndex:
+    # brute-force search over the full matrix, kept as the reference for recall measurements
+    kind = "exact"
+
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, **params) -> "ExactIndex":
+        return cls(embeddings)
+
+    def search(self, query: np.ndarray, top_k: int, **params) -> Tuple[np.ndarray, np.ndarray]:
+        scores = np.asarray(self.embeddings) @ query
+        top = top_k_rows(scores, top_k)
+        return top, scores[top]
+
+    def memory_bytes(self) -> int:
+        return int(self.embeddings.nbytes)
+
+    def save(self, index_dir: str) -> Dict[str, Any]:
+        return {}
+
+    @classmethod
+    def load(cls, index_dir: str, embeddings: np.ndarray, meta: Dict[str, Any]) -> "ExactIndex":
+        return cls(embeddings)
+
+class IVFFlatIndex:
+    # inverted-file index with a spherical k-means coarse quantizer.
+    # rows are stored contiguously per list so a probe is one dense matmul over a slice.
+    kind = "ivf_flat"
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray,
+                 list_vectors: np.ndarray, nprobe: int = 8):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.list_vectors = list_vectors
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @staticmethod
+    def default_nlist(count: int) -> int:
+        # the usual sqrt(N) heuristic, bounded so tiny corpora still get a few lists
+        return int(min(4096, max(1, round(np.sqrt(count)))))
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, nlist: Optional[int] = None, nprobe: int = 8,
+              iterations: int = 20, sample_size: Optional[int] = 65536, seed: int = 0) -> "IVFFlatIndex":
+        count = embeddings.shape[0]
+        if nlist is None:
+            nlist = cls.default_nlist(count)
+
+        print(f"Training IVF coarse quantizer with {nlist} lists on {count} vectors...")
+        centroids = kmeans(embeddings, nlist, iterations=iterations, spherical=True,
+                           sample_size=sample_size, seed=seed)
+        assignments = assign_to_centroids(embeddings, centroids, spherical=True)
+
+        order = np.argsort(assignments, kind='stable').astype(np.int64)
+        counts = np.bincount(assignments, minlength=len(centroids))
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        vectors = np.asarray(embeddings, dtype=np.float32)[order]
+
+        return cls(centroids, offsets, order, vectors, nprobe=nprobe)
+
+    def search(self, query: np.ndarray, top_k: int, nprobe: Optional[int] = None,
+               **params) -> Tuple[np.ndarray, np.ndarray]:
+        # scan the nprobe lists whose centroids are closest to the query
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        id_parts, score_parts = [], []
+        for list_no in probe:
+            start, end = self.list_offsets[list_no], self.list_offsets[list_no + 1]
+            if start == end:
+                continue
+            score_parts.append(self.list_vectors[start:end] @ query)
+            id_parts.append(self.list_ids[start:end])
+
+        if not score_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        ids = np.concatenate(id_parts)
+        scores = np.concatenate(score_parts)
+        top = top_k_rows(scores, top_k)
+        return ids[top], scores[top]
+
+    def memory_bytes(self) -> int:
+        return int(self.centroids.nbytes + self.list_offsets.nbytes + self.list_ids.nbytes + self.list_vectors.nbytes)
+
+    def save(self, index_dir: str) -> Dict[str, Any]:
+        np.save(os.path.join(index_dir, "ivf_centroids.npy"), self.centroids)
+        np.save(os.path.join(index_dir, "ivf_offsets.npy"), self.list_offsets)
+        np.save(os.path.join(index_dir, "ivf_ids.npy"), self.list_ids)
+        np.save(os.path.join(index_dir, "ivf_vectors.npy"), self.list_vectors)
+        return {"nlist": self.nlist, "nprobe": self.nprobe}
+
+    @classmethod
+    def load(cls, index_dir: str, embeddings: np.ndarray, meta: Dict[str, Any]) -> "IVFFlatIndex":
+        return cls(
+            np.load(os.path.join(index_dir, "ivf_centroids.npy")),
+            np.load(os.path.join(index_dir, "ivf_offsets.npy")),
+            np.load(os.path.join(index_dir, "ivf_ids.npy"), mmap_mode='r'),
+            np.load(os.path.join(index_dir, "ivf_vectors.npy"), mmap_mode='r'),
+            nprobe=meta.get("nprobe", 8),
+        )
+
+class PQIndex:
+    # product-quantized index: every vector is split into m sub-vectors and each one is
+    # replaced by the uint8 id of its nearest codeword, so a 384-dim float32 row (1536 bytes)
+    # becomes m bytes. queries are scored with asymmetric distance computation (ADC):
+    # a per-query (m x ksub) lookup table of query/codeword dot products summed over the codes.
+    # the best `rerank` candidates can then be re-scored exactly from the float matrix on disk.
+    kind = "pq"
+
+    def __init__(self, codebooks: np.ndarray, codes: np.ndarray, embeddings: Optional[np.ndarray] = None,
+                 rerank: int = 100):
+        self.codebooks = codebooks
+        self.codes = codes
+        self.embeddings = embeddings
+        self.rerank = rerank
+
+    @property
+    def num_subvectors(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def subvector_dim(self) -> int:
+        return self.codebooks.shape[2]
+
+    @staticmethod
+    def encode(embeddings: np.ndarray, codebooks: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        # uint8 code of the nearest codeword in every subspace, streamed in row blocks.
+        # codes are stored subspace-major (m x N) so ADC reads each subspace contiguously
+        m, _, dsub = codebooks.shape
+        codes = np.empty((m, embeddings.shape[0]), dtype=np.uint8)
+        for start in range(0, embeddings.shape[0], batch_size):
+            block = np.asarray(embeddings[start:start + batch_size], dtype=np.float32)
+            for j in range(m):
+                codes[j, start:start + len(block)] = assign_to_centroids(
+                    block[:, j * dsub:(j + 1) * dsub], codebooks[j], spherical=False)
+        return codes
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, num_subvectors: int = 48, rerank: int = 100,
+              iterations: int = 20, sample_size: Optional[int] = 65536, seed: int = 0) -> "PQIndex":
+        count, dim = embeddings.shape
+        if dim % num_subvectors:
+            raise ValueError(f"Embedding dimension {dim} is not divisible by {num_subvectors} sub-vectors")
+        dsub = dim // num_subvectors
+        ksub = min(256, count)
+
+        rng = np.random.default_rng(seed)
+        if sample_size and count > sample_size:
+            train = np.asarray(embeddings[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+        else:
+            train = np.asarray(embeddings, dtype=np.float32)
+
+        print(f"Training {num_subvectors} PQ codebooks ({ksub} codewords of {dsub} dims) on {len(train)} vectors...")
+        codebooks = np.zeros((num_subvectors, ksub, dsub), dtype=np.float32)
+        for j in range(num_subvectors):
+            codebooks[j] = kmeans(train[:, j * dsub:(j + 1) * dsub], ksub, iterations=iterations,
+                                  spherical=False, sample_size=None, seed=seed + j)
+
+        codes = cls.encode(embeddings, codebooks)
+        return cls(codebooks, codes, embeddings, rerank=rerank)
+
+    def adc_scores(self, query: np.ndarray) -> np.ndarray:
+        # approximate dot products for every row from the lookup table
+        m = self.num_subvectors
+        lut = np.einsum('jkd,jd->jk', self.codebooks, query.reshape(m, self.subvector_dim))
+        scores = np.zeros(self.codes.shape[1], dtype=np.float32)
+        for j in range(m):
+            scores += lut[j].take(self.codes[j])
+        return scores
+
+    def search(self, query: np.ndarray, top_k: int, rerank: Optional[int] = None,
+               **params) -> Tuple[np.ndarray, np.ndarray]:
+        rerank = self.rerank if rerank is None else rerank
+        scores = self.adc_scores(query)
+
+        if not rerank or self.embeddings is None:
+            top = top_k_rows(scores, top_k)
+            return top, scores[top]
+
+        # exact re-ranking of the ADC shortlist, reading rows in file order
+        shortlist = np.sort(top_k_rows(scores, max(rerank, top_k)))
+        exact = np.asarray(self.embeddings[shortlist], dtype=np.float32) @ query
+        top = top_k_rows(exact, top_k)
+        return shortlist[top], exact[top]
+
+    def memory_bytes(self) -> int:
+        # resident size; the float matrix used for re-ranking stays on disk
+        return int(self.codebooks.nbytes + self.codes.nbytes)
+
+    def save(self, index_dir: str) -> Dict[str, Any]:
+        np.save(os.path.join(index_dir, "pq_codebooks.npy"), self.codebooks)
+        np.save(os.path.join(index_dir, "pq_codes.npy"), self.codes)
+        return {"num_subvectors": self.num_subvectors, "ksub": int(self.codebooks.shape[1]), "rerank": self.rerank}
+
+    @classmethod
+    def load(cls, index_dir: str, embeddings: np.ndarray, meta: Dict[str, Any]) -> "PQIndex":
+        # codes are read fully into memory; they are the compact part of the index
+        return cls(
+            np.load(os.path.join(index_dir, "pq_codebooks.npy")),
+            np.load(os.path.join(index_dir, "pq_codes.npy")),
+            embeddings,
+            rerank=meta.get("rerank", 100),
+        )
+
+class ReducedIndex:
+    # two-stage search over a low-dimensional copy of the matrix: the first pass scans
+    # (N x reduced_dim) projected vectors for a shortlist, the second re-scores only that
+    # shortlist with the full vectors on disk. projections are either PCA (top principal
+    # directions of a sample) or Matryoshka-style prefixes (the first reduced_dim dims,
+    # for models trained so that prefixes remain meaningful).
+    # scores are (x P) . (q P): for PCA this ranks rows like ((x - mean) P) . (q P),
+    # since the mean only adds the same constant to every row's score
+    kind = "reduced"
+
+    def __init__(self, projection: np.ndarray, vectors: np.ndarray, embeddings: Optional[np.ndarray] = None,
+                 shortlist: int = 100, method: str = "pca"):
+        self.projection = projection
+        self.vectors = vectors
+        self.embeddings = embeddings
+        self.shortlist = shortlist
+        self.method = method
+
+    @property
+    def reduced_dim(self) -> int:
+        return self.projection.shape[1]
+
+    @staticmethod
+    def pca_projection(embeddings: np.ndarray, reduced_dim: int, sample_size: Optional[int] = 65536,
+                       seed: int = 0) -> np.ndarray:
+        # (dim x reduced_dim) matrix of the top principal directions of a row sample
+        rng = np.random.default_rng(seed)
+        count = embeddings.shape[0]
+        if sample_size and count > sample_size:
+            train = np.asarray(embeddings[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+        else:
+            train = np.asarray(embeddings, dtype=np.float32)
+        centered = train - train.mean(axis=0)
+        _, _, vt = np.linalg.svd(centered, full_matrices=False)
+        return np.ascontiguousarray(vt[:reduced_dim].T, dtype=np.float32)
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, reduced_dim: int = 64, shortlist: int = 100, method: str = "pca",
+              sample_size: Optional[int] = 65536, seed: int = 0, batch_size: int = 65536) -> "ReducedIndex":
+        count, dim = embeddings.shape
+        reduced_dim = max(1, min(reduced_dim, dim))
+        if method == "pca":
+            print(f"Fitting PCA projection to {reduced_dim} of {dim} dims...")
+            projection = cls.pca_projection(embeddings, reduced_dim, sample_size, seed)
+        elif method == "prefix":
+            projection = np.eye(dim, reduced_dim, dtype=np.float32)
+        else:
+            raise ValueError(f"Unknown projection '{method}', expected 'pca' or 'prefix'")
+
+        vectors = np.empty((count, reduced_dim), dtype=np.float32)
+        for start in range(0, count, batch_size):
+            vectors[start:start + batch_size] = np.asarray(embeddings[start:start + batch_size], dtype=np.float32) @ projection
+        return cls(projection, vectors, embeddings, shortlist=shortlist, method=method)
+
+    def search(self, query: np.ndarray, top_k: int, shortlist: Optional[int] = None,
+               **params) -> Tuple[np.ndarray, np.ndarray]:
+        shortlist = self.shortlist if shortlist is None else shortlist
+        approx = self.vectors @ (query @ self.projection)
+
+        if not shortlist or self.embeddings is None:
+            top = top_k_rows(approx, top_k)
+            return top, approx[top]
+
+        # exact re-scoring of the shortlist, reading rows in file order
+        candidates = np.sort(top_k_rows(approx, max(shortlist, top_k)))
+        exact = np.asarray(self.embeddings[candidates], dtype=np.float32) @ query
+        top = top_k_rows(exact, top_k)
+        return candidates[top], exact[top]
+
+    def memory_bytes(self) -> int:
+        # resident size; the full matrix is only read for shortlisted rows
+        return int(self.projection.nbytes + self.vectors.nbytes)
+
+    def save(self, index_dir: str) -> Dict[str, Any]:
+        np.save(os.path.join(index_dir, "reduced_projection.npy"), self.projection)
+        np.save(os.path.join(index_dir, "reduced_vectors.npy"), self.vectors)
+        return {"reduced_dim": self.reduced_dim, "shortlist": self.shortlist, "method": self.method}
+
+    @classmethod
+    def load(cls, index_dir: str, embeddings: np.ndarray, meta: Dict[str, Any]) -> "ReducedIndex":
+        return cls(
+            np.load(os.path.join(index_dir, "reduced_projection.npy")),
+            np.load(os.path.join(index_dir, "reduced_vectors.npy")),
+            embeddings,
+            shortlist=meta.get("shortlist", 100),
+            method=meta.get("method", "pca"),
+        )
+
+# index types that can be built with --ann and attached to a loaded index
+ANN_INDEX_TYPES = {
+    ExactIndex.kind: ExactIndex,
+    IVFFlatIndex.kind: IVFFlatIndex,
+    PQIndex.kind: PQIndex,
+    ReducedIndex.kind: ReducedIndex,
+}
+
+def build_ann_index(index_dir: str, kind: str = IVFFlatIndex.kind, **params):
+    # build an ANN structure for an existing index directory and record it in ann.json.
+    # each build gets its own ann-<build id> subdirectory and ann.json is switched to it
+    # last and atomically, so a rebuild of a published index never rewrites files that
+    # readers have memory-mapped; the build id lets serving processes notice the rebuild
+    if kind not in ANN_INDEX_TYPES:
+        raise ValueError(f"Unknown ANN index type '{kind}', expected one of {sorted(ANN_INDEX_TYPES)}")
+
+    index = load_index(index_dir)
+    # write into the version that was loaded, even if a newer one is published meanwhile
+    index_dir = index["index_dir"]
+    previous = read_ann_meta(index_dir) or {}
+    start = time.perf_counter()
+    ann = ANN_INDEX_TYPES[kind].build(index["embeddings"], **params)
+    build_id = uuid.uuid4().hex
+    ann_dir = f"ann-{build_id}"
+    os.makedirs(os.path.join(index_dir, ann_dir))
+    meta = ann.save(os.path.join(index_dir, ann_dir))
+    meta.update({"kind": kind, "index_version": index["version"], "build_id": build_id, "dir": ann_dir})
+    meta_path = os.path.join(index_dir, ANN_META_FILE)
+    with open(f"{meta_path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+    # the build being replaced stays for processes still opening it; older ones are removed
+    for entry in os.listdir(index_dir):
+        if entry.startswith("ann-") and entry not in (ann_dir, previous.get("dir")):
+            shutil.rmtree(os.path.join(index_dir, entry), ignore_errors=True)
+    print(f"Built {kind} ANN index in {time.perf_counter() - start:.2f}s")
+    return ann
+
+def read_ann_meta(index_dir: str) -> Optional[Dict[str, Any]]:
+    # contents of ann.json, or None if the index has no ANN structure
+    try:
+        with open(os.path.join(index_dir, ANN_META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def load_ann_index(index_dir: str, embeddings: np.ndarray, index_version: str,
+                   meta: Optional[Dict[str, Any]] = None):
+    # the ANN structure for an index, or None if it is missing or was built for an older version
+    meta = meta or read_ann_meta(index_dir)
+    if meta is None:
+        return None
+    if meta.get("index_version") != index_version:
+        print(f"Ignoring stale ANN index in {index_dir}")
+        return None
+    index_type = ANN_INDEX_TYPES.get(meta.get("kind"))
+    if index_type is None:
+        return None
+    return index_type.load(os.path.join(index_dir, meta.get("dir", "")), embeddings, meta)
+
+def evaluate_recall(index: Dict[str, Any], ann, queries: np.ndarray, top_k: int = 10,
+                    param: str = "nprobe", values=(1, 2, 4, 8, 16, 32)) -> Dict[Any, Dict[str, float]]:
+    # recall@k and mean latency of the ANN index against exact search for each value
+    # of its tuning knob (nprobe for IVF, rerank shortlist size for PQ, shortlist for reduced)
+    exact = ExactIndex(index["embeddings"])
+    start = time.perf_counter()
+    truth = [set(exact.search(q, top_k)[0].tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"exact: {exact_ms:.3f} ms/query")
+
+    report = {}
+    for value in values:
+        start = time.perf_counter()
+        found = [ann.search(q, top_k, **{param: value})[0] for q in queries]
+        ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([len(t.intersection(f.tolist())) / max(1, len(t)) for t, f in zip(truth, found)])
+        report[value] = {"recall": float(recall), "ms_per_query": ann_ms, "exact_ms_per_query": exact_ms}
+        print(f"{param}={value}: recall@{top_k}={recall:.3f}, {ann_ms:.3f} ms/query")
+    return report
+
+def memory_report(index: Dict[str, Any], ann) -> Dict[str, int]:
+    # resident bytes of the ANN structure next to the full-precision matrix
+    report = {
+        "float32_matrix_bytes": int(index["embeddings"].nbytes),
+        "ann_resident_bytes": ann.memory_bytes(),
+    }
+    ratio = report["float32_matrix_bytes"] / max(1, report["ann_resident_bytes"])
+    print(f"float32 matrix: {report['float32_matrix_bytes'] / 2**20:.1f} MiB, "
+          f"{ann.kind} resident: {report['ann_resident_bytes'] / 2**20:.1f} MiB ({ratio:.1f}x)")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or evaluate the ANN index for an embedding index')
+    parser.add_argument('--index', default='./chunked_corpus/index', help='Embedding index directory')
+    parser.add_argument('--kind', default=IVFFlatIndex.kind, choices=sorted(ANN_INDEX_TYPES),
+                        help='ANN index type to build')
+    parser.add_argument('--nlist', type=int, help='Number of IVF lists (default: sqrt of the row count)')
+    parser.add_argument('--pq-subvectors', type=int, default=48, help='Number of PQ sub-vectors (must divide the dimension)')
+    parser.add_argument('--reduced-dim', type=int, default=64, help='Projected dimension for --kind reduced')
+    parser.add_argument('--projection', default='pca', choices=['pca', 'prefix'],
+                        help='PCA projection or Matryoshka-style prefix truncation for --kind reduced')
+    parser.add_argument('--build', action='store_true', help='(Re)build the ANN index before evaluating')
+    parser.add_argument('--queries', type=int, default=200, help='Number of indexed rows to reuse as queries')
+    parser.add_argument('--top-k', '-k', type=int, default=10, help='k for recall@k')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='nprobe values to compare against exact search (IVF)')
+    parser.add_argument('--rerank', type=int, nargs='+', default=[0, 20, 50, 100, 200],
+                        help='Re-rank shortlist sizes to compare against exact search (PQ, 0 = ADC only)')
+    parser.add_argument('--shortlist', type=int, nargs='+', default=[0, 20, 50, 100, 200, 500],
+                        help='First-pass shortlist sizes to compare against exact search (reduced, 0 = projection only)')
+    args = parser.parse_args()
+
+    if args.build:
+        params = {}
+        if args.kind == IVFFlatIndex.kind:
+            params = {"nlist": args.nlist}
+        elif args.kind == PQIndex.kind:
+            params = {"num_subvectors": args.pq_subvectors}
+        elif args.kind == ReducedIndex.kind:
+            params = {"reduced_dim": args.reduced_dim, "method": args.projection}
+        build_ann_index(args.index, args.kind, **params)
+
+    index = load_index(args.index)
+    ann = load_ann_index(args.index, index["embeddings"], index["version"])
+    if ann is None:
+        print("No ANN index found, run with --build first")
+        return
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(index["chunks"]), min(args.queries, len(index["chunks"])), replace=False)
+    queries = np.asarray(index["embeddings"][np.sort(rows)], dtype=np.float32)
+    memory_report(index, ann)
+    if ann.kind == PQIndex.kind:
+        evaluate_recall(index, ann, queries, args.top_k, "rerank", args.rerank)
+    elif ann.kind == ReducedIndex.kind:
+        evaluate_recall(index, ann, queries, args.top_k, "shortlist", args.shortlist)
+    else:
+        evaluate_recall(index, ann, queries, args.top_k, "nprobe", args.nprobe)
+
+if __name__ == "__main__":
+    main()
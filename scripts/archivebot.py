@@ -4,8 +4,8 @@ from rag_app.llm_interface import LocalLLM, load_embedded_chunks, rag_response
 
 def main():
     parser = argparse.ArgumentParser(description='ArchiveBot: RAG system for archived materials')
-    parser.add_argument('--embeddings', '-e', default='./chunked_corpus/embedded_chunks.pkl',
-                        help='Path to the embedded chunks pickle file')
+    parser.add_argument('--embeddings', '-e', default='./chunked_corpus/index',
+                        help='Path to the embedding index directory (or a legacy embedded_chunks.pkl)')
     parser.add_argument('--model', '-m', default='TinyLlama/TinyLlama-1.1B-Chat-v1.0',
                         help='Hugging Face model to use')
     parser.add_argument('--device', '-d', choices=['cpu', 'cuda', 'mps'], 
@@ -19,7 +19,7 @@ def main():
     if not os.path.exists(args.embeddings):
         print(f"Error: Embeddings file {args.embeddings} not found.")
         print("Please run the embedding generation script first:")
-        print("python embed_chunks.py --input ./chunked_corpus/all_chunks.json --output ./chunked_corpus/embedded_chunks.pkl")
+        print("python embed_chunks.py --input ./chunked_corpus/all_chunks.jsonl --output ./chunked_corpus/index")
         return
     
     # load embedded chunks
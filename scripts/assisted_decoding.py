@@ -0,0 +1,58 @@
+import time
+from typing import Any, Dict, Tuple
+
+class ForwardCounter:
+    # counts forward passes of a module through a forward hook
+    def __init__(self, module):
+        self.count = 0
+        self._handle = module.register_forward_hook(self._hook)
+
+    def _hook(self, module, inputs, output):
+        self.count += 1
+
+    def remove(self):
+        self._handle.remove()
+
+def same_vocabulary(tokenizer, draft_tokenizer) -> bool:
+    # draft and target can exchange token ids directly only if their vocabularies match
+    return tokenizer.get_vocab() == draft_tokenizer.get_vocab()
+
+def assisted_generate(model, draft_model, prompt_length: int, **generate_kwargs) -> Tuple[Any, Dict[str, Any]]:
+    # model.generate with draft_model proposing tokens that model verifies in one forward
+    # pass per round. returns the generate output and counts for acceptance_rate
+    target = ForwardCounter(model)
+    draft = ForwardCounter(draft_model)
+    start = time.perf_counter()
+    try:
+        output = model.generate(assistant_model=draft_model, **generate_kwargs)
+    finally:
+        target.remove()
+        draft.remove()
+    seconds = time.perf_counter() - start
+
+    sequences = output.sequences if hasattr(output, "sequences") else output
+    return output, {
+        "new_tokens": int(sequences.shape[1] - prompt_length),
+        "target_forwards": target.count,
+        "draft_forwards": draft.count,
+        "seconds": seconds,
+    }
+
+def acceptance_rate(new_tokens: int, target_forwards: int, draft_forwards: int) -> float:
+    # fraction of drafted tokens the target model kept. every verification pass of the
+    # target yields exactly one token of its own (a correction or a bonus token), so the
+    # remaining new tokens are accepted draft proposals; each draft forward proposes one
+    if not draft_forwards:
+        return 0.0
+    return max(0, new_tokens - target_forwards) / draft_forwards
+
+def summarize(stats: Dict[str, Any]) -> Dict[str, Any]:
+    # acceptance rate, tokens per target forward and throughput from accumulated counts
+    return {
+        **stats,
+        "acceptance_rate": round(acceptance_rate(stats["new_tokens"], stats["target_forwards"],
+                                                 stats["draft_forwards"]), 3),
+        "tokens_per_target_forward": round(stats["new_tokens"] / stats["target_forwards"], 2)
+                                     if stats["target_forwards"] else 0.0,
+        "tokens_per_second": round(stats["new_tokens"] / stats["seconds"], 2) if stats["seconds"] else 0.0,
+    }
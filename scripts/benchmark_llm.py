@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+from assisted_decoding import assisted_generate, summarize
+from llm_cpu import CPU_MODES, configure_threads, default_num_threads, optimize_for_cpu, rss_bytes
+
+# filler for the benchmark prompt, roughly the shape of an OCR'd newspaper chunk
+FILLER = ("The varsity football team travelled to Exeter on Saturday for the annual game, "
+          "where a crowd of alumni and students watched from the stands. ")
+
+def build_prompt(tokenizer, prompt_tokens: int) -> str:
+    # a RAG-style prompt padded with filler text to about prompt_tokens tokens
+    prompt = "Below are some relevant documents:\n\nDocument 1 (Source: benchmark, Date: 2024-11-09):\n"
+    question = "\n\nBased on the above documents, please answer the following question:\nWho won the game?\n\nAnswer:"
+    filler_tokens = len(tokenizer(FILLER, add_special_tokens=False)["input_ids"])
+    repeats = max(1, (prompt_tokens - len(tokenizer(prompt + question)["input_ids"])) // filler_tokens)
+    return prompt + FILLER * repeats + question
+
+def run_mode(model_name: str, mode: str, prompt_tokens: int, max_new_tokens: int, num_threads: int,
+             draft_model_name: str = None) -> Dict[str, Any]:
+    # load time, resident memory, prefill latency and decode throughput of one CPU mode,
+    # plus sampled decoding with and without a draft model when one is given.
+    # meant to run in a fresh process so RSS is not polluted by other modes
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    configure_threads(num_threads)
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = optimize_for_cpu(AutoModelForCausalLM.from_pretrained(model_name), mode)
+    load_seconds = time.perf_counter() - start
+
+    inputs = tokenizer(build_prompt(tokenizer, prompt_tokens), return_tensors="pt")
+    generate = dict(do_sample=False, pad_token_id=tokenizer.eos_token_id)
+    with torch.inference_mode():
+        # warm-up, then time the prompt pass on its own and a fixed-length generation
+        model.generate(**inputs, max_new_tokens=4, **generate)
+
+        start = time.perf_counter()
+        model(**inputs)
+        prefill_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        output = model.generate(**inputs, max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens, **generate)
+        generate_seconds = time.perf_counter() - start
+
+    prompt_length = inputs["input_ids"].shape[1]
+    result = {
+        "mode": mode,
+        "threads": torch.get_num_threads(),
+        "load_seconds": load_seconds,
+        "rss_mb": rss_bytes() / 2**20,
+        "prompt_tokens": int(prompt_length),
+        "prefill_ms": prefill_seconds * 1000,
+        "tokens_per_second": (output.shape[1] - prompt_length) / generate_seconds,
+    }
+
+    if draft_model_name:
+        # plain sampling vs. assisted sampling at the settings LocalLLM uses
+        draft_model = optimize_for_cpu(AutoModelForCausalLM.from_pretrained(draft_model_name), mode)
+        sample = dict(do_sample=True, temperature=0.7, top_p=0.95, pad_token_id=tokenizer.eos_token_id,
+                      max_new_tokens=max_new_tokens)
+        with torch.inference_mode():
+            start = time.perf_counter()
+            output = model.generate(**inputs, **sample)
+            result["sampled_tokens_per_second"] = (output.shape[1] - prompt_length) / (time.perf_counter() - start)
+            _, counts = assisted_generate(model, draft_model, prompt_length, **inputs, **sample)
+        assisted = summarize(counts)
+        result["assisted_tokens_per_second"] = assisted["tokens_per_second"]
+        result["acceptance_rate"] = assisted["acceptance_rate"]
+    return result
+
+def benchmark(model_name: str, modes: List[str], prompt_tokens: int = 512, max_new_tokens: int = 64,
+              num_threads: int = 0, draft_model_name: str = None) -> List[Dict[str, Any]]:
+    # run every mode in its own process and print a comparison against the first one
+    results = []
+    for mode in modes:
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", "--model", model_name, "--modes", mode,
+               "--prompt-tokens", str(prompt_tokens), "--max-new-tokens", str(max_new_tokens),
+               "--threads", str(num_threads)]
+        if draft_model_name:
+            cmd += ["--draft-model", draft_model_name]
+        print(f"Benchmarking {mode}...")
+        process = subprocess.run(cmd, capture_output=True, text=True)
+        if process.returncode != 0:
+            print(f"{mode} failed:\n{process.stderr.strip()}")
+            continue
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    if not results:
+        return results
+    baseline = results[0]
+    print(f"\n{model_name}, {baseline['prompt_tokens']} prompt tokens, {max_new_tokens} new tokens, "
+          f"{baseline['threads']} thread(s)")
+    print(f"{'mode':<6} {'load s':>8} {'RSS MiB':>9} {'prefill ms':>11} {'tokens/s':>9} {'speedup':>8}")
+    for result in results:
+        print(f"{result['mode']:<6} {result['load_seconds']:>8.1f} {result['rss_mb']:>9.0f} "
+              f"{result['prefill_ms']:>11.0f} {result['tokens_per_second']:>9.2f} "
+              f"{result['tokens_per_second'] / baseline['tokens_per_second']:>7.2f}x")
+
+    if draft_model_name:
+        print(f"\nAssisted decoding with {draft_model_name} (sampled, temperature 0.7)")
+        print(f"{'mode':<6} {'plain tok/s':>12} {'assisted tok/s':>15} {'speedup':>8} {'acceptance':>11}")
+        for result in results:
+            print(f"{result['mode']:<6} {result['sampled_tokens_per_second']:>12.2f} "
+                  f"{result['assisted_tokens_per_second']:>15.2f} "
+                  f"{result['assisted_tokens_per_second'] / result['sampled_tokens_per_second']:>7.2f}x "
+                  f"{result['acceptance_rate']:>10.0%}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare LLM load time, memory and speed across CPU inference modes')
+    parser.add_argument('--model', '-m', default='TinyLlama/TinyLlama-1.1B-Chat-v1.0',
+                        help='Hugging Face model to benchmark')
+    parser.add_argument('--modes', nargs='+', default=['fp32', 'int8'], choices=CPU_MODES,
+                        help='CPU modes to compare; the first is the baseline')
+    parser.add_argument('--prompt-tokens', type=int, default=512, help='Approximate prompt length')
+    parser.add_argument('--max-new-tokens', type=int, default=64, help='Tokens generated per run')
+    parser.add_argument('--threads', type=int, default=0, help='Torch threads (0 = all available cores)')
+    parser.add_argument('--draft-model',
+                        help='Also compare sampled decoding with and without this draft model (assisted decoding)')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    num_threads = args.threads or default_num_threads()
+    if args.child:
+        result = run_mode(args.model, args.modes[0], args.prompt_tokens, args.max_new_tokens, num_threads,
+                          args.draft_model)
+        print(json.dumps(result))
+        return
+    benchmark(args.model, args.modes, args.prompt_tokens, args.max_new_tokens, num_threads, args.draft_model)
+
+if __name__ == "__main__":
+    main()
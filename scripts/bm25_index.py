@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from chunk_io import iter_chunks
+
+BM25_META_FILE = "bm25.json"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# very common words carry no signal for BM25 and only lengthen the postings lists
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i in is it its of on or our
+she that the their them they this to was we were what when where which who will with you your
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+class BM25Index:
+    # inverted index with CSR-style postings: the documents containing term t are
+    # doc_ids[term_offsets[t]:term_offsets[t + 1]], with matching term_freqs.
+    # doc ids are positions in the chunk file the index was built from.
+    def __init__(self, vocab: Dict[str, int], term_offsets: np.ndarray, doc_ids: np.ndarray,
+                 term_freqs: np.ndarray, doc_lengths: np.ndarray, chunk_ids: List[str],
+                 k1: float = 1.2, b: float = 0.75):
+        self.vocab = vocab
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.chunk_ids = chunk_ids
+        self.k1 = k1
+        self.b = b
+        self.avgdl = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        # maps doc ids to rows of an embedding index, set by align_to()
+        self.row_of_doc: Optional[np.ndarray] = None
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, chunks: Iterable[Dict[str, Any]], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        vocab: Dict[str, int] = {}
+        term_parts, doc_parts, tf_parts = [], [], []
+        doc_lengths, chunk_ids = [], []
+
+        for doc_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk.get("text", ""))
+            counts = Counter(tokens)
+            doc_lengths.append(len(tokens))
+            chunk_ids.append(chunk.get("chunk_id"))
+            if not counts:
+                continue
+            term_parts.append(np.fromiter((vocab.setdefault(t, len(vocab)) for t in counts), dtype=np.int32, count=len(counts)))
+            tf_parts.append(np.fromiter(counts.values(), dtype=np.int64, count=len(counts)))
+            doc_parts.append(np.full(len(counts), doc_id, dtype=np.int32))
+
+        if term_parts:
+            terms = np.concatenate(term_parts)
+            docs = np.concatenate(doc_parts)
+            tfs = np.minimum(np.concatenate(tf_parts), np.iinfo(np.uint16).max).astype(np.uint16)
+        else:
+            terms = np.empty(0, dtype=np.int32)
+            docs = np.empty(0, dtype=np.int32)
+            tfs = np.empty(0, dtype=np.uint16)
+
+        # group postings by term; the stable sort keeps doc ids ascending inside each list
+        order = np.argsort(terms, kind='stable')
+        term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum(np.bincount(terms, minlength=len(vocab)))
+
+        return cls(vocab, term_offsets, docs[order], tfs[order],
+                   np.asarray(doc_lengths, dtype=np.int32), chunk_ids, k1=k1, b=b)
+
+    def scores(self, query: str, doc_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        # BM25 score of every document for the query (0 for documents without any query term)
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        if not self.num_docs:
+            return scores
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end].astype(np.float32)
+            if doc_mask is not None:
+                keep = doc_mask[docs]
+                docs, tf = docs[keep], tf[keep]
+            df = end - start
+            idf = np.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[docs] / max(self.avgdl, 1e-9))
+            # each doc appears once per postings list, so plain fancy-index += is safe
+            scores[docs] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+        return scores
+
+    def search(self, query: str, top_k: int, doc_mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # top documents with a non-zero score, best first
+        scores = self.scores(query, doc_mask)
+        matched = np.flatnonzero(scores)
+        k = min(top_k, len(matched))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def align_to(self, index_chunk_ids: Sequence[str]):
+        # map doc ids onto the rows of an embedding index by chunk_id (-1 when absent)
+        row_by_id = {chunk_id: row for row, chunk_id in enumerate(index_chunk_ids)}
+        self.row_of_doc = np.fromiter((row_by_id.get(c, -1) for c in self.chunk_ids),
+                                      dtype=np.int64, count=len(self.chunk_ids))
+
+    def search_rows(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # like search(), but returning embedding-index rows; requires align_to()
+        docs, scores = self.search(query, top_k)
+        rows = self.row_of_doc[docs]
+        keep = rows >= 0
+        return rows[keep], scores[keep]
+
+    def memory_bytes(self) -> int:
+        return int(self.term_offsets.nbytes + self.doc_ids.nbytes + self.term_freqs.nbytes + self.doc_lengths.nbytes)
+
+    def save(self, output_dir: str):
+        os.makedirs(output_dir, exist_ok=True)
+        np.save(os.path.join(output_dir, "bm25_term_offsets.npy"), self.term_offsets)
+        np.save(os.path.join(output_dir, "bm25_doc_ids.npy"), self.doc_ids)
+        np.save(os.path.join(output_dir, "bm25_term_freqs.npy"), self.term_freqs)
+        np.save(os.path.join(output_dir, "bm25_doc_lengths.npy"), self.doc_lengths)
+        with open(os.path.join(output_dir, "bm25_vocab.json"), 'w', encoding='utf-8') as f:
+            json.dump(self.vocab, f)
+        with open(os.path.join(output_dir, BM25_META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"k1": self.k1, "b": self.b, "num_docs": self.num_docs, "chunk_ids": self.chunk_ids}, f)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "BM25Index":
+        with open(os.path.join(index_dir, BM25_META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(index_dir, "bm25_vocab.json"), 'r', encoding='utf-8') as f:
+            vocab = json.load(f)
+        return cls(
+            vocab,
+            np.load(os.path.join(index_dir, "bm25_term_offsets.npy")),
+            np.load(os.path.join(index_dir, "bm25_doc_ids.npy"), mmap_mode='r'),
+            np.load(os.path.join(index_dir, "bm25_term_freqs.npy"), mmap_mode='r'),
+            np.load(os.path.join(index_dir, "bm25_doc_lengths.npy")),
+            meta["chunk_ids"],
+            k1=meta.get("k1", 1.2),
+            b=meta.get("b", 0.75),
+        )
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    # fuse several best-first lists of row ids: score(row) = sum 1 / (k + rank)
+    if not rankings or all(len(r) == 0 for r in rankings):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    rows = np.concatenate([np.asarray(r, dtype=np.int64) for r in rankings])
+    contributions = np.concatenate([1.0 / (k + 1 + np.arange(len(r))) for r in rankings])
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    fused = np.bincount(inverse, weights=contributions)
+    order = np.argsort(-fused, kind='stable')
+    return unique_rows[order], fused[order]
+
+def attach_bm25(embedded_chunks: Dict[str, Any], bm25_dir: str) -> Optional[BM25Index]:
+    # load the BM25 index built during chunking and align it to the embedding index rows
+    if not os.path.exists(os.path.join(bm25_dir, BM25_META_FILE)):
+        return None
+    bm25 = BM25Index.load(bm25_dir)
+    chunks = embedded_chunks["chunks"]
+    chunk_ids = chunks.chunk_ids() if hasattr(chunks, "chunk_ids") else [c["chunk_id"] for c in chunks]
+    bm25.align_to(chunk_ids)
+    embedded_chunks["bm25"] = bm25
+    return bm25
+
+def build_bm25_index(input_path: str, output_dir: str) -> BM25Index:
+    # chunks are streamed from the file, so only the postings are held in memory
+    start = time.perf_counter()
+    bm25 = BM25Index.build(iter_chunks(input_path))
+    bm25.save(output_dir)
+    print(f"Built BM25 index for {bm25.num_docs} chunks ({len(bm25.vocab)} terms, "
+          f"{bm25.memory_bytes() / 2**20:.1f} MiB postings) in {time.perf_counter() - start:.2f}s. Saved to {output_dir}")
+    return bm25
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a BM25 inverted index from chunked text')
+    parser.add_argument('--input', '-i', default='./chunked_corpus/all_chunks.jsonl',
+                        help='Input JSON Lines (or legacy JSON) file containing chunks')
+    parser.add_argument('--output', '-o', default='./chunked_corpus/bm25',
+                        help='Output directory for the BM25 index')
+    parser.add_argument('--query', '-q', help='Optional query to test lexical search')
+    parser.add_argument('--top-k', '-k', type=int, default=5)
+    args = parser.parse_args()
+
+    bm25 = build_bm25_index(args.input, args.output)
+    if args.query:
+        docs, scores = bm25.search(args.query, args.top_k)
+        for doc, score in zip(docs, scores):
+            print(f"{score:.3f}  {bm25.chunk_ids[doc]}")
+
+if __name__ == "__main__":
+    main()
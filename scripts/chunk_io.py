@@ -0,0 +1,144 @@
+import gzip
+import io
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# extensions of the compressed JSON Lines variants, by compression name
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+def chunks_filename(stem: str, compression: Optional[str] = None) -> str:
+    # e.g. all_chunks.jsonl, all_chunks.jsonl.gz, all_chunks.jsonl.zst
+    if compression and compression != "none":
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"Unknown compression '{compression}', expected one of {sorted(COMPRESSION_EXTENSIONS)}")
+        return f"{stem}.jsonl{COMPRESSION_EXTENSIONS[compression]}"
+    return f"{stem}.jsonl"
+
+def find_chunks_file(directory: str, stem: str = "all_chunks") -> str:
+    # the chunk file for stem in directory: JSON Lines (plain or compressed) first,
+    # then the legacy JSON array. returns the plain .jsonl path when none exists yet
+    candidates = [chunks_filename(stem)] + [chunks_filename(stem, c) for c in COMPRESSION_EXTENSIONS] + [f"{stem}.json"]
+    for name in candidates:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(directory, candidates[0])
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst chunk files requires the 'zstandard' package (pip install zstandard)")
+    return zstandard
+
+def open_text(path: str, mode: str = "r"):
+    # open a text file for reading ("r") or writing ("w"), compressed according to its extension
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if path.endswith(".zst"):
+        zstandard = _zstandard()
+        raw = open(path, mode + "b")
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def _iter_json_array(f) -> Iterator[Dict[str, Any]]:
+    # legacy all_chunks.json: streamed with ijson when it is installed, otherwise parsed in one go
+    try:
+        import ijson
+    except ImportError:
+        yield from json.load(f)
+        return
+    yield from ijson.items(f.buffer if hasattr(f, "buffer") else f, "item")
+
+def iter_chunks(path: str) -> Iterator[Dict[str, Any]]:
+    # yield the chunk dicts of a JSON Lines file one at a time.
+    # legacy JSON array files (the old indent=2 all_chunks.json) are detected and read too
+    with open_text(path, "r") as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        if first == "[":
+            # rewind is not possible on compressed streams, so reopen
+            f.close()
+            with open_text(path, "r") as array_file:
+                yield from _iter_json_array(array_file)
+            return
+
+        pending = first
+        for line in f:
+            line = pending + line
+            pending = ""
+            if line.strip():
+                yield json.loads(line)
+        if pending.strip():
+            yield json.loads(pending)
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def count_chunks(path: str) -> int:
+    # number of chunks in a file; a line count for JSON Lines
+    return sum(1 for _ in iter_chunks(path))
+
+class ChunkWriter:
+    # appends chunk dicts to a JSON Lines file. output goes to a temporary file that
+    # replaces path on close, so readers never see a partially written chunk file
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # keep the compression extension last so open_text picks the right codec
+        self._tmp_path = os.path.join(directory, f".tmp-{os.getpid()}-{os.path.basename(path)}")
+        self._file = open_text(self._tmp_path, "w")
+
+    def write(self, chunk: Dict[str, Any]):
+        self._file.write(json.dumps(chunk, ensure_ascii=False))
+        self._file.write("\n")
+        self.count += 1
+
+    def write_all(self, chunks: Iterable[Dict[str, Any]]):
+        for chunk in chunks:
+            self.write(chunk)
+
+    def close(self):
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self) -> "ChunkWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_chunks(chunks: Iterable[Dict[str, Any]], path: str) -> int:
+    with ChunkWriter(path) as writer:
+        writer.write_all(chunks)
+    return writer.count
+
+def merge_chunk_files(paths: Iterable[str], output_path: str) -> int:
+    # concatenate per-file chunk outputs into one JSON Lines file, one chunk in memory at a time
+    with ChunkWriter(output_path) as writer:
+        for path in paths:
+            writer.write_all(iter_chunks(path))
+    return writer.count
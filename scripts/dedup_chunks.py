@@ -0,0 +1,189 @@
+import argparse
+import os
+import re
+import time
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import numpy as np
+
+from chunk_io import ChunkWriter, iter_chunks
+
+# hashes are taken modulo a prime just above 2**32. shingle hashes and the multipliers a
+# are both below 2**32, so a * h stays inside uint64
+HASH_PRIME = np.uint64((1 << 32) + 15)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+def shingle_hashes(text: str, shingle_size: int = 5) -> np.ndarray:
+    # crc32 of every word n-gram in the text; texts shorter than one shingle hash as a whole
+    words = WORD_PATTERN.findall((text or "").lower())
+    if len(words) <= shingle_size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams)))
+
+class MinHasher:
+    # num_perm universal hash functions h(x) = (a * x + b) mod p; the signature of a set of
+    # shingles is the minimum of each function over the set
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.integers(1, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+        self.b = rng.integers(0, int(HASH_PRIME), size=(num_perm, 1), dtype=np.uint64)
+
+    def permute(self, hashes: np.ndarray) -> np.ndarray:
+        # (num_perm, len(hashes)) values of every hash function
+        return ((self.a * hashes[np.newaxis, :]) % HASH_PRIME + self.b) % HASH_PRIME
+
+    def signature(self, text: str) -> np.ndarray:
+        permuted = self.permute(shingle_hashes(text, self.shingle_size))
+        return np.minimum(permuted.min(axis=1), MAX_HASH).astype(np.uint32)
+
+def check_hash_range(num_perm: int = 128, seed: int = 1) -> bool:
+    # the permutations must never wrap around uint64: compares them with Python integers for
+    # the largest possible shingle hashes (and some random ones), under the seeded multipliers
+    # and under the largest multiplier the constructor can draw
+    rng = np.random.default_rng(seed)
+    hashes = np.concatenate([np.asarray([0, 1, int(MAX_HASH) - 1, int(MAX_HASH)], dtype=np.uint64),
+                             rng.integers(0, int(MAX_HASH) + 1, size=60, dtype=np.uint64)])
+    worst = MinHasher(1, seed=seed)
+    worst.a[:] = MAX_HASH
+    worst.b[:] = HASH_PRIME - np.uint64(1)
+
+    ok = True
+    for name, hasher in (("seeded", MinHasher(num_perm, seed=seed)), ("largest multiplier", worst)):
+        expected = [[(int(a) * int(h) + int(b)) % int(HASH_PRIME) for h in hashes]
+                    for a, b in zip(hasher.a[:, 0], hasher.b[:, 0])]
+        matches = hasher.permute(hashes).tolist() == expected and int(hasher.a.max()) <= int(MAX_HASH)
+        print(f"{'ok' if matches else 'FAILED'}: {name} hash functions match Python integers")
+        ok = ok and matches
+    return ok
+
+def lsh_duplicate_groups(signatures: np.ndarray, bands: int, threshold: float) -> np.ndarray:
+    # representative row of every row. rows whose signatures agree on all rows of at least
+    # one band become candidates; a candidate is merged when the fraction of equal signature
+    # values (the estimated Jaccard similarity) is at least threshold.
+    # the representative of a group is its first row
+    num_rows, num_perm = signatures.shape
+    rows_per_band = num_perm // bands
+    parent = np.arange(num_rows)
+
+    def find(row: int) -> int:
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    for band in range(bands):
+        band_values = np.ascontiguousarray(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+        buckets: Dict[bytes, List[int]] = defaultdict(list)
+        for row in range(num_rows):
+            buckets[band_values[row].tobytes()].append(row)
+
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            # compare every member with the first one instead of all pairs, which keeps
+            # boilerplate repeated in thousands of issues linear
+            members = np.asarray(members)
+            similarity = (signatures[members[1:]] == signatures[members[0]]).mean(axis=1)
+            for row in members[1:][similarity >= threshold]:
+                a, b = find(members[0]), find(int(row))
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+
+    return np.fromiter((find(row) for row in range(num_rows)), dtype=np.int64, count=num_rows)
+
+def dedup_chunks(input_path: str, output_path: str, threshold: float = 0.8, num_perm: int = 128,
+                 bands: int = 16, shingle_size: int = 5) -> Dict[str, Any]:
+    # drop near-duplicate chunks, keeping the first chunk of every group with the sources and
+    # chunk ids of the others in its metadata. two streaming passes over input_path: one for
+    # signatures, one to write the representatives, so chunk dicts are never all in memory
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+    start = time.perf_counter()
+    hasher = MinHasher(num_perm, shingle_size)
+
+    signatures, sources, chunk_ids, text_bytes = [], [], [], []
+    for chunk in iter_chunks(input_path):
+        signatures.append(hasher.signature(chunk.get("text", "")))
+        meta = chunk.get("metadata", {})
+        sources.append([meta.get("source", "unknown")] + meta.get("duplicate_sources", []))
+        chunk_ids.append([chunk.get("chunk_id")] + meta.get("duplicate_chunk_ids", []))
+        text_bytes.append(len(chunk.get("text", "").encode('utf-8')))
+    if not signatures:
+        return {"input_chunks": 0, "output_chunks": 0}
+
+    representative = lsh_duplicate_groups(np.stack(signatures), bands, threshold)
+    members: Dict[int, List[int]] = defaultdict(list)
+    for row in np.flatnonzero(representative != np.arange(len(representative))):
+        members[int(representative[row])].append(int(row))
+
+    with ChunkWriter(output_path) as writer:
+        for row, chunk in enumerate(iter_chunks(input_path)):
+            if representative[row] != row:
+                continue
+            if row in members:
+                meta = dict(chunk.get("metadata", {}))
+                own_source = sources[row][0]
+                duplicate_sources = set(sources[row][1:])
+                duplicate_ids = list(chunk_ids[row][1:])
+                for member in members[row]:
+                    duplicate_sources.update(sources[member])
+                    duplicate_ids.extend(chunk_ids[member])
+                duplicate_sources.discard(own_source)
+                meta["duplicate_sources"] = sorted(duplicate_sources)
+                meta["duplicate_chunk_ids"] = duplicate_ids
+                chunk = {**chunk, "metadata": meta}
+            writer.write(chunk)
+
+    text_bytes = np.asarray(text_bytes)
+    kept = representative == np.arange(len(representative))
+    report = {
+        "input_chunks": len(representative),
+        "output_chunks": int(kept.sum()),
+        "removed_chunks": int((~kept).sum()),
+        "duplicate_groups": len(members),
+        "removed_fraction": float((~kept).mean()),
+        "input_text_bytes": int(text_bytes.sum()),
+        "output_text_bytes": int(text_bytes[kept].sum()),
+        "seconds": time.perf_counter() - start,
+    }
+    print(f"Deduplicated {report['input_chunks']} chunks into {report['output_chunks']} "
+          f"({report['removed_chunks']} near-duplicates in {report['duplicate_groups']} groups removed, "
+          f"{report['removed_fraction']:.1%} fewer rows to embed, store and scan; "
+          f"text {report['input_text_bytes'] / 2**20:.1f} -> {report['output_text_bytes'] / 2**20:.1f} MiB) "
+          f"in {report['seconds']:.2f}s. Saved to {output_path}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove near-duplicate chunks with MinHash and LSH before embedding')
+    parser.add_argument('--input', '-i', default='./chunked_corpus/all_chunks.jsonl',
+                        help='Input JSON Lines (or legacy JSON) file containing chunks')
+    parser.add_argument('--output', '-o',
+                        help='Output JSON Lines file (default: rewrite the input as .jsonl)')
+    parser.add_argument('--threshold', type=float, default=0.8,
+                        help='Estimated Jaccard similarity of word shingles above which chunks are merged')
+    parser.add_argument('--num-perm', type=int, default=128, help='MinHash signature length')
+    parser.add_argument('--bands', type=int, default=16,
+                        help='LSH bands; more bands find candidates at lower similarity')
+    parser.add_argument('--shingle-size', type=int, default=5, help='Words per shingle')
+    parser.add_argument('--check', action='store_true',
+                        help='Check the MinHash arithmetic against Python integers and exit')
+    args = parser.parse_args()
+
+    if args.check:
+        raise SystemExit(0 if check_hash_range(args.num_perm) else 1)
+
+    output = args.output
+    if output is None:
+        output = args.input if '.jsonl' in os.path.basename(args.input) else os.path.splitext(args.input)[0] + '.jsonl'
+    dedup_chunks(args.input, output, args.threshold, args.num_perm, args.bands, args.shingle_size)
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,37 @@
-import json
 import os
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import argparse
 from typing import List, Dict, Any
 import pickle
+from encoder_registry import get_encoder
+from embedding_engine import DEFAULT_BATCH_TOKENS, encode_texts, start_pool, stop_pool
+from index_store import (save_index, load_index, convert_pickle, is_index_dir, read_chunk_hashes,
+                         read_chunk_ids, read_manifest, content_hash, IndexWriter)
+from chunk_io import iter_chunks, iter_batches, count_chunks
+from ann_index import ANN_INDEX_TYPES, build_ann_index, top_k_rows
+from bm25_index import reciprocal_rank_fusion
+from metadata_index import MetadataIndex
+from search_cache import query_embedding_cache, search_result_cache, normalize_query, freeze_options
 
 def load_chunks(file_path: str) -> List[Dict[str, Any]]:
-    # load chunks from a JSON file
+    # load all chunks from a JSON Lines (or legacy JSON) file into memory.
+    # large corpora should be streamed with chunk_io.iter_chunks instead
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return list(iter_chunks(file_path))
     except Exception as e:
         print(f"Error loading chunks from {file_path}: {e}")
         return []
 
-def generate_embeddings(chunks: List[Dict[str, Any]], model_name: str = 'all-MiniLM-L6-v2') -> Dict[str, Any]:
-    # generate embeddings for each chunk using SentenceTransformers
+def generate_embeddings(chunks: List[Dict[str, Any]], model_name: str = 'all-MiniLM-L6-v2',
+                        batch_tokens: int = DEFAULT_BATCH_TOKENS, num_workers: int = 0) -> Dict[str, Any]:
+    # generate embeddings for each chunk using SentenceTransformers,
+    # in length-bucketed batches (see embedding_engine.py)
     print(f"Loading model: {model_name}")
-    model = SentenceTransformer(model_name)
+    model = get_encoder(model_name)
     
     print(f"Generating embeddings for {len(chunks)} chunks...")
     texts = [chunk['text'] for chunk in chunks]
-    embeddings = model.encode(texts, show_progress_bar=True)
+    embeddings, _ = encode_texts(model, texts, batch_tokens=batch_tokens, num_workers=num_workers)
     
     # create a dictionary with both chunks and their embeddings
     embedded_chunks = {
@@ -33,68 +42,437 @@ def generate_embeddings(chunks: List[Dict[str, Any]], model_name: str = 'all-Min
     
     return embedded_chunks
 
+def _reusable_vectors(index_dir: str, model_name: str):
+    # (row by (chunk_id, text hash), embeddings) of the index at index_dir,
+    # or None when its vectors cannot be reused for model_name. only the manifest,
+    # chunk ids, hashes and the memory-mapped matrix are opened, not the ANN or BM25 data
+    if not is_index_dir(index_dir):
+        print("Full embedding run (no previous index)")
+        return None
+    index_dir = os.path.realpath(index_dir)
+    manifest = read_manifest(index_dir)
+    previous_hashes = read_chunk_hashes(index_dir)
+    if previous_hashes is None or manifest["model_name"] != model_name:
+        reason = "previous index has no content hashes" if previous_hashes is None else "model changed"
+        print(f"Full embedding run ({reason})")
+        return None
+    
+    previous_rows = {}
+    for row, (chunk_id, text_hash) in enumerate(zip(read_chunk_ids(index_dir), previous_hashes)):
+        previous_rows.setdefault((chunk_id, text_hash), row)
+    return previous_rows, np.load(os.path.join(index_dir, manifest["files"]["embeddings"]), mmap_mode='r')
+
+def embed_to_index(chunks_path: str, index_dir: str, model_name: str = 'all-MiniLM-L6-v2',
+                   incremental: bool = True, batch_size: int = 4096, ann_kind: str = None,
+                   ann_params: Dict[str, Any] = None, **encode_options) -> Dict[str, Any]:
+    # stream chunks from chunks_path into a new index at index_dir, holding one batch of
+    # chunk dicts in memory at a time. with incremental=True the vectors of chunks whose
+    # chunk_id and text are unchanged are copied from the existing index and only new or
+    # edited chunks go through the encoder; chunks no longer in the input are dropped.
+    # with ann_kind set, the ANN index is built before the new version is published
+    total = count_chunks(chunks_path)
+    previous = _reusable_vectors(index_dir, model_name) if incremental else None
+    reused_rows = np.zeros(len(previous[1]) if previous else 0, dtype=bool)
+    stats = {"reused": 0, "encoded": 0, "dropped": 0}
+    model = None
+    pool = None
+    
+    print(f"Generating embeddings for {total} chunks...")
+    writer = IndexWriter(index_dir, model_name, total)
+    try:
+        done = 0
+        for batch in iter_batches(iter_chunks(chunks_path), batch_size):
+            embeddings = None
+            encode_at = list(range(len(batch)))
+            if previous:
+                previous_rows, previous_embeddings = previous
+                reuse_at, reuse_from, encode_at = [], [], []
+                for position, chunk in enumerate(batch):
+                    row = previous_rows.get((chunk.get("chunk_id"), content_hash(chunk.get("text", ""))))
+                    if row is None:
+                        encode_at.append(position)
+                    else:
+                        reuse_at.append(position)
+                        reuse_from.append(row)
+                
+                embeddings = np.empty((len(batch), previous_embeddings.shape[1]), dtype=np.float32)
+                if reuse_at:
+                    # sorted reads keep the copy out of the memory-mapped file sequential
+                    order = np.argsort(reuse_from)
+                    reuse_from = np.asarray(reuse_from)[order]
+                    embeddings[np.asarray(reuse_at)[order]] = previous_embeddings[reuse_from]
+                    reused_rows[reuse_from] = True
+                    stats["reused"] += len(reuse_at)
+            
+            if encode_at:
+                if model is None:
+                    print(f"Loading model: {model_name}")
+                    model = get_encoder(model_name)
+                    pool = start_pool(model, encode_options.get("num_workers", 0))
+                encoded, _ = encode_texts(model, [batch[i]["text"] for i in encode_at], pool=pool, **encode_options)
+                if embeddings is None:
+                    embeddings = encoded
+                else:
+                    embeddings[encode_at] = encoded
+                stats["encoded"] += len(encode_at)
+            
+            writer.append(batch, embeddings)
+            done += len(batch)
+            print(f"Embedded {done}/{total} chunks")
+        
+        stats["dropped"] = int(len(reused_rows) - reused_rows.sum())
+        before_publish = None
+        if ann_kind:
+            before_publish = lambda staging_dir: build_ann_index(staging_dir, ann_kind, **(ann_params or {}))
+        manifest = writer.commit(before_publish, embedding_stats=stats)
+    except Exception:
+        writer.abort()
+        raise
+    finally:
+        stop_pool(model, pool)
+    
+    if previous:
+        print(f"Incremental embedding: {stats['reused']} chunks reused, {stats['encoded']} encoded, "
+              f"{stats['dropped']} dropped from the previous index")
+    return manifest
+
 def save_embeddings(embedded_chunks: Dict[str, Any], output_path: str):
-    # save the embedded chunks to a pickle file
+    # save the embedded chunks as a memory-mapped index directory,
+    # or as a legacy pickle when the output path ends in .pkl
     try:
-        with open(output_path, 'wb') as f:
-            pickle.dump(embedded_chunks, f)
+        if output_path.endswith('.pkl'):
+            with open(output_path, 'wb') as f:
+                pickle.dump(embedded_chunks, f)
+        else:
+            save_index(embedded_chunks, output_path)
         print(f"Embeddings saved to {output_path}")
     except Exception as e:
         print(f"Error saving embeddings to {output_path}: {e}")
 
-def vector_search(query: str, embedded_chunks: Dict[str, Any], top_k: int = 5) -> List[Dict[str, Any]]:
-    # search for the most similar chunks to a query
-    model = SentenceTransformer(embedded_chunks["model_name"])
-    query_embedding = model.encode(query)
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    # L2-normalize a single vector or each row of a matrix
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+def _format_results(embedded_chunks: Dict[str, Any], rows, scores) -> List[Dict[str, Any]]:
+    return [
+        {"chunk": embedded_chunks["chunks"][idx], "similarity": float(score), "row": int(idx)}
+        for idx, score in zip(rows, scores)
+    ]
+
+def encode_query(model_name: str, query: str) -> np.ndarray:
+    # query embeddings are cached by model and normalized query text.
+    # the encoder stays resident across calls instead of being reloaded per query
+    key = (model_name, normalize_query(query))
+    query_embedding = query_embedding_cache.get(key)
+    if query_embedding is None:
+        query_embedding = get_encoder(model_name).encode(query)
+        query_embedding_cache.put(key, query_embedding)
+    return query_embedding
+
+def _filter_rows(embedded_chunks: Dict[str, Any], filters: Dict[str, Any] = None):
+    # sorted index rows matching date/source filters, or None when unfiltered.
+    # indexes opened from disk carry a prebuilt MetadataIndex; in-memory dicts build one once
+    if not filters:
+        return None
+    metadata_index = embedded_chunks.get("metadata_index")
+    if metadata_index is None:
+        metadata_index = MetadataIndex.build(chunk.get("metadata", {}) for chunk in embedded_chunks["chunks"])
+        embedded_chunks["metadata_index"] = metadata_index
+    return metadata_index.candidate_rows(filters)
+
+def _dense_rank(query_embedding: np.ndarray, embedded_chunks: Dict[str, Any], top_k: int,
+                search_mode: str = "auto", nprobe: int = None, candidate_rows: np.ndarray = None):
+    # best-first (rows, cosine scores) for a raw query embedding, via the ANN index or a full scan.
+    # with candidate_rows only those rows of the matrix are read and scored
+    if candidate_rows is not None:
+        subset = np.asarray(embedded_chunks["embeddings"][candidate_rows], dtype=np.float32)
+        if not embedded_chunks.get("normalized"):
+            subset = _normalize(subset)
+        similarities = subset @ _normalize(query_embedding)
+        top = top_k_rows(similarities, top_k)
+        return candidate_rows[top], similarities[top]
+    
+    ann = embedded_chunks.get("ann")
+    if search_mode == "ann" and ann is None:
+        print("No ANN index loaded, falling back to exact search")
+    if search_mode in ("auto", "ann") and ann is not None:
+        return ann.search(_normalize(query_embedding), top_k, nprobe=nprobe)
+    
+    # exact scans are split across the shard workers when sharded search is enabled
+    sharded = embedded_chunks.get("sharded")
+    if sharded is not None:
+        return sharded.search(_normalize(query_embedding), top_k)
     
     # calculate cosine similarity
-    embeddings = np.array(embedded_chunks["embeddings"])
-    similarities = np.dot(embeddings, query_embedding) / (
-        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_embedding)
-    )
+    # index rows are stored pre-normalized, so only the query needs normalizing
+    embeddings = np.asarray(embedded_chunks["embeddings"])
+    if embedded_chunks.get("normalized"):
+        similarities = embeddings @ _normalize(query_embedding)
+    else:
+        similarities = np.dot(embeddings, query_embedding) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_embedding)
+        )
+    
+    # get top k indices without sorting the whole array
+    top_indices = top_k_rows(similarities, top_k)
+    return top_indices, similarities[top_indices]
+
+def _hybrid_search(query: str, query_embedding: np.ndarray, embedded_chunks: Dict[str, Any], top_k: int,
+                   nprobe: int = None, bm25_candidates: int = 200, rrf_k: int = 60,
+                   prune: bool = False, candidate_rows: np.ndarray = None) -> List[Dict[str, Any]]:
+    # fuse BM25 and dense rankings with reciprocal rank fusion.
+    # with prune=True the dense scorer only touches the rows BM25 returned
+    bm25 = embedded_chunks["bm25"]
+    embeddings = embedded_chunks["embeddings"]
+    query_embedding = _normalize(query_embedding)
+    lexical_rows, _ = bm25.search_rows(query, bm25_candidates)
+    if candidate_rows is not None:
+        lexical_rows = lexical_rows[np.isin(lexical_rows, candidate_rows, assume_unique=True)]
     
-    # get top k indices
-    top_indices = np.argsort(similarities)[-top_k:][::-1]
+    if prune:
+        if len(lexical_rows) == 0:
+            rows, scores = _dense_rank(query_embedding, embedded_chunks, top_k, "auto", nprobe, candidate_rows)
+            return _format_results(embedded_chunks, rows, scores)
+        dense_rows, _ = _dense_rank(query_embedding, embedded_chunks, len(lexical_rows),
+                                    candidate_rows=np.sort(lexical_rows))
+    else:
+        dense_rows, _ = _dense_rank(query_embedding, embedded_chunks, bm25_candidates, "auto", nprobe, candidate_rows)
+    
+    fused_rows, fused_scores = reciprocal_rank_fusion([dense_rows, lexical_rows], rrf_k)
+    fused_rows, fused_scores = fused_rows[:top_k], fused_scores[:top_k]
+    similarities = np.asarray(embeddings[fused_rows], dtype=np.float32) @ query_embedding
+    
+    results = _format_results(embedded_chunks, fused_rows, similarities)
+    for result, fused in zip(results, fused_scores):
+        result["rrf_score"] = float(fused)
+    return results
+
+def vector_search(query: str, embedded_chunks: Dict[str, Any], top_k: int = 5,
+                  search_mode: str = "auto", nprobe: int = None,
+                  bm25_candidates: int = 200, rrf_k: int = 60,
+                  filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    # search for the most similar chunks to a query.
+    # search_mode "auto" uses the ANN index when one is attached, "ann" requires it
+    # and "exact" always scans the full matrix (useful for comparing the two).
+    # "hybrid" fuses dense and BM25 rankings, "hybrid_pruned" additionally scores
+    # only the BM25 candidate rows densely.
+    # filters ({"date_from", "date_to", "sources"}) restrict scoring to the matching rows
+    query_embedding = encode_query(embedded_chunks["model_name"], query)
+    candidate_rows = _filter_rows(embedded_chunks, filters)
+    
+    if search_mode in ("hybrid", "hybrid_pruned"):
+        if embedded_chunks.get("bm25") is not None:
+            return _hybrid_search(query, query_embedding, embedded_chunks, top_k, nprobe,
+                                  bm25_candidates, rrf_k, prune=search_mode == "hybrid_pruned",
+                                  candidate_rows=candidate_rows)
+        print("No BM25 index loaded, falling back to dense search")
+        search_mode = "auto"
     
     # return top k chunks with their similarity scores
+    rows, scores = _dense_rank(query_embedding, embedded_chunks, top_k, search_mode, nprobe, candidate_rows)
+    return _format_results(embedded_chunks, rows, scores)
+
+def cached_vector_search(query: str, embedded_chunks: Dict[str, Any], top_k: int = 5,
+                         **search_options) -> List[Dict[str, Any]]:
+    # vector_search behind the result cache. keys include the index version, so results
+    # from a previous index are dropped as soon as a newly written one is searched
+    version = embedded_chunks.get("version") or f"memory-{id(embedded_chunks)}"
+    key = (normalize_query(query), top_k, freeze_options(search_options))
+    results = search_result_cache.get(key, version)
+    if results is None:
+        results = vector_search(query, embedded_chunks, top_k, **search_options)
+        search_result_cache.put(key, results, version)
+    return [dict(result) for result in results]
+
+def maximal_marginal_relevance(query_embedding: np.ndarray, candidate_embeddings: np.ndarray,
+                               top_k: int, lambda_mult: float = 0.5) -> np.ndarray:
+    # positions of top_k candidates picked greedily by maximal marginal relevance:
+    # lambda * sim(query, c) - (1 - lambda) * max sim(c, already picked).
+    # inputs must be L2-normalized. both terms come from one query-by-candidate product and
+    # one candidate-by-candidate similarity matrix; each pick is a vectorized update
+    num_candidates = len(candidate_embeddings)
+    k = min(top_k, num_candidates)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    relevance = candidate_embeddings @ query_embedding
+    pairwise = candidate_embeddings @ candidate_embeddings.T
+    
+    selected = np.empty(k, dtype=np.int64)
+    selected[0] = np.argmax(relevance)
+    redundancy = pairwise[selected[0]].copy()
+    available = np.ones(num_candidates, dtype=bool)
+    available[selected[0]] = False
+    for i in range(1, k):
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        selected[i] = np.argmax(scores)
+        available[selected[i]] = False
+        np.maximum(redundancy, pairwise[selected[i]], out=redundancy)
+    return selected
+
+def mmr_search(query: str, embedded_chunks: Dict[str, Any], top_k: int = 5, fetch_k: int = None,
+               mmr_lambda: float = 0.5, **search_options) -> List[Dict[str, Any]]:
+    # over-fetch fetch_k candidates (default 4 * top_k) with cached_vector_search and keep the
+    # top_k that balance relevance against similarity to each other, so overlapping windows
+    # of the same page do not fill the context. mmr_lambda=1 is plain relevance order
+    fetch_k = max(fetch_k or 4 * top_k, top_k)
+    candidates = cached_vector_search(query, embedded_chunks, fetch_k, **search_options)
+    if len(candidates) <= top_k:
+        return candidates
+    
+    rows = np.asarray([result["row"] for result in candidates])
+    candidate_embeddings = np.asarray(embedded_chunks["embeddings"][rows], dtype=np.float32)
+    if not embedded_chunks.get("normalized"):
+        candidate_embeddings = _normalize(candidate_embeddings)
+    query_embedding = _normalize(encode_query(embedded_chunks["model_name"], query))
+    
+    picks = maximal_marginal_relevance(query_embedding, candidate_embeddings, top_k, mmr_lambda)
+    return [candidates[i] for i in picks]
+
+def vector_search_many(queries: List[str], embedded_chunks: Dict[str, Any], top_k: int = 5,
+                       search_mode: str = "auto", nprobe: int = None,
+                       filters: Dict[str, Any] = None,
+                       max_block_bytes: int = 256 * 1024 * 1024) -> List[List[Dict[str, Any]]]:
+    # batched version of vector_search: one encoder call for all queries and,
+    # for exact search, one (queries x chunks) matrix multiply per block of queries.
+    # blocks keep the score matrix under max_block_bytes on large indexes.
+    # hybrid modes are not batched and use dense search here
+    if not queries:
+        return []
+    
+    model = get_encoder(embedded_chunks["model_name"])
+    query_embeddings = _normalize(model.encode(list(queries)))
+    
+    if search_mode in ("hybrid", "hybrid_pruned"):
+        search_mode = "auto"
+    candidate_rows = _filter_rows(embedded_chunks, filters)
+    
+    ann = embedded_chunks.get("ann")
+    if search_mode in ("auto", "ann") and ann is not None and candidate_rows is None:
+        results = []
+        for query_embedding in query_embeddings:
+            rows, scores = ann.search(query_embedding, top_k, nprobe=nprobe)
+            results.append(_format_results(embedded_chunks, rows, scores))
+        return results
+    
+    sharded = embedded_chunks.get("sharded")
+    if sharded is not None and candidate_rows is None:
+        results = []
+        all_rows, all_scores = sharded.search_many(query_embeddings, top_k)
+        for rows, row_scores in zip(all_rows, all_scores):
+            results.append(_format_results(embedded_chunks, rows, row_scores))
+        return results
+    
+    embeddings = np.asarray(embedded_chunks["embeddings"])
+    if candidate_rows is not None:
+        embeddings = np.asarray(embeddings[candidate_rows], dtype=np.float32)
+    if not embedded_chunks.get("normalized"):
+        embeddings = _normalize(embeddings)
+    
+    num_rows = embeddings.shape[0]
+    k = min(top_k, num_rows)
+    if k <= 0:
+        return [[] for _ in queries]
+    block_size = max(1, max_block_bytes // max(1, num_rows * 4))
+    
     results = []
-    for idx in top_indices:
-        results.append({
-            "chunk": embedded_chunks["chunks"][idx],
-            "similarity": float(similarities[idx])
-        })
+    for start in range(0, len(query_embeddings), block_size):
+        scores = query_embeddings[start:start + block_size] @ embeddings.T
+        
+        # select the k winners per row, then sort only those
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        if candidate_rows is not None:
+            top = candidate_rows[top]
+        
+        for rows, row_scores in zip(top, top_scores):
+            results.append(_format_results(embedded_chunks, rows, row_scores))
     
     return results
 
 def main():
     parser = argparse.ArgumentParser(description='Generate embeddings for text chunks')
-    parser.add_argument('--input', '-i', default='./chunked_corpus/all_chunks.json', 
-                        help='Input JSON file containing chunks')
-    parser.add_argument('--output', '-o', default='./chunked_corpus/embedded_chunks.pkl',
-                        help='Output pickle file for embeddings')
+    parser.add_argument('--input', '-i', default='./chunked_corpus/all_chunks.jsonl', 
+                        help='Input JSON Lines file containing chunks (.gz/.zst and legacy JSON arrays are also read)')
+    parser.add_argument('--output', '-o', default='./chunked_corpus/index',
+                        help='Output index directory for embeddings (a .pkl path writes the legacy pickle)')
     parser.add_argument('--model', '-m', default='all-MiniLM-L6-v2',
                         help='SentenceTransformer model to use')
     parser.add_argument('--query', '-q', 
                         help='Optional query to test search functionality')
     parser.add_argument('--top-k', '-k', type=int, default=3,
                         help='Number of top results to return for query')
+    parser.add_argument('--ann', default='ivf_flat', choices=['none'] + sorted(ANN_INDEX_TYPES),
+                        help='Approximate nearest-neighbour index to build after embedding')
+    parser.add_argument('--nlist', type=int,
+                        help='Number of IVF lists for --ann ivf_flat (default: sqrt of the chunk count)')
+    parser.add_argument('--pq-subvectors', type=int, default=48,
+                        help='Number of uint8 sub-vector codes per chunk for --ann pq (must divide the dimension)')
+    parser.add_argument('--pq-rerank', type=int, default=100,
+                        help='Shortlist size re-ranked exactly from the float vectors for --ann pq (0 disables)')
+    parser.add_argument('--reduced-dim', type=int, default=64,
+                        help='Projected dimension of the first-pass vectors for --ann reduced')
+    parser.add_argument('--projection', default='pca', choices=['pca', 'prefix'],
+                        help='PCA or Matryoshka-style prefix truncation for --ann reduced')
+    parser.add_argument('--shortlist', type=int, default=100,
+                        help='Rows re-scored with the full vectors for --ann reduced')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='CPU worker processes to encode with (0 = encode in-process)')
+    parser.add_argument('--batch-tokens', type=int, default=DEFAULT_BATCH_TOKENS,
+                        help='Padded tokens per encoder batch; shorter chunks get larger batches')
+    parser.add_argument('--stream-batch', type=int, default=4096,
+                        help='Chunks read from --input and written to the index per batch')
+    parser.add_argument('--full', action='store_true',
+                        help='Re-encode every chunk instead of reusing vectors of unchanged chunks from --output')
+    parser.add_argument('--convert', 
+                        help='Convert an existing embedded_chunks.pkl into the index at --output and exit')
     
     args = parser.parse_args()
     
     # create output directory if it doesn't exist
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
     
-    chunks = load_chunks(args.input)
-    if not chunks:
+    if args.convert:
+        convert_pickle(args.convert, args.output)
         return
     
-    embedded_chunks = generate_embeddings(chunks, args.model)
+    encode_options = {"batch_tokens": args.batch_tokens, "num_workers": args.workers}
+    ann_params = {}
+    if args.ann == 'ivf_flat':
+        ann_params = {"nlist": args.nlist}
+    elif args.ann == 'pq':
+        ann_params = {"num_subvectors": args.pq_subvectors, "rerank": args.pq_rerank}
+    elif args.ann == 'reduced':
+        ann_params = {"reduced_dim": args.reduced_dim, "method": args.projection, "shortlist": args.shortlist}
     
-    save_embeddings(embedded_chunks, args.output)
+    if args.output.endswith('.pkl'):
+        chunks = load_chunks(args.input)
+        if not chunks:
+            return
+        embedded_chunks = generate_embeddings(chunks, args.model, **encode_options)
+        save_embeddings(embedded_chunks, args.output)
+    else:
+        # chunks are streamed from --input straight into the index, one batch at a time,
+        # and the ANN index is built alongside before the new version goes live
+        try:
+            embed_to_index(args.input, args.output, args.model, incremental=not args.full,
+                           batch_size=args.stream_batch, ann_kind=None if args.ann == 'none' else args.ann,
+                           ann_params=ann_params, **encode_options)
+        except Exception as e:
+            print(f"Error embedding {args.input} into {args.output}: {e}")
+            return
+        print(f"Embeddings saved to {args.output}")
     
     # test search if query is provided
     if args.query:
         print(f"\nTesting search with query: '{args.query}'")
+        if not args.output.endswith('.pkl'):
+            embedded_chunks = load_index(args.output)
         results = vector_search(args.query, embedded_chunks, args.top_k)
         
         print(f"\nTop {args.top_k} results:")
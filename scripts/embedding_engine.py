@@ -0,0 +1,149 @@
+import argparse
+import itertools
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from chunk_io import iter_chunks
+from encoder_registry import get_encoder
+
+# padded tokens per encoder forward pass; batches of short chunks get more rows than batches of long ones
+DEFAULT_BATCH_TOKENS = 16384
+MAX_BATCH_SIZE = 256
+
+def token_lengths(model, texts: Sequence[str]) -> np.ndarray:
+    # tokenized length of each text as the encoder will see it (capped at max_seq_length).
+    # falls back to a characters-per-token estimate for models without a HF tokenizer
+    max_length = getattr(model, "max_seq_length", None) or 512
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is not None:
+        try:
+            encoded = tokenizer(list(texts), add_special_tokens=True, truncation=True, max_length=max_length)
+            return np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(texts))
+        except Exception:
+            pass
+    lengths = np.fromiter((len(text) // 4 + 2 for text in texts), dtype=np.int64, count=len(texts))
+    return np.minimum(lengths, max_length)
+
+def plan_batches(lengths: np.ndarray, batch_tokens: int = DEFAULT_BATCH_TOKENS,
+                 max_batch_size: int = MAX_BATCH_SIZE) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+    # sort texts by length and cut the sorted order into batches whose padded size
+    # (rows x longest row) stays under batch_tokens. returns the order and [start, end) batches
+    order = np.argsort(-lengths, kind='stable')
+    sorted_lengths = lengths[order]
+    batches = []
+    start = 0
+    while start < len(order):
+        # the first row of a batch is its longest, so it fixes the padded width
+        width = max(1, int(sorted_lengths[start]))
+        size = max(1, min(max_batch_size, batch_tokens // width))
+        batches.append((start, min(start + size, len(order))))
+        start += size
+    return order, batches
+
+def padding_efficiency(lengths: np.ndarray, order: np.ndarray, batches: List[Tuple[int, int]]) -> float:
+    # real tokens / padded tokens over all batches
+    sorted_lengths = lengths[order]
+    padded = sum(int(sorted_lengths[start]) * (end - start) for start, end in batches)
+    return float(sorted_lengths.sum()) / padded if padded else 1.0
+
+def start_pool(model, num_workers: int):
+    # sentence-transformers multi-process pool of CPU workers, or None when it is unavailable
+    if num_workers <= 1 or not hasattr(model, "start_multi_process_pool"):
+        return None
+    return model.start_multi_process_pool(target_devices=["cpu"] * num_workers)
+
+def stop_pool(model, pool):
+    if pool is not None:
+        model.stop_multi_process_pool(pool)
+
+def encode_texts(model, texts: Sequence[str], batch_tokens: int = DEFAULT_BATCH_TOKENS,
+                 max_batch_size: int = MAX_BATCH_SIZE, num_workers: int = 0,
+                 show_progress: bool = True, pool=None) -> Tuple[np.ndarray, Dict[str, Any]]:
+    # embed texts in length-bucketed, token-budgeted batches and return them in input order.
+    # with num_workers > 1 the sorted texts are fanned out over a sentence-transformers
+    # multi-process pool of CPU workers; callers encoding many batches pass a pool
+    # from start_pool() so the workers are started only once
+    texts = list(texts)
+    start_time = time.perf_counter()
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32), {"chunks": 0, "seconds": 0.0, "chunks_per_second": 0.0}
+
+    lengths = token_lengths(model, texts)
+    order, batches = plan_batches(lengths, batch_tokens, max_batch_size)
+    sorted_texts = [texts[i] for i in order]
+
+    own_pool = pool is None and num_workers > 1
+    if own_pool:
+        pool = start_pool(model, num_workers)
+    if pool is not None:
+        # workers receive consecutive slices of the sorted texts, so every slice is length-homogeneous.
+        # the pool encodes with one batch size, taken from the median planned batch
+        batch_size = int(np.median([end - start for start, end in batches]))
+        try:
+            sorted_embeddings = model.encode_multi_process(sorted_texts, pool, batch_size=batch_size)
+        finally:
+            if own_pool:
+                stop_pool(model, pool)
+        sorted_embeddings = np.asarray(sorted_embeddings, dtype=np.float32)
+    else:
+        parts = []
+        for i, (start, end) in enumerate(batches):
+            parts.append(np.asarray(model.encode(sorted_texts[start:end], batch_size=end - start,
+                                                 show_progress_bar=False), dtype=np.float32))
+            if show_progress and (i + 1) % 20 == 0:
+                print(f"Encoded {end}/{len(texts)} chunks")
+        sorted_embeddings = np.concatenate(parts)
+
+    # scatter back to the original chunk order
+    embeddings = np.empty_like(sorted_embeddings)
+    embeddings[order] = sorted_embeddings
+
+    seconds = time.perf_counter() - start_time
+    stats = {
+        "chunks": len(texts),
+        "batches": len(batches),
+        "workers": len(pool["processes"]) if pool is not None else 1,
+        "padding_efficiency": padding_efficiency(lengths, order, batches),
+        "seconds": seconds,
+        "chunks_per_second": len(texts) / seconds if seconds > 0 else 0.0,
+    }
+    print(f"Embedded {stats['chunks']} chunks in {seconds:.2f}s ({stats['chunks_per_second']:.1f} chunks/sec, "
+          f"{stats['batches']} batches, {stats['padding_efficiency']:.0%} padding efficiency, {stats['workers']} worker(s))")
+    return embeddings, stats
+
+def benchmark(texts: Sequence[str], model_name: str, batch_tokens: int = DEFAULT_BATCH_TOKENS,
+              num_workers: int = 0) -> Dict[str, float]:
+    # chunks/sec of a plain model.encode call vs. the bucketed engine
+    model = get_encoder(model_name)
+    texts = list(texts)
+
+    start = time.perf_counter()
+    baseline = np.asarray(model.encode(texts, show_progress_bar=False), dtype=np.float32)
+    baseline_rate = len(texts) / (time.perf_counter() - start)
+    print(f"model.encode: {baseline_rate:.1f} chunks/sec")
+
+    embeddings, stats = encode_texts(model, texts, batch_tokens, num_workers=num_workers, show_progress=False)
+    max_diff = float(np.abs(embeddings - baseline).max()) if len(texts) else 0.0
+    print(f"bucketed: {stats['chunks_per_second']:.1f} chunks/sec "
+          f"({stats['chunks_per_second'] / baseline_rate:.2f}x, max abs difference {max_diff:.2e})")
+    return {"baseline": baseline_rate, "bucketed": stats["chunks_per_second"]}
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare plain and length-bucketed embedding throughput')
+    parser.add_argument('--input', '-i', default='./chunked_corpus/all_chunks.jsonl',
+                        help='Input JSON Lines (or legacy JSON) file containing chunks')
+    parser.add_argument('--model', '-m', default='all-MiniLM-L6-v2',
+                        help='SentenceTransformer model to use')
+    parser.add_argument('--limit', type=int, default=2000, help='Number of chunks to benchmark on')
+    parser.add_argument('--batch-tokens', type=int, default=DEFAULT_BATCH_TOKENS,
+                        help='Padded tokens per batch')
+    parser.add_argument('--workers', type=int, default=0, help='CPU worker processes (0 = encode in-process)')
+    args = parser.parse_args()
+
+    chunks = list(itertools.islice(iter_chunks(args.input), args.limit))
+    benchmark([chunk['text'] for chunk in chunks], args.model, args.batch_tokens, args.workers)
+
+if __name__ == "__main__":
+    main()
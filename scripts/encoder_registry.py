@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+# default memory budget for resident encoders, overridable per process
+DEFAULT_MAX_BYTES = int(float(os.environ.get("ARCHIVEBOT_ENCODER_MEMORY_MB", "1024")) * 1024 * 1024)
+
+# tokens per (query, chunk) pair fed to a cross-encoder
+CROSS_ENCODER_MAX_LENGTH = 256
+
+def load_sentence_transformer(model_name: str) -> Any:
+    # default loader, imported lazily so the registry itself stays cheap to import
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+def load_cross_encoder(model_name: str) -> Any:
+    # loader for reranking models; inputs are truncated to keep one batched CPU pass cheap
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name, max_length=CROSS_ENCODER_MAX_LENGTH)
+
+def estimate_model_bytes(model: Any) -> int:
+    # approximate resident size of a torch module from its parameters and buffers
+    try:
+        total = sum(p.numel() * p.element_size() for p in model.parameters())
+        total += sum(b.numel() * b.element_size() for b in model.buffers())
+        return int(total)
+    except Exception:
+        return 0
+
+class EncoderRegistry:
+    # process-wide cache of loaded encoders keyed by model name.
+    # models are kept in LRU order and evicted once the memory budget is exceeded,
+    # the most recently loaded model is always kept even if it alone exceeds the budget.
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, loader: Optional[Callable[[str], Any]] = None):
+        self.max_bytes = max_bytes
+        self._loader = loader or load_sentence_transformer
+        self._models: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._loading: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.total_load_seconds = 0.0
+        self.load_seconds: Dict[str, float] = {}
+
+    def get(self, model_name: str) -> Any:
+        # return the resident encoder for model_name, loading it on first use
+        while True:
+            with self._lock:
+                model = self._models.get(model_name)
+                if model is not None:
+                    self._models.move_to_end(model_name)
+                    self.hits += 1
+                    return model
+
+                pending = self._loading.get(model_name)
+                if pending is None:
+                    # this thread loads the model, others wait on the event
+                    pending = threading.Event()
+                    self._loading[model_name] = pending
+                    self.misses += 1
+                    break
+            pending.wait()
+
+        try:
+            print(f"Loading encoder: {model_name}")
+            start = time.perf_counter()
+            model = self._loader(model_name)
+            elapsed = time.perf_counter() - start
+            print(f"Encoder {model_name} loaded in {elapsed:.2f}s")
+
+            with self._lock:
+                self._models[model_name] = model
+                self._sizes[model_name] = estimate_model_bytes(model)
+                self.loads += 1
+                self.total_load_seconds += elapsed
+                self.load_seconds[model_name] = elapsed
+                self._evict_locked(keep=model_name)
+        finally:
+            with self._lock:
+                self._loading.pop(model_name, None)
+            pending.set()
+
+        return model
+
+    def _evict_locked(self, keep: Optional[str] = None):
+        # drop least recently used models until the budget is met
+        while sum(self._sizes.values()) > self.max_bytes and len(self._models) > 1:
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            self._models.pop(oldest)
+            self._sizes.pop(oldest, None)
+            self.evictions += 1
+            print(f"Evicted encoder {oldest} to stay within memory budget")
+
+    def configure(self, max_bytes: Optional[int] = None):
+        # change the memory budget, evicting immediately if needed
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict_locked()
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._sizes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "total_load_seconds": round(self.total_load_seconds, 3),
+                "load_seconds": {name: round(s, 3) for name, s in self.load_seconds.items()},
+                "resident_models": list(self._models.keys()),
+                "resident_bytes": sum(self._sizes.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+_registry = EncoderRegistry()
+_cross_encoder_registry = EncoderRegistry(loader=load_cross_encoder)
+
+def get_registry() -> EncoderRegistry:
+    return _registry
+
+def get_encoder(model_name: str) -> Any:
+    # shortcut used by the embedding and search code
+    return _registry.get(model_name)
+
+def get_cross_encoder(model_name: str) -> Any:
+    return _cross_encoder_registry.get(model_name)
+
+def encoder_stats() -> Dict[str, Any]:
+    return _registry.stats()
@@ -0,0 +1,345 @@
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import shutil
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+# on-disk layout of an embedding index directory
+INDEX_FORMAT = "archivebot-index"
+INDEX_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.jsonl"
+CHUNK_OFFSETS_FILE = "chunk_offsets.npy"
+CHUNK_IDS_FILE = "chunk_ids.json"
+CHUNK_HASHES_FILE = "chunk_hashes.json"
+
+class ChunkStore:
+    # read-only, random-access view over chunks.jsonl.
+    # the file is memory-mapped and each chunk is decoded only when it is requested,
+    # so opening the store costs the same regardless of corpus size.
+    def __init__(self, chunks_path: str, offsets_path: str):
+        self.path = chunks_path
+        self.offsets = np.load(offsets_path, mmap_mode='r')
+        self._file = open(chunks_path, 'rb')
+        if os.path.getsize(chunks_path) > 0:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._mm = b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("chunk index out of range")
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return json.loads(self._mm[start:end])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def chunk_ids(self) -> List[str]:
+        # chunk_id of every row, read from the side file instead of decoding every chunk
+        ids_path = os.path.join(os.path.dirname(self.path), CHUNK_IDS_FILE)
+        if os.path.exists(ids_path):
+            with open(ids_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return [chunk["chunk_id"] for chunk in self]
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    # L2-normalize each row so cosine similarity becomes a plain dot product
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+def is_index_dir(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+def content_hash(text: str) -> str:
+    # fingerprint of the text a chunk's vector was computed from
+    return hashlib.sha1((text or "").encode('utf-8')).hexdigest()
+
+def read_chunk_ids(index_dir: str) -> List[str]:
+    # chunk_id of every row, without opening the rest of the index
+    ids_path = os.path.join(index_dir, CHUNK_IDS_FILE)
+    if os.path.exists(ids_path):
+        with open(ids_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    chunks = ChunkStore(os.path.join(index_dir, CHUNKS_FILE), os.path.join(index_dir, CHUNK_OFFSETS_FILE))
+    try:
+        return [chunk["chunk_id"] for chunk in chunks]
+    finally:
+        chunks.close()
+
+def read_chunk_hashes(index_dir: str) -> List[str]:
+    # content hash of every row, or None for indexes written before hashes were recorded
+    hashes_path = os.path.join(index_dir, CHUNK_HASHES_FILE)
+    if not os.path.exists(hashes_path):
+        return None
+    with open(hashes_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+class ChunkStoreWriter:
+    # writes chunks as JSON lines and records the byte offset of every line,
+    # alongside the chunk ids, content hashes and the date/source filter index
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self.offsets = [0]
+        self.chunk_ids = []
+        self.chunk_hashes = []
+        self.metadata = []
+        self._file = open(os.path.join(index_dir, CHUNKS_FILE), 'wb')
+
+    def write(self, chunk: Dict[str, Any]):
+        line = json.dumps(chunk, ensure_ascii=False).encode('utf-8') + b"\n"
+        self._file.write(line)
+        self.offsets.append(self.offsets[-1] + len(line))
+        self.chunk_ids.append(chunk.get("chunk_id"))
+        self.chunk_hashes.append(content_hash(chunk.get("text", "")))
+        chunk_meta = chunk.get("metadata", {})
+        self.metadata.append({"date": chunk_meta.get("date"), "source": chunk_meta.get("source"),
+                              "duplicate_sources": chunk_meta.get("duplicate_sources")})
+
+    def close(self) -> int:
+        from metadata_index import MetadataIndex
+
+        self._file.close()
+        np.save(os.path.join(self.index_dir, CHUNK_OFFSETS_FILE), np.asarray(self.offsets, dtype=np.int64))
+        with open(os.path.join(self.index_dir, CHUNK_IDS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.chunk_ids, f)
+        with open(os.path.join(self.index_dir, CHUNK_HASHES_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.chunk_hashes, f)
+        MetadataIndex.build(self.metadata).save(self.index_dir)
+        return len(self.offsets) - 1
+
+    def abort(self):
+        self._file.close()
+
+def write_chunk_store(chunks, index_dir: str) -> int:
+    writer = ChunkStoreWriter(index_dir)
+    for chunk in chunks:
+        writer.write(chunk)
+    return writer.close()
+
+def write_manifest(index_dir: str, model_name: str, count: int, dim: int, **extra) -> Dict[str, Any]:
+    manifest = {
+        "format": INDEX_FORMAT,
+        "format_version": INDEX_FORMAT_VERSION,
+        "version": uuid.uuid4().hex,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "model_name": model_name,
+        "count": count,
+        "dim": dim,
+        "dtype": "float32",
+        "normalized": True,
+        "files": {
+            "embeddings": EMBEDDINGS_FILE,
+            "chunks": CHUNKS_FILE,
+            "chunk_offsets": CHUNK_OFFSETS_FILE,
+            "chunk_ids": CHUNK_IDS_FILE,
+            "chunk_hashes": CHUNK_HASHES_FILE,
+        },
+        **extra,
+    }
+    with open(os.path.join(index_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def version_dirs(index_dir: str) -> List[str]:
+    # the versioned directories published for index_dir, current or not
+    parent, name = os.path.split(os.path.abspath(index_dir))
+    prefix = f"{name}.v-"
+    if not os.path.isdir(parent):
+        return []
+    return [os.path.join(parent, entry) for entry in os.listdir(parent) if entry.startswith(prefix)]
+
+def replace_index_dir(staging_dir: str, index_dir: str):
+    # publish a fully written staging directory as index_dir. index_dir is a symlink to a
+    # versioned sibling directory and is switched by a single os.replace, so readers always
+    # find the old or the new index and a crash leaves one of them in place. the version
+    # being replaced is kept for processes that are still opening it; older ones are removed.
+    # processes that already have files memory-mapped keep reading them until they reload
+    index_dir = os.path.abspath(index_dir)
+    if os.path.exists(index_dir) and not os.path.islink(index_dir) \
+            and not is_index_dir(index_dir) and os.listdir(index_dir):
+        raise ValueError(f"{index_dir} exists and is not an index directory, refusing to replace it")
+
+    version_dir = f"{index_dir}.v-{read_manifest(staging_dir)['version']}"
+    os.rename(staging_dir, version_dir)
+    previous = None
+    if os.path.islink(index_dir):
+        previous = os.path.realpath(index_dir)
+    elif os.path.exists(index_dir):
+        # a plain directory from before versioned indexes; moving it aside is the one non-atomic switch
+        previous = f"{index_dir}.v-{current_version(index_dir) or uuid.uuid4().hex}"
+        os.rename(index_dir, previous)
+
+    link = f"{index_dir}.link-{uuid.uuid4().hex[:8]}"
+    os.symlink(os.path.basename(version_dir), link)
+    os.replace(link, index_dir)
+
+    keep = {os.path.realpath(version_dir), os.path.realpath(previous) if previous else None}
+    for old_dir in version_dirs(index_dir):
+        if os.path.realpath(old_dir) not in keep:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+class IndexWriter:
+    # builds an index directory batch by batch, so only one batch of chunks and vectors
+    # is in memory. everything is written to a sibling staging directory and swapped in
+    # by commit(), so readers only ever see the old index or the complete new one
+    def __init__(self, index_dir: str, model_name: str, count: int):
+        self.index_dir = os.path.normpath(index_dir)
+        self.model_name = model_name
+        self.count = count
+        self.rows = 0
+        self.staging_dir = f"{self.index_dir}.tmp-{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.staging_dir)
+        self._embeddings = None
+        self._chunks = ChunkStoreWriter(self.staging_dir)
+
+    def append(self, chunks, embeddings: np.ndarray):
+        if len(chunks) == 0:
+            return
+        embeddings = normalize_rows(embeddings)
+        if embeddings.ndim != 2:
+            embeddings = embeddings.reshape(len(chunks), -1)
+        if embeddings.shape[0] != len(chunks):
+            raise ValueError(f"Chunk count {len(chunks)} does not match embedding rows {embeddings.shape[0]}")
+        if self.rows + len(chunks) > self.count:
+            raise ValueError(f"More than the expected {self.count} chunks were written")
+
+        if self._embeddings is None:
+            # the matrix is preallocated on disk and filled in place
+            self._embeddings = np.lib.format.open_memmap(
+                os.path.join(self.staging_dir, EMBEDDINGS_FILE), mode='w+',
+                dtype=np.float32, shape=(self.count, embeddings.shape[1]))
+        self._embeddings[self.rows:self.rows + len(chunks)] = embeddings
+        for chunk in chunks:
+            self._chunks.write(chunk)
+        self.rows += len(chunks)
+
+    def commit(self, before_publish=None, **manifest_extra) -> Dict[str, Any]:
+        # before_publish(staging_dir) can add derived files (the ANN index) to the new
+        # version while it is still private, so it is never served without them
+        if self.rows != self.count:
+            raise ValueError(f"Chunk count {self.rows} does not match the expected {self.count}")
+        if self._embeddings is None:
+            np.save(os.path.join(self.staging_dir, EMBEDDINGS_FILE), np.empty((0, 0), dtype=np.float32))
+            dim = 0
+        else:
+            self._embeddings.flush()
+            dim = int(self._embeddings.shape[1])
+            self._embeddings = None
+        self._chunks.close()
+
+        manifest = write_manifest(self.staging_dir, self.model_name, self.count, dim, **manifest_extra)
+        if before_publish is not None:
+            before_publish(self.staging_dir)
+        replace_index_dir(self.staging_dir, self.index_dir)
+        return manifest
+
+    def abort(self):
+        self._embeddings = None
+        self._chunks.abort()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+def save_index(embedded_chunks: Dict[str, Any], index_dir: str, **manifest_extra) -> Dict[str, Any]:
+    # write an in-memory embedded_chunks dict as a versioned index directory
+    chunks = embedded_chunks["chunks"]
+    writer = IndexWriter(index_dir, embedded_chunks["model_name"], len(chunks))
+    try:
+        writer.append(chunks, embedded_chunks["embeddings"])
+        return writer.commit(**manifest_extra)
+    except Exception:
+        writer.abort()
+        raise
+
+def read_manifest(index_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(index_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get("format") != INDEX_FORMAT:
+        raise ValueError(f"{index_dir} is not an ArchiveBot index")
+    if manifest.get("format_version", 0) > INDEX_FORMAT_VERSION:
+        raise ValueError(f"Index format version {manifest['format_version']} is newer than supported ({INDEX_FORMAT_VERSION})")
+    return manifest
+
+def current_version(index_dir: str) -> str:
+    # version id of the index currently on disk, or None if there is none
+    try:
+        return read_manifest(index_dir)["version"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def current_ann_build(index_dir: str) -> str:
+    # build id of the ANN structure currently on disk, or None if there is none
+    from ann_index import read_ann_meta
+    try:
+        return (read_ann_meta(index_dir) or {}).get("build_id")
+    except (OSError, ValueError):
+        return None
+
+def load_index(index_dir: str) -> Dict[str, Any]:
+    # open an index directory without reading the matrix into memory.
+    # embeddings are an np.memmap, so the OS page cache is shared between worker processes.
+    # the link is resolved once, so every file comes from the same version even if a new
+    # one is published meanwhile; if that version was pruned before it could be opened,
+    # the link is resolved again
+    version_dir = os.path.realpath(index_dir)
+    try:
+        return _open_index(version_dir)
+    except FileNotFoundError:
+        if os.path.realpath(index_dir) == version_dir:
+            raise
+        return _open_index(os.path.realpath(index_dir))
+
+def _open_index(index_dir: str) -> Dict[str, Any]:
+    manifest = read_manifest(index_dir)
+    files = manifest["files"]
+    embeddings = np.load(os.path.join(index_dir, files["embeddings"]), mmap_mode='r')
+    chunks = ChunkStore(os.path.join(index_dir, files["chunks"]),
+                        os.path.join(index_dir, files["chunk_offsets"]))
+
+    from ann_index import load_ann_index, read_ann_meta
+    from metadata_index import MetadataIndex
+    ann_meta = read_ann_meta(index_dir)
+    ann = load_ann_index(index_dir, embeddings, manifest["version"], ann_meta)
+
+    return {
+        "chunks": chunks,
+        "embeddings": embeddings,
+        "model_name": manifest["model_name"],
+        "normalized": manifest.get("normalized", False),
+        "version": manifest["version"],
+        "index_dir": index_dir,
+        "manifest": manifest,
+        "ann": ann,
+        "ann_build": (ann_meta or {}).get("build_id"),
+        "metadata_index": MetadataIndex.load(index_dir),
+    }
+
+def convert_pickle(pickle_path: str, index_dir: str) -> Dict[str, Any]:
+    # convert a legacy embedded_chunks.pkl into the index directory format
+    with open(pickle_path, 'rb') as f:
+        embedded_chunks = pickle.load(f)
+    manifest = save_index(embedded_chunks, index_dir)
+    print(f"Converted {pickle_path} ({manifest['count']} chunks) to index at {index_dir}")
+    return manifest
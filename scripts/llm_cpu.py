@@ -0,0 +1,74 @@
+import os
+from typing import Optional
+
+# CPU inference modes for the causal LM: full precision, dynamic int8 linear layers, bfloat16 weights
+CPU_MODES = ("fp32", "int8", "bf16")
+
+def available_cores() -> int:
+    # cores this process may run on (respects taskset / container cpusets)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def default_num_threads(reserved: int = 0) -> int:
+    # intra-op threads for the LLM: every available core except those reserved for
+    # other workers (e.g. search shards), at least one
+    return max(1, available_cores() - reserved)
+
+def configure_threads(num_threads: Optional[int] = None):
+    # torch intra-op threads for matmuls; inter-op parallelism is not useful for
+    # token-by-token decoding and only adds contention
+    import torch
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # can only be set before the first parallel torch call in the process
+        pass
+    print(f"Torch using {torch.get_num_threads()} thread(s)")
+
+def cpu_bf16_supported() -> bool:
+    # bf16 matmuls are only fast with native instructions (AVX512-BF16 or AMX);
+    # elsewhere torch emulates them and is slower than fp32
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+def optimize_for_cpu(model, mode: str = "fp32"):
+    # apply a CPU inference mode to a loaded model and return it (possibly a new module)
+    import torch
+    if mode not in CPU_MODES:
+        raise ValueError(f"Unknown CPU mode '{mode}', expected one of {CPU_MODES}")
+    model.eval()
+
+    if mode == "bf16":
+        if not cpu_bf16_supported():
+            print("CPU has no native bf16 support, keeping fp32")
+            return model
+        return model.to(torch.bfloat16)
+
+    if mode == "int8":
+        # int8 weights with activations quantized on the fly, only for nn.Linear, which
+        # holds nearly all parameters of a decoder-only model
+        quantization = getattr(torch, "ao", torch).quantization
+        return quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    return model
+
+def rss_bytes() -> int:
+    # current resident set size of this process
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
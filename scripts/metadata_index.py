@@ -0,0 +1,128 @@
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+METADATA_META_FILE = "metadata.json"
+
+def date_to_int(date: str, end: bool = False) -> int:
+    # "YYYY-MM-DD" -> YYYYMMDD. partial dates ("2024", "2024-09") expand to the start
+    # of the period, or to its end when end=True. unknown dates map to 0
+    match = re.match(r'^(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?$', (date or "").strip())
+    if not match:
+        return 0
+    year, month, day = match.groups()
+    month = int(month) if month else (12 if end else 1)
+    day = int(day) if day else (31 if end else 1)
+    return int(year) * 10000 + month * 100 + day
+
+class MetadataIndex:
+    # per-row filter structures for the embedding index:
+    # - dates sorted once, so a date range is two binary searches into date_order
+    # - each source (one newspaper issue) as a list of contiguous row ranges,
+    #   which is usually a single range since chunks of a file are written together
+    def __init__(self, sorted_dates: np.ndarray, date_order: np.ndarray, sources: List[str],
+                 range_offsets: np.ndarray, ranges: np.ndarray):
+        self.sorted_dates = sorted_dates
+        self.date_order = date_order
+        self.sources = sources
+        self.source_ids = {source: i for i, source in enumerate(sources)}
+        self.range_offsets = range_offsets
+        self.ranges = ranges
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.date_order)
+
+    @classmethod
+    def build(cls, metadata: Iterable[Dict[str, Any]]) -> "MetadataIndex":
+        dates, row_sources = [], []
+        for meta in metadata:
+            dates.append(date_to_int(meta.get("date", "")))
+            # a deduplicated chunk also stands in for the sources its duplicates came from
+            row_sources.append([meta.get("source") or "unknown"] + list(meta.get("duplicate_sources") or []))
+
+        dates = np.asarray(dates, dtype=np.int32)
+        date_order = np.argsort(dates, kind='stable').astype(np.int64)
+
+        # collapse consecutive rows of the same source into [start, end) ranges
+        sources: List[str] = []
+        source_ids: Dict[str, int] = {}
+        per_source: List[List[List[int]]] = []
+        for row, names in enumerate(row_sources):
+            for source in names:
+                sid = source_ids.get(source)
+                if sid is None:
+                    sid = source_ids[source] = len(sources)
+                    sources.append(source)
+                    per_source.append([])
+                source_ranges = per_source[sid]
+                if source_ranges and source_ranges[-1][1] >= row:
+                    source_ranges[-1][1] = row + 1
+                else:
+                    source_ranges.append([row, row + 1])
+
+        range_offsets = np.zeros(len(sources) + 1, dtype=np.int64)
+        range_offsets[1:] = np.cumsum([len(r) for r in per_source])
+        ranges = np.asarray([r for source_ranges in per_source for r in source_ranges], dtype=np.int64).reshape(-1, 2)
+
+        return cls(dates[date_order], date_order, sources, range_offsets, ranges)
+
+    def rows_for_dates(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> np.ndarray:
+        # chunks with unknown (0) dates never match a date filter
+        lower = max(1, date_to_int(date_from)) if date_from else 1
+        lo = np.searchsorted(self.sorted_dates, lower, side='left')
+        hi = np.searchsorted(self.sorted_dates, date_to_int(date_to, end=True), side='right') if date_to else self.num_rows
+        return np.sort(self.date_order[lo:max(lo, hi)])
+
+    def rows_for_sources(self, sources: Iterable[str]) -> np.ndarray:
+        parts = []
+        for source in sources:
+            sid = self.source_ids.get(source)
+            if sid is None:
+                continue
+            for start, end in self.ranges[self.range_offsets[sid]:self.range_offsets[sid + 1]]:
+                parts.append(np.arange(start, end, dtype=np.int64))
+        return np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+    def candidate_rows(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        # sorted rows matching every given filter, or None when nothing is filtered
+        if not filters:
+            return None
+        date_from, date_to = filters.get("date_from"), filters.get("date_to")
+        sources = filters.get("sources")
+        if isinstance(sources, str):
+            sources = [sources]
+
+        rows = None
+        if date_from or date_to:
+            rows = self.rows_for_dates(date_from, date_to)
+        if sources:
+            source_rows = self.rows_for_sources(sources)
+            rows = source_rows if rows is None else np.intersect1d(rows, source_rows, assume_unique=True)
+        return rows
+
+    def save(self, index_dir: str):
+        np.save(os.path.join(index_dir, "meta_sorted_dates.npy"), self.sorted_dates)
+        np.save(os.path.join(index_dir, "meta_date_order.npy"), self.date_order)
+        np.save(os.path.join(index_dir, "meta_range_offsets.npy"), self.range_offsets)
+        np.save(os.path.join(index_dir, "meta_ranges.npy"), self.ranges)
+        with open(os.path.join(index_dir, METADATA_META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"sources": self.sources}, f)
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["MetadataIndex"]:
+        meta_path = os.path.join(index_dir, METADATA_META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(
+            np.load(os.path.join(index_dir, "meta_sorted_dates.npy")),
+            np.load(os.path.join(index_dir, "meta_date_order.npy")),
+            meta["sources"],
+            np.load(os.path.join(index_dir, "meta_range_offsets.npy")),
+            np.load(os.path.join(index_dir, "meta_ranges.npy")),
+        )
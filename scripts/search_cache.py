@@ -0,0 +1,131 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+
+def normalize_query(query: str) -> str:
+    # case- and whitespace-insensitive form of a query used in cache keys
+    return re.sub(r"\s+", " ", query.strip().lower())
+
+def freeze_options(options: Optional[Dict[str, Any]]) -> str:
+    # stable, hashable representation of search options such as filters
+    return json.dumps(options or {}, sort_keys=True, default=str)
+
+def estimate_bytes(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+class LRUCache:
+    # thread-safe LRU cache with an optional per-entry time-to-live.
+    # entries can be tied to a version (e.g. the embedding index version): the first
+    # lookup with a new version drops everything cached for the old one.
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.version: Optional[str] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.bytes = 0
+
+    def _check_version_locked(self, version: Optional[str]):
+        if version is not None and version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.bytes = 0
+            self.version = version
+
+    def get(self, key: Hashable, version: Optional[str] = None) -> Any:
+        with self._lock:
+            self._check_version_locked(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, stored_at, size = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, version: Optional[str] = None):
+        size = estimate_bytes(value)
+        with self._lock:
+            self._check_version_locked(version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._entries[key] = (value, time.monotonic(), size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def configure(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if ttl_seconds is not None:
+                self.ttl_seconds = ttl_seconds
+            while len(self._entries) > self.max_entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "approx_bytes": self.bytes,
+                "version": self.version,
+            }
+
+# query text -> embedding, keyed by model name (independent of the index version)
+query_embedding_cache = LRUCache(max_entries=4096)
+
+# (query, top_k, options) -> search results, invalidated when the index version changes
+search_result_cache = LRUCache(max_entries=1024, ttl_seconds=3600)
+
+# (tokenizer, row) -> token count of the chunk text, invalidated when the index version changes
+chunk_token_cache = LRUCache(max_entries=65536)
+
+def cache_stats() -> Dict[str, Any]:
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "search_results": search_result_cache.stats(),
+        "chunk_tokens": chunk_token_cache.stats(),
+    }
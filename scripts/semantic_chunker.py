@@ -1,9 +1,10 @@
 import os
 import argparse
 import re
-import json
 import nltk
 from typing import List, Dict, Any
+from bm25_index import build_bm25_index
+from chunk_io import ChunkWriter, chunks_filename, write_chunks
 from nltk.tokenize import sent_tokenize
 from nltk.tokenize import word_tokenize
 
@@ -108,46 +109,45 @@ def process_file(file_path: str, output_dir: str, max_chunk_size: int = 1000) ->
     
     # save chunks to output directory
     os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, f"{metadata['title']}_semantic_chunks.json")
-    
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(chunk_documents, f, indent=2)
+    output_path = os.path.join(output_dir, f"{metadata['title']}_semantic_chunks.jsonl")
+    write_chunks(chunk_documents, output_path)
     
     print(f"Processed {file_path} into {len(chunks)} semantic chunks. Saved to {output_path}")
     return chunk_documents
 
-def process_directory(input_dir: str, output_dir: str, max_chunk_size: int = 1000) -> List[Dict[str, Any]]:
-    # process all text files in a directory
-    all_chunks = []
+def process_directory(input_dir: str, output_dir: str, max_chunk_size: int = 1000,
+                      compression: str = None) -> int:
+    # process all text files in a directory, streaming every file's chunks into one
+    # JSON Lines file (optionally gzip/zstd-compressed) instead of collecting them in memory
     
     # create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
+    all_chunks_path = os.path.join(output_dir, chunks_filename("all_semantic_chunks", compression))
     
     # process each text file in the directory
-    for filename in os.listdir(input_dir):
-        if filename.endswith('.txt'):
-            file_path = os.path.join(input_dir, filename)
-            chunks = process_file(file_path, output_dir, max_chunk_size)
-            all_chunks.extend(chunks)
+    with ChunkWriter(all_chunks_path) as writer:
+        for filename in os.listdir(input_dir):
+            if filename.endswith('.txt'):
+                file_path = os.path.join(input_dir, filename)
+                writer.write_all(process_file(file_path, output_dir, max_chunk_size))
     
-    # save all chunks to a single file
-    if all_chunks:
-        all_chunks_path = os.path.join(output_dir, "all_semantic_chunks.json")
-        with open(all_chunks_path, 'w', encoding='utf-8') as f:
-            json.dump(all_chunks, f, indent=2)
-        print(f"Saved all {len(all_chunks)} semantic chunks to {all_chunks_path}")
+    if writer.count:
+        build_bm25_index(all_chunks_path, os.path.join(output_dir, "bm25"))
+        print(f"Saved all {writer.count} semantic chunks to {all_chunks_path}")
     
-    return all_chunks
+    return writer.count
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Split text files into semantic chunks for RAG system')
     parser.add_argument('--input', '-i', help='Input text file or directory', required=True)
     parser.add_argument('--output', '-o', help='Output directory for chunks', default='chunked_corpus')
     parser.add_argument('--max-chunk-size', '-c', type=int, help='Maximum chunk size in characters', default=1000)
+    parser.add_argument('--compress', choices=['none', 'gzip', 'zstd'], default='none',
+                        help='Compression for the combined all_semantic_chunks.jsonl file')
     args = parser.parse_args()
 
     if os.path.isdir(args.input):
-        process_directory(args.input, args.output, args.max_chunk_size)
+        process_directory(args.input, args.output, args.max_chunk_size, args.compress)
     elif os.path.isfile(args.input):
         process_file(args.input, args.output, args.max_chunk_size)
     else:
@@ -0,0 +1,169 @@
+import argparse
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from index_store import EMBEDDINGS_FILE, load_index
+
+# environment variables that size the BLAS/OpenMP thread pools of a worker
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS")
+
+def select_top_k(scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # per-row top_k (positions, scores) of a 2-d score matrix, best first
+    k = min(top_k, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+def _shard_worker(conn, embeddings_path: str, start: int, end: int):
+    # long-lived worker: maps its slice of the shared embeddings file and answers
+    # (query matrix, top_k) requests with its local top-k rows until it receives None
+    embeddings = np.load(embeddings_path, mmap_mode='r')[start:end]
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        queries, top_k = message
+        try:
+            rows, scores = select_top_k(queries @ embeddings.T, top_k)
+            conn.send((rows + start, scores))
+        except Exception as e:
+            conn.send(e)
+    conn.close()
+
+class ShardedSearcher:
+    # exact search split across N worker processes, one contiguous row range each.
+    # workers memory-map the same embeddings.npy, so the matrix lives once in the
+    # OS page cache no matter how many shards read it
+    def __init__(self, index_dir: str, num_shards: int, threads_per_worker: int = 1):
+        self.index_dir = index_dir
+        self.num_shards = num_shards
+        self.threads_per_worker = threads_per_worker
+        self._workers: List[Tuple[multiprocessing.Process, object]] = []
+        self._lock = threading.Lock()
+
+        embeddings = np.load(os.path.join(index_dir, EMBEDDINGS_FILE), mmap_mode='r')
+        self.num_rows = embeddings.shape[0]
+        self.dim = embeddings.shape[1]
+
+    def start(self) -> "ShardedSearcher":
+        embeddings_path = os.path.join(self.index_dir, EMBEDDINGS_FILE)
+        bounds = np.linspace(0, self.num_rows, self.num_shards + 1).astype(np.int64)
+        context = multiprocessing.get_context("spawn")
+
+        # spawned workers inherit the environment, so their BLAS pools are sized here
+        # instead of competing with the torch threads used by the LLM in this process
+        saved = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+        try:
+            for name in THREAD_ENV_VARS:
+                os.environ[name] = str(self.threads_per_worker)
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                parent_conn, child_conn = context.Pipe()
+                process = context.Process(target=_shard_worker,
+                                          args=(child_conn, embeddings_path, int(start), int(end)),
+                                          daemon=True)
+                process.start()
+                child_conn.close()
+                self._workers.append((process, parent_conn))
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        atexit.register(self.close)
+        print(f"Started {self.num_shards} search shards over {self.num_rows} rows")
+        return self
+
+    def search_many(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # top_k (rows, scores) per query; queries must already be L2-normalized
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+        with self._lock:
+            for _, conn in self._workers:
+                conn.send((queries, top_k))
+            replies = [conn.recv() for _, conn in self._workers]
+
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+
+        # merge the local winners of every shard
+        rows = np.concatenate([r for r, _ in replies], axis=1)
+        scores = np.concatenate([s for _, s in replies], axis=1)
+        top, top_scores = select_top_k(scores, top_k)
+        return np.take_along_axis(rows, top, axis=1), top_scores
+
+    def search(self, query: np.ndarray, top_k: int, **params) -> Tuple[np.ndarray, np.ndarray]:
+        rows, scores = self.search_many(query, top_k)
+        return rows[0], scores[0]
+
+    def close(self):
+        with self._lock:
+            for process, conn in self._workers:
+                try:
+                    conn.send(None)
+                    conn.close()
+                except (OSError, BrokenPipeError):
+                    pass
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            self._workers = []
+
+def benchmark(index_dir: str, shard_counts=(1, 2, 4), num_queries: int = 64, top_k: int = 10,
+              batch_size: int = 1, threads_per_worker: int = 1, repeats: int = 3):
+    # mean latency per query of single-process exact search vs. sharded search
+    index = load_index(index_dir)
+    embeddings = np.asarray(index["embeddings"])
+    rng = np.random.default_rng(0)
+    queries = np.asarray(embeddings[rng.choice(len(embeddings), num_queries)], dtype=np.float32)
+    batches = [queries[i:i + batch_size] for i in range(0, num_queries, batch_size)]
+
+    def timed(fn) -> float:
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for batch in batches:
+                fn(batch)
+            best = min(best, time.perf_counter() - start)
+        return best * 1000 / num_queries
+
+    baseline = timed(lambda batch: select_top_k(batch @ embeddings.T, top_k))
+    print(f"single process: {baseline:.3f} ms/query ({len(embeddings)} rows, batch {batch_size})")
+
+    report = {"single": baseline}
+    for shards in shard_counts:
+        searcher = ShardedSearcher(index_dir, shards, threads_per_worker).start()
+        try:
+            searcher.search_many(batches[0], top_k)  # let the workers fault their pages in
+            elapsed = timed(lambda batch: searcher.search_many(batch, top_k))
+        finally:
+            searcher.close()
+        report[shards] = elapsed
+        print(f"{shards} shards: {elapsed:.3f} ms/query ({baseline / elapsed:.2f}x)")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sharded multi-process search against single-process search')
+    parser.add_argument('--index', default='./chunked_corpus/index', help='Embedding index directory')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4], help='Shard counts to compare')
+    parser.add_argument('--queries', type=int, default=64, help='Number of queries')
+    parser.add_argument('--batch-size', type=int, default=1, help='Queries sent per request')
+    parser.add_argument('--threads', type=int, default=1, help='BLAS threads per worker')
+    parser.add_argument('--top-k', '-k', type=int, default=10)
+    args = parser.parse_args()
+
+    benchmark(args.index, args.shards, args.queries, args.top_k, args.batch_size, args.threads)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 import os
 import argparse
 import re
-import json
 from typing import List, Dict, Any
+from bm25_index import build_bm25_index
+from chunk_io import ChunkWriter, chunks_filename, write_chunks
 
 def read_text_file(file_path: str) -> str:
     # read text content from a file
@@ -80,36 +81,33 @@ def process_file(file_path: str, output_dir: str, chunk_size: int = 1000, overla
     
     # save chunks to output directory
     os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, f"{metadata['title']}_chunks.json")
-    
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(chunk_documents, f, indent=2)
+    output_path = os.path.join(output_dir, f"{metadata['title']}_chunks.jsonl")
+    write_chunks(chunk_documents, output_path)
     
     print(f"Processed {file_path} into {len(chunks)} chunks. Saved to {output_path}")
     return chunk_documents
 
-def process_directory(input_dir: str, output_dir: str, chunk_size: int = 1000, overlap: int = 200) -> List[Dict[str, Any]]:
-    # process all text files in a directory
-    all_chunks = []
+def process_directory(input_dir: str, output_dir: str, chunk_size: int = 1000, overlap: int = 200,
+                      compression: str = None) -> int:
+    # process all text files in a directory, streaming every file's chunks into one
+    # JSON Lines file (optionally gzip/zstd-compressed) instead of collecting them in memory
     
     # create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
+    all_chunks_path = os.path.join(output_dir, chunks_filename("all_chunks", compression))
     
     # process each text file in the directory
-    for filename in os.listdir(input_dir):
-        if filename.endswith('.txt'):
-            file_path = os.path.join(input_dir, filename)
-            chunks = process_file(file_path, output_dir, chunk_size, overlap)
-            all_chunks.extend(chunks)
+    with ChunkWriter(all_chunks_path) as writer:
+        for filename in os.listdir(input_dir):
+            if filename.endswith('.txt'):
+                file_path = os.path.join(input_dir, filename)
+                writer.write_all(process_file(file_path, output_dir, chunk_size, overlap))
     
-    # save all chunks to a single file
-    if all_chunks:
-        all_chunks_path = os.path.join(output_dir, "all_chunks.json")
-        with open(all_chunks_path, 'w', encoding='utf-8') as f:
-            json.dump(all_chunks, f, indent=2)
-        print(f"Saved all {len(all_chunks)} chunks to {all_chunks_path}")
+    if writer.count:
+        build_bm25_index(all_chunks_path, os.path.join(output_dir, "bm25"))
+        print(f"Saved all {writer.count} chunks to {all_chunks_path}")
     
-    return all_chunks
+    return writer.count
 
 
 parser = argparse.ArgumentParser(description='Split text files into chunks for RAG system')
@@ -117,10 +115,12 @@ parser.add_argument('--input', '-i', help='Input text file or directory', requir
 parser.add_argument('--output', '-o', help='Output directory for chunks', default='chunked_corpus')
 parser.add_argument('--chunk-size', '-c', type=int, help='Target chunk size in characters', default=1000)
 parser.add_argument('--overlap', type=int, help='Overlap between chunks in characters', default=200)
+parser.add_argument('--compress', choices=['none', 'gzip', 'zstd'], default='none',
+                    help='Compression for the combined all_chunks.jsonl file')
 args = parser.parse_args()
 
 if os.path.isdir(args.input):
-    process_directory(args.input, args.output, args.chunk_size, args.overlap)
+    process_directory(args.input, args.output, args.chunk_size, args.overlap, args.compress)
 elif os.path.isfile(args.input):
     process_file(args.input, args.output, args.chunk_size, args.overlap)
 else: